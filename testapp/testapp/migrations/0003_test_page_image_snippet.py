@@ -0,0 +1,25 @@
+# Generated by Django 2.0.13 on 2026-10-16 20:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailimages', '0019_delete_filter'),
+        ('testapp', '0002_test_page'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testpage',
+            name='image',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='wagtailimages.Image'),
+        ),
+        migrations.AddField(
+            model_name='testpage',
+            name='snippet',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='testapp.TestSnippet'),
+        ),
+    ]
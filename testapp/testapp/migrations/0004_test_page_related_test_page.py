@@ -0,0 +1,19 @@
+# Generated by Django 2.0.13 on 2026-10-16 20:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testapp', '0003_test_page_image_snippet'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testpage',
+            name='related_test_page',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='testapp.TestPage'),
+        ),
+    ]
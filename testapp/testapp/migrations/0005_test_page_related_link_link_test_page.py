@@ -0,0 +1,19 @@
+# Generated by Django 2.0.13 on 2026-10-16 21:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testapp', '0004_test_page_related_test_page'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testpagerelatedlink',
+            name='link_test_page',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='testapp.TestPage'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.0.13 on 2026-10-16 22:47
+
+from django.db import migrations
+import testapp.models
+import wagtail.core.blocks
+import wagtail.core.fields
+import wagtail.images.blocks
+import wagtail.snippets.blocks
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testapp', '0005_test_page_related_link_link_test_page'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='testpage',
+            name='body',
+            field=wagtail.core.fields.StreamField([('heading', wagtail.core.blocks.CharBlock()), ('paragraph', wagtail.core.blocks.RichTextBlock()), ('page', wagtail.core.blocks.PageChooserBlock()), ('snippet', wagtail.snippets.blocks.SnippetChooserBlock(testapp.models.TestSnippet)), ('image', wagtail.images.blocks.ImageChooserBlock())], blank=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.0.13 on 2026-10-16 23:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testapp', '0006_test_page_image_block'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TestSnippetBase',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TestInheritedSnippet',
+            fields=[
+                ('testsnippetbase_ptr', models.OneToOneField(auto_created=True, on_delete=django.db.models.deletion.CASCADE, parent_link=True, primary_key=True, serialize=False, to='testapp.TestSnippetBase')),
+                ('extra_text', models.CharField(max_length=255)),
+            ],
+            bases=('testapp.testsnippetbase',),
+        ),
+    ]
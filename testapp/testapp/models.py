@@ -1,5 +1,13 @@
 from django.db import models
-from wagtail.admin.edit_handlers import FieldPanel
+from modelcluster.fields import ParentalKey
+from wagtail.admin.edit_handlers import FieldPanel, InlinePanel, PageChooserPanel, StreamFieldPanel
+from wagtail.core import blocks
+from wagtail.core.fields import StreamField
+from wagtail.core.models import Orderable, Page
+from wagtail.images.blocks import ImageChooserBlock
+from wagtail.images.edit_handlers import ImageChooserPanel
+from wagtail.snippets.blocks import SnippetChooserBlock
+from wagtail.snippets.edit_handlers import SnippetChooserPanel
 from wagtail.snippets.models import register_snippet
 
 
@@ -13,4 +21,67 @@ class TestSnippet(models.Model):
     ]
 
     def __str__(self):
-        return self.text
\ No newline at end of file
+        return self.text
+
+
+class TestSnippetBase(models.Model):
+    """A concrete base model of a snippet model for testing purposes."""
+    text = models.CharField(max_length=255)
+
+
+@register_snippet
+class TestInheritedSnippet(TestSnippetBase):
+    """A snippet model with multi-table inheritance for testing purposes."""
+    extra_text = models.CharField(max_length=255)
+
+    panels = [
+        FieldPanel('text'),
+        FieldPanel('extra_text'),
+    ]
+
+    def __str__(self):
+        return self.text
+
+
+class TestPage(Page):
+    """A page model with a StreamField, page, image and snippet links and inline children for testing purposes."""
+    body = StreamField([
+        ('heading', blocks.CharBlock()),
+        ('paragraph', blocks.RichTextBlock()),
+        ('page', blocks.PageChooserBlock()),
+        ('snippet', SnippetChooserBlock(TestSnippet)),
+        ('image', ImageChooserBlock()),
+    ], blank=True)
+    related_page = models.ForeignKey(
+        'wagtailcore.Page', null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    image = models.ForeignKey(
+        'wagtailimages.Image', null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    snippet = models.ForeignKey(
+        TestSnippet, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    related_test_page = models.ForeignKey(
+        'testapp.TestPage', null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+
+    content_panels = Page.content_panels + [
+        StreamFieldPanel('body'),
+        PageChooserPanel('related_page'),
+        PageChooserPanel('related_test_page'),
+        ImageChooserPanel('image'),
+        SnippetChooserPanel('snippet'),
+        InlinePanel('related_links'),
+    ]
+
+
+class TestPageRelatedLink(Orderable):
+    """An inline child model of TestPage for testing purposes."""
+    page = ParentalKey(TestPage, on_delete=models.CASCADE, related_name='related_links')
+    link_page = models.ForeignKey(
+        'wagtailcore.Page', null=True, blank=True, on_delete=models.CASCADE, related_name='+')
+    link_test_page = models.ForeignKey(
+        TestPage, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    title = models.CharField(max_length=255)
+
+    panels = [
+        FieldPanel('title'),
+        PageChooserPanel('link_page'),
+        PageChooserPanel('link_test_page'),
+    ]
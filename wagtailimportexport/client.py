@@ -0,0 +1,212 @@
+import json
+import queue
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.translation import ugettext as _
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from wagtailimportexport.jsonstream import IncompleteJSONError, iter_json_array
+
+
+# the number of page records requested from the export API at a time
+API_PAGE_LIMIT = 500
+
+# the size of spooled page records above which they are written to a temporary file
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+# the HTTP statuses of responses to requests which are worth retrying
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# errors which are raised while waiting for or reading a response, including
+# those of a response which is cut off part way through
+TRANSIENT_ERRORS = (
+    requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ContentDecodingError, IncompleteJSONError,
+)
+
+
+class ExportAPIClient:
+    """
+    A client of the export API endpoint of a source site (views.export)
+    at export_url, which fetches the exported page records a part at a time
+
+    Requests are made over a pooled, keep-alive session, with compressed
+    responses decoded and parsed as they arrive. Requests which fail with
+    a connection error, a timeout or a server error, or whose responses are
+    cut off part way through, are retried up to retries times with
+    exponential backoff.
+
+    source is the source site named by the export (see
+    exporting.get_export_source), once the first part has been received.
+    """
+    def __init__(self, export_url, limit=None, timeout=None, retries=None, backoff_factor=None, session=None):
+        self.export_url = export_url
+        self.limit = limit or getattr(settings, 'WAGTAILIMPORTEXPORT_API_PAGE_LIMIT', API_PAGE_LIMIT)
+        self.timeout = timeout or getattr(settings, 'WAGTAILIMPORTEXPORT_API_TIMEOUT', (10, 60))
+        self.retries = retries if retries is not None else getattr(settings, 'WAGTAILIMPORTEXPORT_API_RETRIES', 5)
+        self.backoff_factor = backoff_factor if backoff_factor is not None else getattr(
+            settings, 'WAGTAILIMPORTEXPORT_API_BACKOFF_FACTOR', 0.5)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        self.source = None
+
+    def iter_records(self):
+        """Generate the page records of the export, requesting each part after the last"""
+        after = None
+        while True:
+            record_count = 0
+            for record in self._iter_part(after):
+                record_count += 1
+                yield record
+            if record_count < self.limit:
+                return
+            after = record['content']['path']
+
+    def prefetch_records(self):
+        """
+        Generate the page records of iter_records, requested by a background
+        thread up to a part ahead of those which have been taken, so that
+        waiting on the network overlaps with importing the records
+        """
+        records = queue.Queue(maxsize=self.limit)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._fetch_records, args=(records, stop), daemon=True)
+        thread.start()
+        try:
+            while True:
+                record = records.get()
+                if record is None:
+                    return
+                if isinstance(record, BaseException):
+                    raise record
+                yield record
+        finally:
+            stop.set()
+
+    def _fetch_records(self, records, stop):
+        try:
+            for record in self.iter_records():
+                if not _put(records, record, stop):
+                    return
+            _put(records, None, stop)
+        except BaseException as e:
+            _put(records, e, stop)
+
+    def _iter_part(self, after):
+        """
+        Generate the page records of the part of the export after the given
+        path, requesting the rest of it, after the path of the last record
+        generated, if it fails part way
+
+        The rest of the part is found by the path rather than by the number
+        of records already generated, so that no records are repeated or
+        missed if the source tree changes in the meantime.
+        """
+        record_count = 0
+        attempt = 0
+        while True:
+            params = {'limit': self.limit - record_count}
+            if after is not None:
+                params['after'] = after
+            try:
+                with self.session.get(self.export_url, params=params, stream=True, timeout=self.timeout) as response:
+                    response.raise_for_status()
+                    values = {}
+                    try:
+                        for record in iter_json_array(
+                                _ChunksFile(response.iter_content(64 * 1024)), 'pages', values=values):
+                            self.source = values.get('source')
+                            record_count += 1
+                            after = record['content']['path']
+                            yield record
+                        self.source = values.get('source')
+                    except KeyError:
+                        raise LookupError(_("No pages were exported by %(url)s") % {'url': self.export_url})
+                    return
+            except TRANSIENT_ERRORS + (requests.HTTPError,) as e:
+                if record_count >= self.limit:
+                    # every record of the part arrived before the failure, so there is nothing
+                    # left of it to request; the next part follows the last record as usual
+                    return
+                if attempt >= self.retries or (
+                        isinstance(e, requests.HTTPError) and e.response.status_code not in RETRY_STATUSES):
+                    raise
+            time.sleep(self.backoff_factor * (2 ** attempt))
+            attempt += 1
+
+
+class SpooledRecords:
+    """
+    The records of an iterable which can only be iterated once, such as
+    ExportAPIClient.prefetch_records(), as an iterable which can be
+    iterated again: the records are spooled as JSON lines to a temporary
+    file, in memory up to max_size bytes, as they are first iterated
+    """
+    def __init__(self, records, max_size=SPOOL_MAX_SIZE):
+        self.records = records
+        self.spool = tempfile.SpooledTemporaryFile(max_size=max_size)
+        self.spooled = False
+
+    def __iter__(self):
+        if self.records is not None:
+            records, self.records = self.records, None
+            return self._iter_spooling(records)
+        if not self.spooled:
+            raise RuntimeError("The records were not iterated to the end the first time")
+        self.spool.seek(0)
+        return (json.loads(line.decode('utf-8')) for line in self.spool)
+
+    def _iter_spooling(self, records):
+        for record in records:
+            self.spool.write(json.dumps(record, cls=DjangoJSONEncoder).encode('utf-8') + b'\n')
+            yield record
+        self.spooled = True
+
+    def close(self):
+        self.spool.close()
+
+
+class _ChunksFile:
+    """
+    A file-like reader of the bytes of an iterator of chunks, which reads
+    as many chunks as it takes to return size bytes, or all of them if
+    size is negative, unless they run out first
+    """
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = bytearray()
+
+    def read(self, size=-1):
+        if size is None:
+            size = -1
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        if size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+def _put(records, item, stop):
+    """Put item on the records queue unless stop is set first, returning whether it was put"""
+    while not stop.is_set():
+        try:
+            records.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
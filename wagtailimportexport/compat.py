@@ -14,3 +14,31 @@ except ImportError:  # fallback for Wagtail <2.0
     from wagtail.wagtailcore.models import Page
 
     WAGTAIL_VERSION_2_OR_GREATER = False
+
+
+def bulk_update(queryset, objs, fields, batch_size=None):
+    """
+    Update the given fields of objs, saved instances of queryset's model,
+    with QuerySet.bulk_update, or on Django < 2.2, which lacks it, with the
+    same UPDATE ... CASE WHEN statement per batch that it would make
+    """
+    if hasattr(queryset, 'bulk_update'):
+        return queryset.bulk_update(objs, fields, batch_size=batch_size)
+
+    from django.db import connections
+    from django.db.models import Case, Value, When
+
+    objs = list(objs)
+    if not objs:
+        return
+    fields = [queryset.model._meta.get_field(name) for name in fields]
+    max_batch_size = connections[queryset.db].ops.bulk_batch_size(['pk', 'pk'] + fields, objs)
+    batch_size = min(batch_size, max_batch_size) if batch_size else max_batch_size
+    for offset in range(0, len(objs), batch_size):
+        batch = objs[offset:offset + batch_size]
+        queryset.filter(pk__in=[obj.pk for obj in batch]).update(**{
+            field.attname: Case(*[
+                When(pk=obj.pk, then=Value(getattr(obj, field.attname), output_field=field)) for obj in batch
+            ], output_field=field)
+            for field in fields
+        })
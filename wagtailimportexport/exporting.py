@@ -1,19 +1,92 @@
-import json, os, argparse
-from zipfile import ZipFile
-from tempfile import TemporaryDirectory
+import hashlib, io, json, multiprocessing, os, sys, threading, time, zlib
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from zipfile import ZIP_BZIP2, ZIP_DEFLATED, ZIP_LZMA, ZIP_STORED, ZipFile, ZipInfo
 
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.core.files import File
 from django.core.files.storage import get_storage_class
 from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, models
+from django.db.models import Exists, Max, OuterRef, Q
+from django.db.models.functions import Substr
 from django.db.models.base import ModelState
 from django.db.models.fields.files import FieldFile
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from modelcluster.models import get_all_child_m2m_relations, get_all_child_relations
 from wagtail.core.blocks import StreamValue
 from wagtail.images import get_image_model
 from wagtail.snippets.models import SNIPPET_MODELS
+from wagtail.core.models import Site
 from wagtailimportexport.compat import Page
+from wagtailimportexport.jsonstream import iter_json
+from wagtailimportexport.workers import setup_export_worker
 
+try:
+    import zstandard
+except ImportError:  # zstd encoding is optional
+    zstandard = None
 
-def export_pages(root_page=None, export_unpublished=False, null_users=False):
+
+# the number of pages read from the database at a time when exporting
+EXPORT_CHUNK_SIZE = 500
+
+# whether process pools take the start method and initializer of the workers of parallel
+# exports, which they do from Python 3.7
+PROCESS_POOL_SUPPORTED = sys.version_info >= (3, 7)
+
+# the number of bytes copied from storage at a time when writing export archives
+ZIP_CHUNK_SIZE = 64 * 1024
+
+# zipfile compression methods by the names used in settings and options
+COMPRESSION_METHODS = {
+    'store': ZIP_STORED,
+    'deflate': ZIP_DEFLATED,
+    'bzip2': ZIP_BZIP2,
+    'lzma': ZIP_LZMA,
+}
+
+# the extensions of already compressed files, which are stored without compression
+STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.avif', '.heic')
+
+# the content encodings of JSON responses, in order of preference
+CONTENT_ENCODINGS = ('zstd', 'gzip') if zstandard is not None else ('gzip',)
+
+
+def get_export_source():
+    """
+    Return the identifier of this site as the source of exports, by which
+    upsert imports recognise the pages they have imported from it before:
+    the WAGTAILIMPORTEXPORT_SOURCE setting, or the root url of the default
+    site
+    """
+    source = getattr(settings, 'WAGTAILIMPORTEXPORT_SOURCE', None)
+    if source is None:
+        site = Site.objects.filter(is_default_site=True).first()
+        source = site.root_url if site is not None else ''
+    return source
+
+
+def parse_timestamp(value):
+    """
+    Parse an ISO 8601 timestamp, such as the since of a delta export, in
+    the current time zone unless it has one, raising ValueError if it
+    isn't one
+    """
+    timestamp = parse_datetime(value)
+    if timestamp is None:
+        raise ValueError("%r is not an ISO 8601 timestamp" % value)
+    if settings.USE_TZ and timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp)
+    elif not settings.USE_TZ and timezone.is_aware(timestamp):
+        timestamp = timezone.make_naive(timestamp)
+    return timestamp
+
+
+def export_pages(root_page=None, export_unpublished=False, null_users=False, since=None, processes=None):
     """
     Create a JSON-able dict definition of part of a site's page tree 
     starting from root_page and descending into its descendants
@@ -27,55 +100,378 @@ def export_pages(root_page=None, export_unpublished=False, null_users=False):
 
     If export_unpublished=True the root_page and all its descendants
     are included.
+
+    If since is given only the pages published or revised since then are
+    included, along with their ancestors.
+
+    If processes is greater than 1 the pages are serialized by a pool of
+    that many worker processes (see iter_export_pages).
+    """
+    return list(iter_export_pages(
+        root_page=root_page,
+        export_unpublished=export_unpublished,
+        null_users=null_users,
+        since=since,
+        processes=processes,
+    ))
+
+
+def iter_export_pages(root_page=None, export_unpublished=False, null_users=False,
+                      chunk_size=EXPORT_CHUNK_SIZE, after=None, limit=None, since=None, processes=None):
+    """
+    Generate the page records of export_pages one at a time
+
+    The page tree is read from the database in chunks of chunk_size pages
+    and only the paths of the exported pages are kept between chunks, so
+    memory use does not grow with the size of the exported subtree.
+
+    The records can be generated a part at a time: after is the path of
+    the last page of the previous part, whose records start from the
+    following page, and limit the greatest number of records in a part.
+
+    If since is given only the pages which have been published or revised
+    since then are exported, along with their ancestors, so that the
+    destination site can place them in the tree.
+
+    If processes is greater than 1, the chunks of pages are serialized by a
+    pool of that many worker processes, each with its own database
+    connection, and the records are generated in the same order as they
+    would be otherwise. The pages to export are still worked out, and
+    pruned, by this process, from their paths alone. Before Python 3.7,
+    whose process pools can't start their workers as they need, the pages
+    are serialized by this process instead.
     """
     if root_page is None:
         root_page = Page.objects.filter(url_path='/').first()
+    pages = get_export_queryset(root_page, export_unpublished, since)
+    page_chunks = _iter_page_chunks(pages, root_page, chunk_size, after, limit)
+    if processes is not None and processes > 1 and PROCESS_POOL_SUPPORTED:
+        yield from _iter_parallel_records(page_chunks, null_users, processes)
+        return
+
+    prefetches = {}
+    for page_keys in page_chunks:
+        yield from export_page_chunk(page_keys, null_users, prefetches)
+
+
+def get_export_queryset(root_page, export_unpublished=False, since=None):
+    """
+    Return the base pages of the subtree rooted at root_page to export, in
+    path order
+
+    Unless export_unpublished=True, unpublished pages and their descendants
+    are left out by the query itself, so that pruned subtrees are never
+    fetched at all. If since is given, only the pages published or revised
+    since then are included, along with their ancestors.
+    """
     pages = Page.objects.descendant_of(
-        root_page, inclusive=True).order_by('path').specific()
+        root_page, inclusive=True).order_by('path')
     if not export_unpublished:
         pages = pages.filter(live=True)
+        max_depth = pages.aggregate(max_depth=Max('depth'))['max_depth']
+        if max_depth is not None and max_depth > root_page.depth + 1:
+            # an unpublished page below root_page whose path is a prefix of the
+            # page's path, matched on the path of each depth in between so that
+            # every comparison can use the index on path
+            # (the prefixes are annotated on the outer query, as Django < 2.1
+            # can't resolve an OuterRef within a function, and the Exists is
+            # filtered on as an annotation, as Django < 3.0 can't filter on it directly)
+            ancestor_paths = Q()
+            for depth in range(root_page.depth + 1, max_depth):
+                annotation = 'ancestor_path_%d' % depth
+                pages = pages.annotate(**{annotation: Substr('path', 1, depth * Page.steplen)})
+                ancestor_paths |= Q(path=OuterRef(annotation))
+            unpublished_ancestors = Page.objects.filter(ancestor_paths, live=False)
+            pages = pages.annotate(
+                has_unpublished_ancestor=Exists(unpublished_ancestors)).filter(has_unpublished_ancestor=False)
+    if since is not None:
+        changed = Q(last_published_at__gt=since) | Q(latest_revision_created_at__gt=since)
+        changed_pages = pages.filter(changed)
+        max_depth = changed_pages.aggregate(max_depth=Max('depth'))['max_depth']
+        if max_depth is not None:
+            # the ancestors of the changed pages are the prefixes of their paths, matched at
+            # each depth in between with a subquery, rather than with a list of the paths,
+            # so that the query's parameters don't grow with the number of changed pages
+            for depth in range(root_page.depth, max_depth):
+                changed |= Q(path__in=changed_pages.filter(depth__gt=depth).annotate(
+                    changed_ancestor_path=Substr('path', 1, depth * Page.steplen)).values('changed_ancestor_path'))
+        pages = pages.filter(changed)
+    return pages
+
+
+def _iter_page_chunks(pages, root_page, chunk_size, after=None, limit=None):
+    """
+    Generate the (id, content type id) pairs of the pages to export, in
+    chunks of up to chunk_size pages in path order, pruning those whose
+    parents are not exported
 
-    page_data = []
+    The subtrees of unpublished pages below the root page are left out of
+    pages by get_export_queryset already, so only the children of an
+    unpublished root page are ever pruned here.
+    """
     exported_paths = set()
-    for (i, page) in enumerate(pages):
-        parent_path = page.path[:-(Page.steplen)]
-        # skip over pages whose parents haven't already been exported
-        # (which means that export_unpublished is false and the parent was unpublished)
-        if i == 0 or (parent_path in exported_paths):
-            data = json.loads(page.to_json())
-            if null_users == True and data.get('owner') is not None:
-                data['owner'] = None
-            page_data.append({
-                'content': data,
-                'model': page.content_type.model,
-                'app_label': page.content_type.app_label,
-            })
-
-            exported_paths.add(page.path)
-    return page_data
-
-
-def export_snippets():
+    if after is not None:
+        # any pages before after whose children follow it are its ancestors,
+        # so those of its ancestors which were exported are all that's needed
+        # to prune the rest of the tree
+        ancestor_paths = [
+            after[:length] for length in range(len(root_page.path), len(after) + 1, Page.steplen)]
+        live_paths = set(pages.filter(path__in=ancestor_paths).values_list('path', flat=True))
+        for path in ancestor_paths:
+            if path not in live_paths:
+                break
+            exported_paths.add(path)
+        pages = pages.filter(path__gt=after)
+
+    page_count = 0
+    rows = pages.values_list('pk', 'path', 'content_type_id').iterator(chunk_size=chunk_size)
+    for chunk in _iter_chunks(rows, chunk_size):
+        # prune on the paths of the pages, so that pruned pages are never
+        # fetched as their specific page models
+        page_keys = []
+        for (page_id, path, content_type_id) in chunk:
+            parent_path = path[:-(Page.steplen)]
+            # skip over pages whose parents haven't already been exported
+            # (which means that export_unpublished is false and the parent was unpublished)
+            if (after is None and not exported_paths) or (parent_path in exported_paths):
+                page_keys.append((page_id, content_type_id))
+                exported_paths.add(path)
+                page_count += 1
+                if page_count == limit:
+                    break
+        if page_keys:
+            yield page_keys
+        if page_count == limit:
+            return
+
+
+def export_page_chunk(page_keys, null_users=False, prefetches=None):
+    """
+    Return the page records of a chunk of pages, given as (id, content type
+    id) pairs in path order
+    """
+    if prefetches is None:
+        prefetches = {}
+    records = []
+    for page in get_specific_pages(page_keys, prefetches):
+        data = page_to_data(page)
+        if null_users == True and data.get('owner') is not None:
+            data['owner'] = None
+        content_type = ContentType.objects.get_for_id(page.content_type_id)
+        records.append({
+            'content': data,
+            'model': content_type.model,
+            'app_label': content_type.app_label,
+        })
+    return records
+
+
+def _iter_parallel_records(page_chunks, null_users, processes):
+    """
+    Generate the records of page_chunks, serialized by a pool of worker
+    processes, in order, with up to two chunks per process in progress
+    """
+    # the workers are started afresh, rather than forked, so that they never share this process's
+    # connections, and set up Django before they load any models
+    database_names = {alias: connections[alias].settings_dict['NAME'] for alias in connections}
+    with ProcessPoolExecutor(
+            max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+            initializer=setup_export_worker, initargs=(database_names,)) as executor:
+        pending = deque()
+        try:
+            for page_keys in page_chunks:
+                pending.append(executor.submit(export_page_chunk, page_keys, null_users))
+                while len(pending) >= 2 * processes:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def get_specific_pages(page_keys, prefetches):
+    """
+    Return the specific pages of page_keys, (id, content type id) pairs,
+    in the same order
+
+    The pages of each model are fetched with one query, and their inline
+    child objects with one query per child relation (see
+    get_export_prefetches), rather than one query per page. prefetches
+    caches the prefetch lookups of each model between calls.
+    """
+    ids_by_content_type = defaultdict(list)
+    for (page_id, content_type_id) in page_keys:
+        ids_by_content_type[content_type_id].append(page_id)
+
+    pages_by_id = {}
+    for (content_type_id, ids) in ids_by_content_type.items():
+        # pages whose model no longer exists are exported as base pages
+        model = ContentType.objects.get_for_id(content_type_id).model_class() or Page
+        if model not in prefetches:
+            prefetches[model] = get_export_prefetches(model)
+        pages_by_id.update(
+            (page.pk, page) for page in model._default_manager.filter(pk__in=ids).prefetch_related(*prefetches[model]))
+    return [pages_by_id[page_id] for (page_id, content_type_id) in page_keys if page_id in pages_by_id]
+
+
+def get_export_prefetches(model, prefix=''):
+    """
+    Return the prefetch_related lookups of the child relations and
+    serialized many-to-many relations of model and, recursively, of its
+    child models, which are included in the model's serializable_data
+    """
+    lookups = []
+    for rel in get_all_child_relations(model):
+        lookup = prefix + rel.get_accessor_name()
+        lookups.append(lookup)
+        if hasattr(rel.related_model, 'serializable_data'):
+            lookups.extend(get_export_prefetches(rel.related_model, lookup + '__'))
+    for field in get_all_child_m2m_relations(model):
+        if field.serialize:
+            lookups.append(prefix + field.name)
+    return lookups
+
+
+def page_to_data(page):
+    """
+    Create JSON-able data from a specific page instance, including its
+    inline child objects
+
+    This is the data of page.to_json() without the round trip through a
+    JSON string; values such as dates are left for the final JSON encoding
+    with DjangoJSONEncoder, which gives the same output as to_json().
+    """
+    return page.serializable_data()
+
+
+def _iter_chunks(iterable, chunk_size):
+    """Group the items of iterable into lists of up to chunk_size items"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def export_snippets(models=None, references=None):
     """
     Create and return a JSON-able dict of the instance's snippets
+
+    The snippets of each model are a generator of records, which reads the
+    rows from the database chunk_size at a time as it is iterated, so a
+    streamed export such as iter_zip_content never holds them all in memory.
+
+    models is a list of the snippet models to export, by default all of
+    them. If references is a references.ExportReferences, only the snippets
+    it has collected from the exported pages are exported, so the pages
+    must be exported first, as they are by iter_zip_content.
     """
     snippet_data = {}
     for Model in SNIPPET_MODELS:
+        if models is not None and Model not in models:
+            continue
         module_name = Model.__module__.split('.')[0]
         model_key = '.'.join([module_name, Model.__name__])  # for django.apps.apps.get_model(...)
-        snippets = Model.objects.all()
-        snippet_data[model_key] = [instance_to_data(snippet) for snippet in snippets]
+        if references is None:
+            snippet_data[model_key] = iter_model_data(Model.objects.all())
+        else:
+            snippet_data[model_key] = _iter_referenced_data(Model, references)
     return snippet_data
 
 
-def export_image_data(null_users=False):
+def _iter_referenced_data(model, references, null_users=False, chunk_size=EXPORT_CHUNK_SIZE):
+    """Generate the data of the instances of model collected by references, chunk_size at a time"""
+    ids = sorted(references.get_ids(model))
+    for offset in range(0, len(ids), chunk_size):
+        yield from iter_model_data(
+            model.objects.filter(pk__in=ids[offset:offset + chunk_size]).order_by('pk'),
+            null_users=null_users, chunk_size=chunk_size)
+
+
+def export_image_data(null_users=False, content_addressed=False, chunk_size=EXPORT_CHUNK_SIZE, references=None):
     """
-    Create and return a JSON-able dict of the instance's images
+    Generate the JSON-able records of the instance's images, reading them
+    from the database chunk_size at a time
+
+    If content_addressed=True the file of each image record includes the
+    SHA-1 hash of its content, by which export archives store each distinct
+    file once and imports find the images that already exist. This is
+    Wagtail's file_hash of the row, or for images which don't have one yet
+    is worked out from the stored file, without being saved; running the
+    imagehashes command beforehand saves them all once.
+
+    If references is a references.ExportReferences, only the images it has
+    collected from the exported pages are exported, as by export_snippets.
     """
     ImageModel = get_image_model()
-    images = ImageModel.objects.all()
-    image_data = [instance_to_data(image, null_users=null_users) for image in images]
-    return image_data
+    file_field = ImageModel._meta.get_field('file')
+    if references is None:
+        image_data = iter_model_data(ImageModel.objects.all(), null_users=null_users, chunk_size=chunk_size)
+    else:
+        image_data = _iter_referenced_data(ImageModel, references, null_users=null_users, chunk_size=chunk_size)
+    for data in image_data:
+        if content_addressed:
+            if not data['file_hash']:
+                with file_field.storage.open(data['file']['name'], 'rb') as f:
+                    data['file_hash'] = hash_file(f)
+            data['file']['hash'] = data['file_hash']
+        yield data
+
+
+def iter_model_data(queryset, null_users=False, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Generate JSON-able data, as from instance_to_data, for the rows of
+    queryset, which are read chunk_size at a time as field values rather
+    than model instances
+
+    The sizes of files are taken from the rows, where the model records
+    them in a <file field>_size field as Wagtail's images do, so that
+    storage is only asked for the sizes which the rows don't have.
+    """
+    model = queryset.model
+    file_fields = {
+        field.attname: field for field in model._meta.concrete_fields if isinstance(field, models.FileField)}
+    field_attnames = {field.attname for field in model._meta.concrete_fields}
+    size_attnames = {
+        attname: attname + '_size' for attname in file_fields if attname + '_size' in field_attnames}
+    for values in queryset.values().iterator(chunk_size=chunk_size):
+        data = {}
+        for key, value in values.items():
+            if null_users == True and ('user_id' in key or 'owner' in key):
+                data[key] = None
+            elif isinstance(value, StreamValue):
+                data[key] = json.dumps(value.stream_data, cls=DjangoJSONEncoder)
+            elif key in file_fields:
+                size = values[size_attnames[key]] if key in size_attnames else None
+                if size is None and value:
+                    size = file_fields[key].storage.size(value)
+                data[key] = {'name': value, 'size': size}
+            else:
+                data[key] = value
+        yield data
+
+
+def hash_file(f):
+    """Return the SHA-1 hash of the content of a binary file, as Wagtail hashes image files, read in chunks"""
+    sha1 = hashlib.sha1()
+    for chunk in iter(lambda: f.read(64 * 1024), b''):
+        sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def get_image_member_name(file_data):
+    """
+    Return the name of the archive member holding an image file, given the
+    file of its image record: its storage name, or images/<hash><extension>
+    for content addressed records
+    """
+    if file_data.get('hash'):
+        return 'images/%s%s' % (file_data['hash'], os.path.splitext(file_data['name'])[1].lower())
+    return file_data['name']
 
 
 def instance_to_data(instance, null_users=False):
@@ -95,21 +491,263 @@ def instance_to_data(instance, null_users=False):
     return data
 
 
-def zip_content(content_data):
+def zip_content(content_data, compact=False, compression=None, known_hashes=()):
     """
     Create and return a ZIP file containing the instance's content data and images
     """
+    return b''.join(iter_zip_content(
+        content_data, compact=compact, compression=compression, known_hashes=known_hashes))
+
+
+def iter_zip_content(content_data, compact=False, compression=None, chunk_size=ZIP_CHUNK_SIZE, known_hashes=()):
+    """
+    Generate a ZIP file containing the instance's content data and images
+    as a sequence of bytes, e.g. for a StreamingHttpResponse
+
+    The pages, snippets and images of content_data may be generators, such
+    as iter_export_pages(); content.json is encoded one record at a time,
+    indented unless compact=True. Images are copied from storage in chunks
+    of chunk_size bytes and each chunk is passed on as soon as it has been
+    written to the archive, so neither the archive nor any image file is
+    held in memory as a whole.
+
+    See get_compress_type for the compression of the archive's members.
+
+    The files of content addressed image records (see export_image_data)
+    are stored once per hash, under get_image_member_name, and not at all
+    if their hashes are in known_hashes, such as a manifest of the images
+    a destination site already has (see the imagehashes command): the
+    records refer to those files by their hashes only.
+    """
+    stream = _ZipStream()
+    with ZipFile(stream, 'w') as zf:
+        for _ in _write_zip_content(zf, content_data, compact, compression, chunk_size, known_hashes):
+            data = stream.pop()
+            if data:
+                yield data
+    # closing the archive writes its central directory
+    yield stream.pop()
+
+
+def write_zip_content(content_data, fileobj, compact=False, compression=None, chunk_size=ZIP_CHUNK_SIZE,
+                      known_hashes=()):
+    """
+    Write a ZIP file containing the instance's content data and images to
+    fileobj, copying images from storage in chunks of chunk_size bytes
+    """
+    with ZipFile(fileobj, 'w') as zf:
+        for _ in _write_zip_content(zf, content_data, compact, compression, chunk_size, known_hashes):
+            pass
+
+
+def _write_zip_content(zf, content_data, compact, compression, chunk_size, known_hashes):
+    """
+    Write the content data and images to the ZipFile zf, yielding after
+    each write so that the caller can pass on the output written so far
+    """
     file_storage = get_storage_class()()
-    with TemporaryDirectory() as tempdir:
-        zfname = os.path.join(tempdir, 'content.zip')
-        with ZipFile(zfname, 'w') as zf:
-            zf.writestr(
-                'content.json',
-                json.dumps(content_data, indent=2, cls=DjangoJSONEncoder))
-            for image_def in content_data['images']:
-                filename = image_def['file']['name']
+
+    # the image records may be a generator, so note the image files to copy
+    # as the records are written to content.json
+    image_files = []
+    member_names = {}
+    content_data = dict(
+        content_data, images=_note_image_files(content_data['images'], image_files, member_names, known_hashes))
+    content_json = iter_json(content_data, indent=None if compact else 2)
+    # content.json is written before its size is known, so allow for a large one
+    zinfo = _zip_info('content.json', compression)
+    with zf.open(zinfo, 'w', force_zip64=True) as zf_file:
+        for text in _join_chunks(content_json, chunk_size):
+            zf_file.write(text.encode('utf-8'))
+            yield
+
+    concurrency = getattr(settings, 'WAGTAILIMPORTEXPORT_EXPORT_IMAGE_CONCURRENCY', 4)
+    prefetch_bytes = getattr(settings, 'WAGTAILIMPORTEXPORT_EXPORT_IMAGE_PREFETCH_BYTES', 64 * 1024 * 1024)
+    for (filename, size, data) in _iter_image_file_data(image_files, concurrency, prefetch_bytes):
+        zinfo = _zip_info(member_names[filename], compression)
+        zinfo.file_size = size
+        with zf.open(zinfo, 'w') as zf_file:
+            if data is None:
                 with file_storage.open(filename, 'rb') as f:
-                    zf.writestr(filename, f.read())
-        with open(zfname, 'rb') as zf:
-            fd = zf.read()
-    return fd
+                    for chunk in iter(partial(f.read, chunk_size), b''):
+                        zf_file.write(chunk)
+                        yield
+            else:
+                data = memoryview(data)
+                for offset in range(0, len(data), chunk_size):
+                    zf_file.write(data[offset:offset + chunk_size])
+                    yield
+
+
+def iter_json_content(content_data, content_encoding=None, chunk_size=ZIP_CHUNK_SIZE):
+    """
+    Generate the compact JSON text of content_data as bytes, in chunks of
+    about chunk_size bytes before compression, encoded with one of
+    CONTENT_ENCODINGS or left as it is if content_encoding is None
+    """
+    chunks = (text.encode('utf-8') for text in _join_chunks(iter_json(content_data), chunk_size))
+    if content_encoding is None:
+        yield from chunks
+        return
+    if content_encoding == 'gzip':
+        compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    elif content_encoding == 'zstd' and zstandard is not None:
+        compressor = zstandard.ZstdCompressor().compressobj()
+    else:
+        raise ValueError("Unknown content encoding %r" % content_encoding)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def get_compress_type(filename, compression=None):
+    """
+    Return the zipfile compression method for the archive member filename
+
+    compression is the name of one of COMPRESSION_METHODS, by default the
+    WAGTAILIMPORTEXPORT_EXPORT_COMPRESSION setting ('deflate'). Files whose
+    extensions are in WAGTAILIMPORTEXPORT_EXPORT_STORED_EXTENSIONS, such as
+    JPEG and PNG images which are already compressed, are always stored
+    as they are.
+    """
+    if compression is None:
+        compression = getattr(settings, 'WAGTAILIMPORTEXPORT_EXPORT_COMPRESSION', 'deflate')
+    try:
+        compress_type = COMPRESSION_METHODS[compression]
+    except KeyError:
+        raise ValueError("Unknown export compression %r, expected one of %s" % (
+            compression, ', '.join(COMPRESSION_METHODS)))
+
+    stored_extensions = getattr(
+        settings, 'WAGTAILIMPORTEXPORT_EXPORT_STORED_EXTENSIONS', STORED_EXTENSIONS)
+    if os.path.splitext(filename)[1].lower() in stored_extensions:
+        return ZIP_STORED
+    return compress_type
+
+
+def _zip_info(filename, compression):
+    """Create the ZipInfo of a new archive member, as ZipFile.open(filename, 'w') would"""
+    zinfo = ZipInfo(filename, date_time=time.localtime(time.time())[:6])
+    zinfo.compress_type = get_compress_type(filename, compression)
+    zinfo.external_attr = 0o600 << 16
+    return zinfo
+
+
+def _iter_image_file_data(image_files, concurrency, prefetch_bytes):
+    """
+    Generate (filename, size, data) for each of the (filename, size) pairs
+    of image_files, in order
+
+    Up to concurrency files are read from storage at the same time by a
+    pool of threads, as long as the files read ahead of the one being
+    written take up no more than prefetch_bytes in total. The data of files
+    which are not read ahead, such as those larger than prefetch_bytes, is
+    None and is left to be copied from storage by the caller.
+    """
+    if concurrency <= 1:
+        for (filename, size) in image_files:
+            yield (filename, size, None)
+        return
+
+    local = threading.local()
+
+    def read_file(filename):
+        if not hasattr(local, 'file_storage'):
+            local.file_storage = get_storage_class()()
+        with local.file_storage.open(filename, 'rb') as f:
+            return f.read()
+
+    image_files = iter(image_files)
+    next_file = next(image_files, None)
+    pending = deque()
+    pending_bytes = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        try:
+            while True:
+                while next_file is not None and len(pending) < 2 * concurrency:
+                    (filename, size) = next_file
+                    if size > prefetch_bytes:
+                        future = None
+                    elif pending and pending_bytes + size > prefetch_bytes:
+                        break
+                    else:
+                        future = executor.submit(read_file, filename)
+                        pending_bytes += size
+                    pending.append((filename, size, future))
+                    next_file = next(image_files, None)
+                if not pending:
+                    break
+
+                (filename, size, future) = pending.popleft()
+                if future is None:
+                    yield (filename, size, None)
+                else:
+                    yield (filename, size, future.result())
+                    # the data has been written by now, so it no longer counts against the budget
+                    pending_bytes -= size
+        finally:
+            for (filename, size, future) in pending:
+                if future is not None:
+                    future.cancel()
+
+
+def _note_image_files(image_data, image_files, member_names, known_hashes=()):
+    """
+    Pass on the image records of image_data, appending the name and size of
+    each file to image_files and mapping its name to its archive member's
+    in member_names, except for files with known hashes or whose member
+    has been noted already
+    """
+    noted = set()
+    for image_def in image_data:
+        file_data = image_def['file']
+        member_name = get_image_member_name(file_data)
+        if file_data.get('hash') not in known_hashes and member_name not in noted:
+            noted.add(member_name)
+            image_files.append((file_data['name'], file_data['size']))
+            member_names[file_data['name']] = member_name
+        yield image_def
+
+
+def _join_chunks(texts, chunk_size):
+    """Join the strings of texts into strings of at least chunk_size characters"""
+    chunk = []
+    length = 0
+    for text in texts:
+        chunk.append(text)
+        length += len(text)
+        if length >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+            length = 0
+    if chunk:
+        yield ''.join(chunk)
+
+
+class _ZipStream(io.RawIOBase):
+    """
+    A write-only, unseekable file object that collects the output of a
+    ZipFile until it is popped
+    """
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
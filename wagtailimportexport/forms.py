@@ -1,5 +1,6 @@
 from django import forms
 from django.utils.translation import ugettext as _
+from wagtail.snippets.models import get_snippet_models
 
 from wagtailimportexport.compat import AdminPageChooser, Page, WAGTAIL_VERSION_2_OR_GREATER
 
@@ -24,6 +25,12 @@ class ImportFromAPIForm(forms.Form):
         label=_("Destination parent page"),
         help_text=_("Imported pages will be created as children of this page.")
     )
+    update_existing = forms.BooleanField(
+        required=False,
+        label=_("Update existing pages"),
+        help_text=_("If True, pages which already exist under the destination parent page, with the same slugs, "
+                    "will be updated rather than imported again"),
+    )
 
 
 class ImportFromFileForm(forms.Form):
@@ -34,6 +41,12 @@ class ImportFromFileForm(forms.Form):
         label=_("Destination parent page"),
         help_text=_("Imported pages will be created as children of this page.")
     )
+    update_existing = forms.BooleanField(
+        required=False,
+        label=_("Update existing pages"),
+        help_text=_("If True, pages which already exist under the destination parent page, with the same slugs, "
+                    "will be updated rather than imported again"),
+    )
 
 
 class ExportForm(forms.Form):
@@ -51,3 +64,26 @@ class ExportForm(forms.Form):
         required=False,
         help_text=_("If True, user fields (owner in pages, *user_id in images) will be nulled"),
     )
+    snippets = forms.ChoiceField(
+        choices=[
+            ('all', _("All snippets")),
+            ('referenced', _("Only snippets referenced by the exported pages")),
+        ],
+        initial='all',
+        help_text=_("Which snippets of the selected snippet models will be exported"),
+    )
+    snippet_models = forms.MultipleChoiceField(
+        choices=(),
+        required=False,
+        widget=forms.CheckboxSelectMultiple,
+        help_text=_("The snippet models to export; if none are selected, all snippet models will be exported"),
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['snippet_models'].choices = [
+            (model._meta.label, model._meta.verbose_name_plural) for model in get_snippet_models()]
+
+    def clean_snippet_models(self):
+        snippet_models = {model._meta.label: model for model in get_snippet_models()}
+        return [snippet_models[label] for label in self.cleaned_data['snippet_models']] or None
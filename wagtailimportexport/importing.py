@@ -1,89 +1,1169 @@
+import hashlib
+import json
+import os
+from collections import Counter, defaultdict
+from functools import partial
+from itertools import islice
+from zipfile import ZipFile
+
 from django.apps import apps
 from django.contrib.contenttypes.models import ContentType
-from django.db import models, transaction
-from modelcluster.models import get_all_child_relations
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, models, router, transaction
+from django.db.models import F
+from django.utils.functional import cached_property
+from django.utils.translation import ugettext as _
+from modelcluster.fields import ParentalKey
+from modelcluster.models import get_all_child_m2m_relations, get_all_child_relations
+from wagtail.core.models import Collection
+from wagtail.images import get_image_model
+
+from wagtailimportexport.compat import Page, bulk_update
+from wagtailimportexport.exporting import get_image_member_name, hash_file
+from wagtailimportexport.jsonstream import JSONArrayReader, iter_json_object_arrays, read_json_value
+from wagtailimportexport.models import ImportJob, ImportJobPage, ImportJobReference, ObjectMapping, PageMapping
+from wagtailimportexport.references import rewrite_page_references
+
+
+# the number of rows inserted at a time when importing in bulk
+IMPORT_BATCH_SIZE = 500
 
-from wagtailimportexport.compat import Page
+# the attnames of the base Page fields which are set by the page's position in the destination tree
+TREE_ATTNAMES = ('id', 'path', 'depth', 'numchild', 'url_path')
 
+# the attnames of the base Page fields which give the type of the page and the state of its revisions
+# and publishing, which are only written along with the specific page
+SPECIFIC_ATTNAMES = (
+    'content_type_id', 'live', 'has_unpublished_changes', 'first_published_at', 'last_published_at',
+    'live_revision_id', 'latest_revision_created_at', 'draft_title', 'go_live_at', 'expire_at', 'expired',
+)
 
-@transaction.atomic()
-def import_pages(import_data, parent_page):
+
+def import_pages(import_data, parent_page, bulk=False, model_plans=None, checkpoint=None, job=None,
+                 upsert=False, source=None):
     """
     Take a JSON export of part of a source site's page tree
     and create those pages under the parent page
+
+    import_data['pages'] may be any iterable of the page records which can
+    be iterated twice, such as a JSONArrayReader of an uploaded file.
+
+    If bulk=True the tree positions of the new base Page records are
+    worked out up front and the records are inserted with bulk_create,
+    rather than added to the tree one page at a time; the resulting tree
+    is the same. The specific page records and their inline child objects
+    are then inserted in batches per model, rather than saved one page at
+    a time. Pages imported in bulk are not validated and no save signals
+    are sent for them, so search indexes need updating afterwards.
+
+    Models, content types and the fields to rewrite are looked up once per
+    model in model_plans, a ModelPlanCache; pass one in to inspect its
+    hit counts afterwards.
+
+    The import runs in a single transaction, unless checkpoint is given:
+    then it commits every checkpoint pages, recording its progress and the
+    new page of each source page in job, an ImportJob (a new one by
+    default). If the import fails part way, calling import_pages again
+    with the same data, parent page and job resumes it from the last
+    committed batch.
+
+    If upsert=True, pages which already exist in the destination tree
+    are updated from their records rather than created again, so that a
+    later export of the same pages (such as a delta export, see
+    exporting.iter_export_pages) can be imported over an earlier one.
+    Existing pages are found by the PageMappings recorded by earlier
+    upserts from the same source site, identified by source (by default
+    import_data['source'], which exports include), or otherwise by having
+    the same slug under the same parent. Pages whose records haven't
+    changed since they were last upserted are left as they are. Upserts
+    are made page by page, and can't be combined with bulk=True.
+    """
+    if upsert and bulk:
+        raise ValueError("Pages can't be upserted in bulk")
+    if model_plans is None:
+        model_plans = ModelPlanCache()
+    page_matcher = None
+    if upsert:
+        page_matcher = PageMatcher(source if source is not None else import_data.get('source'))
+    if checkpoint:
+        return import_pages_checkpointed(
+            import_data, parent_page, bulk, model_plans, checkpoint, job, page_matcher)
+
+    with transaction.atomic():
+        pages_by_original_path = {}
+        pages_by_original_id = {}
+
+        # First create the base Page records; these contain no foreign keys, so this allows us to
+        # build a complete mapping from old IDs to new IDs before we go on to importing the
+        # specific page models, which may require us to rewrite page IDs within foreign keys / rich
+        # text / streamfields.
+        page_count = create_base_pages(
+            import_data['pages'], parent_page, pages_by_original_path, pages_by_original_id, model_plans, bulk,
+            page_matcher)
+        create_specific_pages(import_data['pages'], pages_by_original_id, model_plans, bulk, page_matcher)
+        if page_matcher is not None:
+            page_matcher.save_mappings(pages_by_original_id)
+
+    return page_count
+
+
+def import_zip(fileobj, parent_page, bulk=False, model_plans=None, upsert=False):
+    """
+    Import the images, snippets and pages of a content.zip export, as
+    written by exporting.write_zip_content, creating the pages under the
+    parent page
+
+    content.json is parsed from the archive as it is read, and each image
+    file is copied from the archive straight into storage. Images and
+    snippets are given new ids, and the references to them from the
+    imported pages, by foreign keys, chooser blocks in StreamFields and
+    images embedded in rich text, are rewritten to match. Files which have been copied to
+    storage are left there if the import fails.
+
+    Pages are upserted as by import_pages if upsert=True, and so are images
+    and snippets: those imported before from the same source site, by the
+    ObjectMappings recorded by earlier upserts, are updated rather than
+    created again. Without a source, images and snippets are always created.
+
+    Returns the number of pages imported.
+    """
+    if model_plans is None:
+        model_plans = ModelPlanCache()
+    with ZipFile(fileobj) as zf, transaction.atomic():
+        # content.json is opened again for each pass rather than seeked, which archive
+        # members only support from Python 3.7
+        open_content = partial(zf.open, 'content.json')
+        with open_content() as content_file:
+            source = get_import_source(content_file)
+        object_matcher = ObjectMatcher(source) if upsert and source is not None else None
+        import_images(JSONArrayReader(open_content, 'images'), zf, model_plans, object_matcher=object_matcher)
+        with open_content() as content_file:
+            import_snippets(
+                iter_json_object_arrays(content_file, 'snippets'), model_plans, object_matcher=object_matcher)
+        return import_pages(
+            {'source': source, 'pages': JSONArrayReader(open_content, 'pages')}, parent_page, bulk=bulk,
+            model_plans=model_plans, upsert=upsert)
+
+
+def get_import_source(fp):
+    """
+    Return the source site of the export in fp, a JSON file, if it has one,
+    reading it from the start if it is seekable
+    """
+    if fp.seekable():
+        fp.seek(0)
+    try:
+        return read_json_value(fp, 'source')
+    except KeyError:
+        return None
+
+
+def import_images(image_records, zf, model_plans, batch_size=IMPORT_BATCH_SIZE, object_matcher=None):
     """
-    pages_by_original_path = {}
-    pages_by_original_id = {}
+    Create the images of image_records, exported by exporting.export_image_data,
+    copying their files from zf, and record their new ids in model_plans
+
+    Images whose collection does not exist are added to the root collection.
+    Content addressed records are mapped to an existing image with the same
+    file hash instead, if there is one, or else to the first image created
+    with it by this import, so that each file is only stored once.
+
+    If object_matcher, an ObjectMatcher, is given, the images it finds for
+    the records are updated from them instead, keeping their files unless
+    the contents of the files have changed, and the images of the other
+    records are recorded in it.
+
+    Raises LookupError if the file of an image is neither in zf nor, by its
+    hash, on this site.
+    """
+    ImageModel = get_image_model()
+    root_collection_id = None
+    images_by_hash = {}
+    image_records = iter(image_records)
+    while True:
+        batch = list(islice(image_records, batch_size))
+        if not batch:
+            break
+        existing_images = {}
+        if object_matcher is not None:
+            existing_images = object_matcher.find(ImageModel, [record['id'] for record in batch])
+        hashes = {record['file'].get('hash') for record in batch} - {None, ''} - set(images_by_hash)
+        for image in ImageModel.objects.filter(file_hash__in=hashes).only('pk', 'file_hash').order_by('pk'):
+            images_by_hash.setdefault(image.file_hash, image)
+
+        images = []
+        original_ids = []
+        updated_images = []
+        updated_ids = []
+        mapped_ids = []
+        mapped_images = []
+        for image_record in batch:
+            file_hash = image_record['file'].get('hash')
+            existing_image = existing_images.get(image_record['id'])
+            keep_file = existing_image is not None and (
+                get_image_file_hash(image_record, zf) == existing_image.get_file_hash())
+            if not keep_file and file_hash in images_by_hash:
+                mapped_ids.append(image_record['id'])
+                mapped_images.append(images_by_hash[file_hash])
+                continue
+
+            image = instance_from_data(ImageModel, image_record, model_plans)
+            if image.collection_id is None:
+                if root_collection_id is None:
+                    root_collection_id = Collection.get_first_root_node().pk
+                image.collection_id = root_collection_id
+
+            if keep_file:
+                image.file = existing_image.file.name
+                image.file_hash = existing_image.file_hash
+            else:
+                member_name = get_image_member_name(image_record['file'])
+                try:
+                    member = zf.getinfo(member_name)
+                except KeyError:
+                    raise LookupError(_("The file of image %(title)r is not in the archive") % {
+                        'title': image_record.get('title')})
+                with zf.open(member) as image_file:
+                    content = File(image_file)
+                    # the size can't be found from the file within the archive itself
+                    content.size = member.file_size
+                    image.file.save(os.path.basename(image_record['file']['name']), content, save=False)
+                if file_hash:
+                    image.file_hash = file_hash
+                    images_by_hash[file_hash] = image
+
+            if existing_image is not None:
+                image.pk = existing_image.pk
+                image._state.adding = False
+                if not keep_file:
+                    existing_image.renditions.all().delete()
+                updated_images.append(image)
+                updated_ids.append(image_record['id'])
+            else:
+                images.append(image)
+                original_ids.append(image_record['id'])
+
+        create_with_ids(ImageModel, images, batch_size)
+        if updated_images:
+            bulk_update(
+                ImageModel.objects, updated_images, get_update_fields(ImageModel, batch[0]) + ['file'],
+                batch_size=batch_size)
+        model_plans.add_remapped_ids(ImageModel, original_ids, images)
+        model_plans.add_remapped_ids(ImageModel, updated_ids, updated_images)
+        model_plans.add_remapped_ids(ImageModel, mapped_ids, mapped_images)
+        if object_matcher is not None:
+            object_matcher.save_mappings(ImageModel, original_ids + mapped_ids, images + mapped_images)
+
+
+def get_image_file_hash(image_record, zf):
+    """
+    Return the hash of the file of image_record, as Wagtail hashes image
+    files: that of the record if it has one, or else that of its file in
+    zf, or None if zf doesn't have it
+    """
+    file_hash = image_record['file'].get('hash') or image_record.get('file_hash')
+    if file_hash:
+        return file_hash
+    try:
+        member = zf.getinfo(get_image_member_name(image_record['file']))
+    except KeyError:
+        return None
+    with zf.open(member) as image_file:
+        return hash_file(image_file)
+
+
+def import_snippets(snippet_items, model_plans, batch_size=IMPORT_BATCH_SIZE, object_matcher=None):
+    """
+    Create the snippets of snippet_items, (model key, records) pairs
+    exported by exporting.export_snippets, and record their new ids in
+    model_plans
+
+    The records of each model may be a generator, such as those of
+    jsonstream.iter_json_object_arrays, and are taken and inserted
+    batch_size at a time.
+
+    If object_matcher, an ObjectMatcher, is given, the snippets it finds
+    for the records are updated from them instead, and the snippets of the
+    other records are recorded in it.
+
+    Raises LookupError if a snippet model does not exist.
+    """
+    for (model_key, snippet_records) in snippet_items:
+        model = apps.get_model(model_key)
+        snippet_records = iter(snippet_records)
+        while True:
+            batch = list(islice(snippet_records, batch_size))
+            if not batch:
+                break
+            original_ids = [record['id'] for record in batch]
+            existing_snippets = object_matcher.find(model, original_ids) if object_matcher is not None else {}
+            snippets = [instance_from_data(model, record, model_plans) for record in batch]
+            new_ids = []
+            new_snippets = []
+            updated_snippets = []
+            for (original_id, snippet) in zip(original_ids, snippets):
+                if original_id in existing_snippets:
+                    snippet.pk = existing_snippets[original_id].pk
+                    snippet._state.adding = False
+                    updated_snippets.append(snippet)
+                else:
+                    new_ids.append(original_id)
+                    new_snippets.append(snippet)
+            create_with_ids(model, new_snippets, batch_size)
+            if updated_snippets:
+                bulk_update(
+                    model._default_manager, updated_snippets, get_update_fields(model, batch[0]),
+                    batch_size=batch_size)
+            model_plans.add_remapped_ids(model, original_ids, snippets)
+            if object_matcher is not None:
+                object_matcher.save_mappings(model, new_ids, new_snippets)
+
+
+def instance_from_data(model, data, model_plans):
+    """
+    Build a new, unsaved instance of model from data exported by
+    exporting.instance_to_data, with the foreign keys to imported objects
+    rewritten and those to objects which do not exist nulled
+    """
+    instance = model(**{
+        field.attname: data[field.attname] for field in model._meta.concrete_fields
+        if field.attname in data and not field.primary_key and not isinstance(field, models.FileField)
+    })
+    model_plans.remap_foreign_keys(instance)
+    model_plans.clear_dangling_foreign_keys(instance)
+    return instance
+
+
+def get_update_fields(model, data):
+    """Return the names of the fields of model which instance_from_data sets from data"""
+    return [
+        field.name for field in model._meta.concrete_fields
+        if field.attname in data and not field.primary_key and not isinstance(field, models.FileField)
+    ]
+
+
+def create_with_ids(model, instances, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Insert instances with bulk_create where the database returns the new
+    primary keys, and one at a time otherwise, as well as for models with
+    multi-table inheritance, which bulk_create can't insert
+    """
+    features = connections[router.db_for_write(model)].features
+    if not is_multi_table_child(model) and getattr(
+            features, 'can_return_rows_from_bulk_insert',
+            getattr(features, 'can_return_ids_from_bulk_insert', False)):
+        model._default_manager.bulk_create(instances, batch_size=batch_size)
+    else:
+        for instance in instances:
+            instance.save()
+
+
+def is_multi_table_child(model):
+    """Return whether model inherits from another concrete model, whose rows are in another table"""
+    return any(
+        parent._meta.concrete_model is not model._meta.concrete_model for parent in model._meta.get_parent_list())
+
+
+def import_pages_checkpointed(import_data, parent_page, bulk, model_plans, checkpoint, job=None,
+                              page_matcher=None):
+    """
+    Import pages as import_pages does, committing every checkpoint pages
+    and recording the progress in job
+    """
+    if job is None:
+        job = ImportJob.objects.create(parent_page=parent_page)
+    elif job.parent_page_id != parent_page.pk:
+        raise ValueError("%s imports to a different parent page" % job)
+    (pages_by_original_path, pages_by_original_id) = job.get_page_mappings()
+
+    page_records = import_data['pages']
+    for batch in _iter_batches(page_records, job.base_pages_done, checkpoint):
+        with transaction.atomic():
+            new_pages = {}
+            create_base_pages(
+                batch, parent_page, pages_by_original_path, new_pages, model_plans, bulk, page_matcher)
+            ImportJobPage.objects.bulk_create([
+                ImportJobPage(job=job, original_id=page_record['content']['pk'],
+                              original_path=page_record['content']['path'],
+                              page=new_pages[page_record['content']['pk']])
+                for page_record in batch
+            ])
+            job.base_pages_done += len(batch)
+            job.save(update_fields=['base_pages_done', 'updated_at'])
+        pages_by_original_id.update(new_pages)
+
+    # the pages whose specific rows are yet to be created, following those created by any earlier run
+    deferred_references = DeferredPageReferences(
+        job.pages.order_by('pk').values_list('page_id', flat=True)[job.specific_pages_done:])
+    # along with the references which the batches committed by any earlier run left waiting
+    deferred_references.load(job)
+    for batch in _iter_batches(page_records, job.specific_pages_done, checkpoint):
+        with transaction.atomic():
+            create_specific_pages(
+                batch, pages_by_original_id, model_plans, bulk, page_matcher, deferred_references)
+            deferred_references.save(job)
+            if page_matcher is not None:
+                page_matcher.save_mappings({
+                    page_record['content']['pk']: pages_by_original_id[page_record['content']['pk']]
+                    for page_record in batch
+                }, batch)
+            job.specific_pages_done += len(batch)
+            job.save(update_fields=['specific_pages_done', 'updated_at'])
+
+    job.completed = True
+    job.save(update_fields=['completed', 'updated_at'])
+    return job.base_pages_done
+
+
+def _iter_batches(records, start, batch_size):
+    """Group the items of records from index start into lists of up to batch_size items"""
+    records = islice(records, start, None)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def create_base_pages(page_records, parent_page, pages_by_original_path, pages_by_original_id,
+                      model_plans, bulk=False, page_matcher=None):
+    """
+    Create the base Page records of page_records, adding them to
+    pages_by_original_path/id; the first page of the import becomes the
+    last child of parent_page, and the others are placed under their
+    imported parents in pages_by_original_path
+
+    If page_matcher is given, the existing pages it finds for the records
+    are added to pages_by_original_path/id in place of new pages.
+
+    Returns the number of pages created.
+    """
+    if bulk:
+        return bulk_create_base_pages(
+            page_records, parent_page, pages_by_original_path, pages_by_original_id, model_plans)
 
-    # First create the base Page records; these contain no foreign keys, so this allows us to
-    # build a complete mapping from old IDs to new IDs before we go on to importing the
-    # specific page models, which may require us to rewrite page IDs within foreign keys / rich
-    # text / streamfields.
     page_content_type = ContentType.objects.get_for_model(Page)
-    for (i, page_record) in enumerate(import_data['pages']):
-        # build a base Page instance from the exported content (so that we pick up its title and other
-        # core attributes)
-        page = Page.from_serializable_data(page_record['content'])
-        original_path = page.path
-        original_id = page.id
-
-        # clear id and treebeard-related fields so that they get reassigned when we save via add_child
-        page.id = None
-        page.path = None
-        page.depth = None
-        page.numchild = 0
-        page.url_path = None
-        page.content_type = page_content_type
-        if i == 0:
-            parent_page.add_child(instance=page)
+    page_count = 0
+    if page_matcher is not None:
+        page_records = page_matcher.iter_loaded(page_records)
+    for page_record in page_records:
+        (page, original_path, original_id) = base_page_from_record(
+            page_record, page_content_type, model_plans)
+        if not pages_by_original_path:
+            parent = parent_page
         else:
             # Child pages are created in the same sibling path order as the
             # source tree because the export is ordered by path
-            parent_path = original_path[:-(Page.steplen)]
-            pages_by_original_path[parent_path].add_child(instance=page)
+            parent = pages_by_original_path[original_path[:-(Page.steplen)]]
+        existing_page = page_matcher and page_matcher.find(page_record, page, parent)
+        if existing_page:
+            # the existing page's url path as it stands, following any changes to its ancestors' here
+            old_url_path = existing_page.set_url_path(parent)
+            if not page_matcher.is_unchanged(original_id):
+                # keep the existing page's id and tree position, and take the rest from the record,
+                # saving it along with the new pages so that a resumed checkpointed import has it;
+                # its type and live state are left until its specific page is saved
+                changes = {
+                    field.attname: getattr(page, field.attname) for field in Page._meta.concrete_fields
+                    if field.attname not in TREE_ATTNAMES and field.attname not in SPECIFIC_ATTNAMES
+                }
+                for (attname, value) in changes.items():
+                    setattr(existing_page, attname, value)
+                # the saved slug is the new one, so the specific page's save won't see it change
+                changes['url_path'] = existing_page.set_url_path(parent)
+                Page.objects.filter(pk=existing_page.pk).update(**changes)
+                if existing_page.url_path != old_url_path:
+                    existing_page._update_descendant_url_paths(old_url_path, existing_page.url_path)
+            page = existing_page
+        else:
+            parent.add_child(instance=page)
+
+        pages_by_original_path[original_path] = page
+        pages_by_original_id[original_id] = page
+        page_count += 1
+    return page_count
+
+
+def create_specific_pages(page_records, pages_by_original_id, model_plans, bulk=False, page_matcher=None,
+                          deferred_references=None):
+    """
+    Create the specific page records of page_records, whose base Page
+    records exist, along with their inline child objects
+
+    Existing pages which page_matcher found to be unchanged are skipped.
+    Foreign keys to specific pages which are yet to be created are set once
+    those pages exist, by deferred_references (by default, a new
+    DeferredPageReferences of all the pages in pages_by_original_id).
+    """
+    if deferred_references is None:
+        deferred_references = DeferredPageReferences(page.id for page in pages_by_original_id.values())
+
+    if bulk:
+        bulk_create_specific_pages(page_records, pages_by_original_id, model_plans, deferred_references)
+    else:
+        for page_record in page_records:
+            if page_matcher is not None and page_matcher.is_unchanged(page_record['content']['pk']):
+                deferred_references.created([pages_by_original_id[page_record['content']['pk']].id])
+                continue
+            specific_page = specific_page_from_record(
+                page_record, pages_by_original_id, model_plans, deferred_references)
+            specific_page.save()
+            deferred_references.created([specific_page.id])
+    deferred_references.patch()
+
+
+def base_page_from_record(page_record, page_content_type, model_plans):
+    """
+    Build a new, unsaved base Page instance from the exported content of
+    page_record (so that we pick up its title and other core attributes)
+
+    Returns the page along with its original path and id.
+    """
+    page = Page.from_serializable_data(page_record['content'], check_fks=False)
+    model_plans.clear_dangling_foreign_keys(page)
+    original_path = page.path
+    original_id = page.id
+
+    # clear id and treebeard-related fields so that they get reassigned when we save via add_child
+    page.id = None
+    page.path = None
+    page.depth = None
+    page.numchild = 0
+    page.url_path = None
+    page.content_type = page_content_type
+    page._state.adding = True
+    return (page, original_path, original_id)
+
+
+def bulk_create_base_pages(page_records, parent_page, pages_by_original_path, pages_by_original_id,
+                           model_plans, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Create the base Page records of page_records under parent_page with
+    bulk_create, adding them to pages_by_original_path/id
+
+    The path, depth, numchild and url_path of each page are computed here
+    in the same way as treebeard's add_child would set them, from the
+    page's position in the source tree relative to the first page, which
+    becomes the last child of parent_page. Each page is given the content
+    type of the base Page model until its specific page is inserted (see
+    insert_specific_pages), so that a checkpointed import which fails in
+    between leaves no pages whose specific pages are missing; the records'
+    page models are looked up here all the same. Pages created by earlier
+    calls in pages_by_original_path can have children added.
+
+    Returns the number of pages created.
+    """
+    page_content_type = ContentType.objects.get_for_model(Page)
+    pages = []
+    grown_parents = {}
+    root_created = False
+    for page_record in page_records:
+        model_plans.get_page_plan(page_record['app_label'], page_record['model'])
+        (page, original_path, original_id) = base_page_from_record(
+            page_record, page_content_type, model_plans)
+        if not pages_by_original_path:
+            if not Page._slug_is_available(page.slug, parent_page):
+                raise ValidationError({'slug': _("This slug is already in use")})
+            root_created = True
+            parent = parent_page
+            last_child = parent_page.get_last_child()
+            if last_child is None:
+                page.path = Page._get_path(parent_page.path, parent_page.depth + 1, 1)
+            else:
+                page.path = last_child._inc_path()
+        else:
+            parent = pages_by_original_path[original_path[:-(Page.steplen)]]
+            parent.numchild += 1
+            if not parent._state.adding:
+                grown_parents[parent.path] = parent
+            page.path = Page._get_path(parent.path, parent.depth + 1, parent.numchild)
+        page.depth = parent.depth + 1
+        page.set_url_path(parent)
+        pages.append(page)
 
         pages_by_original_path[original_path] = page
         pages_by_original_id[original_id] = page
 
-    for (i, page_record) in enumerate(import_data['pages']):
-        # Get the page model of the source page by app_label and model name
-        # The content type ID of the source page is not in general the same
-        # between the source and destination sites but the page model needs
-        # to exist on both.
-        # Raises LookupError exception if there is no matching model
-        model = apps.get_model(page_record['app_label'], page_record['model'])
-
-        specific_page = model.from_serializable_data(page_record['content'], check_fks=False, strict_fks=False)
-        base_page = pages_by_original_id[specific_page.id]
-        specific_page.page_ptr = base_page
-        specific_page.__dict__.update(base_page.__dict__)
-        specific_page.content_type = ContentType.objects.get_for_model(model)
-        update_page_references(specific_page, pages_by_original_id)
-        specific_page.save()
-
-    return len(import_data['pages'])
-
-
-def update_page_references(model, pages_by_original_id):
-    for field in model._meta.get_fields():
-        if isinstance(field, models.ForeignKey) and issubclass(field.related_model, Page):
-            linked_page_id = getattr(model, field.attname)
+    if not pages:
+        return 0
+
+    Page.objects.bulk_create(pages, batch_size=batch_size)
+    if pages[0].pk is None:
+        # not all databases return the primary keys of bulk inserted rows
+        # (pages are in path order, and no other pages lie between them)
+        page_ids = dict(Page.objects.filter(
+            path__range=(pages[0].path, pages[-1].path)).values_list('path', 'pk'))
+        for page in pages:
+            page.pk = page_ids[page.path]
+            page._state.adding = False
+
+    if grown_parents:
+        bulk_update(Page.objects, grown_parents.values(), ['numchild'], batch_size=batch_size)
+    if root_created:
+        Page.objects.filter(pk=parent_page.pk).update(numchild=F('numchild') + 1)
+        parent_page.numchild += 1
+    return len(pages)
+
+
+def specific_page_from_record(page_record, pages_by_original_id, model_plans, deferred_references=None,
+                              children=None):
+    """
+    Build the specific page instance of page_record on top of its new base
+    Page record, with its references to imported pages rewritten, and those
+    to specific pages which are yet to be created deferred to
+    deferred_references
+
+    If children is given, the page's inline child objects are added to it
+    to be remapped later, as by update_page_references.
+    """
+    # Get the page model of the source page by app_label and model name
+    # The content type ID of the source page is not in general the same
+    # between the source and destination sites but the page model needs
+    # to exist on both.
+    # Raises LookupError exception if there is no matching model
+    plan = model_plans.get_page_plan(page_record['app_label'], page_record['model'])
+
+    def get_page_id(original_id):
+        page = pages_by_original_id.get(original_id)
+        return page and page.id
+
+    # page, image and snippet ids within rich text and StreamFields are rewritten in the exported data itself
+    content = rewrite_page_references(
+        plan.model, page_record['content'], get_page_id, model_plans.remapped_ids)
+    specific_page = plan.model.from_serializable_data(content, check_fks=False, strict_fks=False)
+    set_parent_links(specific_page, plan)
+    base_page = pages_by_original_id[specific_page.id]
+    specific_page.page_ptr = base_page
+    # copy over the new id and tree fields, but keep the specific page's own child objects, and
+    # its type and live state from the record, which an existing base page hasn't been given
+    specific_page.__dict__.update(
+        (key, value) for (key, value) in base_page.__dict__.items()
+        if key != '_cluster_related_objects' and key not in SPECIFIC_ATTNAMES)
+    model_plans.clear_dangling_foreign_keys(specific_page, SPECIFIC_ATTNAMES)
+    specific_page.content_type = plan.content_type
+    update_page_references(specific_page, pages_by_original_id, model_plans, deferred_references, children)
+    return specific_page
+
+
+def set_parent_links(specific_page, plan):
+    """
+    Set the parent links of specific_page, built by from_serializable_data,
+    to its original id, and the ParentalKeys of its inline child objects
+    back to it, where django-modelcluster < 5.0 has only set the id of the
+    base Page model
+    """
+    for model in [plan.model] + plan.model._meta.get_parent_list():
+        for parent_link in model._meta.parents.values():
+            if parent_link is not None and getattr(specific_page, parent_link.attname) is None:
+                setattr(specific_page, parent_link.attname, specific_page.id)
+    for rel in plan.child_relations:
+        for child in getattr(specific_page, rel.get_accessor_name()).all():
+            if getattr(child, rel.field.attname) is None:
+                setattr(child, rel.field.attname, specific_page.id)
+
+
+def bulk_create_specific_pages(page_records, pages_by_original_id, model_plans, deferred_references,
+                               batch_size=IMPORT_BATCH_SIZE):
+    """
+    Insert the specific page records of page_records, whose base Page
+    records have been created by bulk_create_base_pages, along with their
+    inline child objects
+
+    The rows of each specific page model's own tables are inserted in
+    batches of batch_size pages, and each child model's objects with one
+    bulk_create once all pages exist. Foreign keys to imported pages on
+    the base Page records are updated with a single bulk_update, and those
+    to specific pages inserted later by deferred_references.
+    """
+    base_plan = model_plans.get(Page)
+    pending_pages = defaultdict(list)
+    changed_base_pages = []
+    children = defaultdict(list)
+    m2m_pages = []
+
+    for page_record in page_records:
+        specific_page = specific_page_from_record(
+            page_record, pages_by_original_id, model_plans, deferred_references, children)
+        plan = model_plans.get(type(specific_page))
+
+        base_page = pages_by_original_id[page_record['content']['pk']]
+        if any(getattr(specific_page, attname) != getattr(base_page, attname)
+               for attname in base_plan.page_fk_attnames):
+            for attname in base_plan.page_fk_attnames:
+                setattr(base_page, attname, getattr(specific_page, attname))
+            changed_base_pages.append(base_page)
+
+        if plan.model is not Page:
+            batch = pending_pages[plan.model]
+            batch.append(specific_page)
+            if len(batch) >= batch_size:
+                insert_specific_pages(plan.model, batch)
+                deferred_references.created(page.id for page in pending_pages.pop(plan.model))
+        else:
+            deferred_references.created([specific_page.id])
+
+        if plan.child_m2m_field_names:
+            m2m_pages.append(specific_page)
+
+    for (model, pages) in pending_pages.items():
+        insert_specific_pages(model, pages)
+        deferred_references.created(page.id for page in pages)
+    # the child objects of all pages are remapped together and inserted below, with their
+    # deferred references set beforehand
+    remap_child_objects(children, pages_by_original_id, model_plans, deferred_references)
+    deferred_references.patch()
+
+    if changed_base_pages:
+        bulk_update(Page.objects, changed_base_pages, base_plan.page_fk_attnames, batch_size=batch_size)
+
+    waiting = {id(instance) for instance in deferred_references.get_waiting_instances()}
+    for (model, objects) in children.items():
+        if model_plans.get(model).child_accessor_names:
+            # child objects with child objects of their own need saving one by one to commit those
+            for child in objects:
+                child.save()
+            continue
+        # as do those whose references are still deferred, which need their new ids (which
+        # bulk_create doesn't return on every database) for those references to be set later
+        inserted = []
+        for child in objects:
+            if id(child) in waiting:
+                child.save()
+            else:
+                inserted.append(child)
+        model._default_manager.bulk_create(inserted, batch_size=batch_size)
+
+    for specific_page in m2m_pages:
+        for field_name in model_plans.get(type(specific_page)).child_m2m_field_names:
+            getattr(specific_page, field_name).commit()
+
+
+def insert_specific_pages(model, pages):
+    """
+    Insert the rows of the tables of model, a Page subclass, and of any
+    intermediate parent models for pages, whose base Page records exist,
+    and give the base Page records the content type of model
+    """
+    page_models = [
+        parent for parent in reversed(model._meta.get_parent_list())
+        if issubclass(parent, Page) and parent is not Page
+    ] + [model]
+    for page in pages:
+        # point the parent links of every table at the new base Page record
+        for page_model in page_models:
+            setattr(page, page_model._meta.pk.attname, page.id)
+
+    connection = connections[router.db_for_write(model)]
+    for page_model in page_models:
+        fields = page_model._meta.local_concrete_fields
+        batch_size = max(connection.ops.bulk_batch_size(fields, pages), 1)
+        for offset in range(0, len(pages), batch_size):
+            page_model._base_manager._insert(
+                pages[offset:offset + batch_size], fields=fields, using=connection.alias)
+
+    for page in pages:
+        page._state.adding = False
+        page._state.db = connection.alias
+    Page._base_manager.using(connection.alias).filter(pk__in=[page.pk for page in pages]).update(
+        content_type=ContentType.objects.get_for_model(model))
+
+
+def update_page_references(model, pages_by_original_id, model_plans=None, deferred_references=None,
+                           children=None):
+    """
+    Rewrite the foreign keys of model, an imported page, to imported pages,
+    images and snippets to their new ids, and those of its inline child
+    objects with remap_child_objects
+
+    If children, a dict of lists of child objects by model, is given, the
+    child objects are added to it to be remapped along with those of other
+    pages, instead of being remapped now.
+    """
+    if model_plans is None:
+        model_plans = ModelPlanCache()
+    # update references to imported images and snippets too
+    model_plans.remap_foreign_keys(model)
+    plan = model_plans.get(type(model))
+    for attname in plan.page_fk_attnames:
+        linked_page_id = getattr(model, attname)
+        try:
+            # see if the linked page is one of the ones we're importing
+            linked_page = pages_by_original_id[linked_page_id]
+        except KeyError:
+            # any references to pages outside of the import should be left unchanged
+            continue
+
+        # update fk to the linked page's new ID
+        setattr(model, attname, linked_page.id)
+
+    if deferred_references is not None:
+        deferred_references.defer(model, plan)
+
+    if children is None:
+        remap_child_objects(
+            collect_child_objects(model, plan), pages_by_original_id, model_plans, deferred_references)
+    else:
+        collect_child_objects(model, plan, children)
+
+
+def collect_child_objects(instance, plan, children=None):
+    """Add the inline child objects of instance, whose plan is given, to children, a dict of lists by model"""
+    if children is None:
+        children = defaultdict(list)
+    for accessor_name in plan.child_accessor_names:
+        for child in getattr(instance, accessor_name).all():
+            children[type(child)].append(child)
+    return children
+
+
+def remap_child_objects(children, pages_by_original_id, model_plans, deferred_references=None):
+    """
+    Prepare the inline child objects of imported pages in children, a dict
+    of lists by model, and their own child objects, for inserting as new
+    objects: their primary keys are reset, and their foreign keys to
+    imported pages (including the ParentalKeys pointing back to their
+    pages), images and snippets are rewritten to the new ids
+
+    The objects of each model are remapped together, field by field.
+    """
+    while children:
+        nested_children = defaultdict(list)
+        for (model, objects) in children.items():
+            plan = model_plans.get(model)
+            for child in objects:
+                # reset the child's PK so that it will be inserted as a new record rather than
+                # updating an existing one
+                child.pk = None
+                model_plans.remap_foreign_keys(child)
+            for attname in plan.page_fk_attnames:
+                for child in objects:
+                    # any references to pages outside of the import are left unchanged
+                    linked_page = pages_by_original_id.get(getattr(child, attname))
+                    if linked_page is not None:
+                        setattr(child, attname, linked_page.id)
+            if deferred_references is not None and plan.specific_page_fks:
+                for child in objects:
+                    deferred_references.defer(child, plan)
+            if plan.child_accessor_names:
+                for child in objects:
+                    collect_child_objects(child, plan, nested_children)
+        children = nested_children
+
+
+class DeferredPageReferences:
+    """
+    The foreign keys to specific page models, from imported pages and their
+    inline child objects, whose target pages' specific rows are yet to be
+    created, given the ids of those pages
+
+    Such a foreign key can't be inserted before its target, which may come
+    later in the import or refer back to its own page, so it is nulled on
+    the inserted row and set afterwards, with one bulk UPDATE per field,
+    once its target exists. Foreign keys which can't be nulled are left as
+    they are.
+
+    A checkpointed import saves the references which are still waiting to
+    its job with each batch, and loads them again when it is resumed, so
+    that they are set even when their targets are created by a later run.
+    """
+    def __init__(self, pending_page_ids, batch_size=IMPORT_BATCH_SIZE):
+        self.pending_page_ids = set(pending_page_ids)
+        self.batch_size = batch_size
+        self.references = defaultdict(list)
+
+    def defer(self, instance, plan):
+        """Null the foreign keys of instance, whose plan is given, to specific pages which are yet to be created"""
+        for field in plan.specific_page_fks:
+            page_id = getattr(instance, field.attname)
+            if page_id in self.pending_page_ids:
+                setattr(instance, field.attname, None)
+                self.references[(type(instance), field.attname)].append((instance, page_id))
+
+    def created(self, page_ids):
+        """Note that the specific rows of the pages with page_ids exist"""
+        self.pending_page_ids.difference_update(page_ids)
+
+    def get_waiting_instances(self):
+        """Return the instances with deferred references, which patch hasn't been able to set yet"""
+        return [instance for references in self.references.values() for (instance, page_id) in references]
+
+    def patch(self):
+        """
+        Set the deferred foreign keys to pages which have been created since,
+        updating the rows of instances which have been saved
+        """
+        for ((model, attname), references) in list(self.references.items()):
+            saved_instances = []
+            waiting = []
+            for (instance, page_id) in references:
+                if page_id in self.pending_page_ids:
+                    waiting.append((instance, page_id))
+                    continue
+                setattr(instance, attname, page_id)
+                if instance.pk is not None and not instance._state.adding:
+                    saved_instances.append(instance)
+            if saved_instances:
+                bulk_update(model._base_manager, saved_instances, [attname], batch_size=self.batch_size)
+            if waiting:
+                self.references[(model, attname)] = waiting
+            else:
+                del self.references[(model, attname)]
+
+    def load(self, job):
+        """Add the references which were waiting when job, a checkpointed import, last committed a batch"""
+        for job_reference in job.references.order_by('pk'):
+            model = ContentType.objects.get_for_id(job_reference.content_type_id).model_class()
+            # only the primary key is needed to update the row
+            instance = model()
+            instance.pk = job_reference.object_id
+            instance._state.adding = False
+            self.references[(model, job_reference.attname)].append((instance, job_reference.page_id))
+
+    def save(self, job):
+        """Replace the references saved to job with those which are still waiting"""
+        job.references.all().delete()
+        ImportJobReference.objects.bulk_create([
+            ImportJobReference(
+                job=job, content_type=ContentType.objects.get_for_model(model), object_id=instance.pk,
+                attname=attname, page_id=page_id)
+            for ((model, attname), references) in self.references.items()
+            for (instance, page_id) in references
+        ], batch_size=self.batch_size)
+
+
+class PageMatcher:
+    """
+    Finds the existing pages of the page records of an upsert import, and
+    whether their records have changed since they were last imported
+
+    Pages are found by the PageMappings of the source site, as long as they
+    are still under the same parent, or else by having the same slug under
+    the same parent. The mappings of a batch
+    of records are loaded with one query.
+    """
+    def __init__(self, source=None, batch_size=IMPORT_BATCH_SIZE):
+        self.source = source
+        self.batch_size = batch_size
+        self.mappings = {}
+        self.content_hashes = {}
+        self.unchanged_ids = set()
+
+    def iter_loaded(self, page_records):
+        """Generate page_records, loading the mappings of each batch of them as it is reached"""
+        for batch in _iter_batches(page_records, 0, self.batch_size):
+            if self.source is not None:
+                self.mappings.update(
+                    (mapping.original_id, mapping) for mapping in PageMapping.objects.filter(
+                        source=self.source,
+                        original_id__in=[page_record['content']['pk'] for page_record in batch],
+                    ).select_related('page'))
+            yield from batch
+
+    def find(self, page_record, page, parent):
+        """
+        Return the existing page of page_record, whose new base page is page,
+        under parent, if any
+
+        Mapped pages which are not children of parent, such as those imported
+        before under a different destination parent page, are not matched.
+        """
+        original_id = page_record['content']['pk']
+        content_hash = get_content_hash(page_record)
+        self.content_hashes[original_id] = content_hash
+        mapping = self.mappings.get(original_id)
+        if mapping is not None and mapping.page.path[:-Page.steplen] == parent.path:
+            if mapping.content_hash == content_hash:
+                self.unchanged_ids.add(original_id)
+            return mapping.page
+        return parent.get_children().filter(slug=page.slug).first()
+
+    def is_unchanged(self, original_id):
+        return original_id in self.unchanged_ids
+
+    def save_mappings(self, pages_by_original_id, page_records=()):
+        """
+        Record the pages and content hashes of the records which were
+        imported; page_records are those whose hashes haven't been found
+        by find, when resuming a checkpointed import
+        """
+        if self.source is None:
+            return
+        for page_record in page_records:
+            if page_record['content']['pk'] not in self.content_hashes:
+                self.content_hashes[page_record['content']['pk']] = get_content_hash(page_record)
+        unloaded_ids = [original_id for original_id in pages_by_original_id if original_id not in self.mappings]
+        for offset in range(0, len(unloaded_ids), self.batch_size):
+            self.mappings.update(
+                (mapping.original_id, mapping) for mapping in PageMapping.objects.filter(
+                    source=self.source, original_id__in=unloaded_ids[offset:offset + self.batch_size]))
+
+        new_mappings = []
+        changed_mappings = []
+        for (original_id, page) in pages_by_original_id.items():
+            if original_id in self.unchanged_ids:
+                continue
+            mapping = self.mappings.get(original_id)
+            if mapping is None:
+                mapping = self.mappings[original_id] = PageMapping(
+                    source=self.source, original_id=original_id, page=page)
+                new_mappings.append(mapping)
+            else:
+                mapping.page = page
+                changed_mappings.append(mapping)
+            mapping.content_hash = self.content_hashes[original_id]
+        PageMapping.objects.bulk_create(new_mappings, batch_size=self.batch_size)
+        bulk_update(PageMapping.objects, changed_mappings, ['page', 'content_hash'], batch_size=self.batch_size)
+
+
+class ObjectMatcher:
+    """
+    Finds the existing snippets and images of the records of an upsert
+    import, by the ObjectMappings recorded by earlier upserts from the
+    source site, and records those of the records it doesn't find
+    """
+    def __init__(self, source):
+        self.source = source
+
+    def find(self, model, original_ids):
+        """
+        Return the existing objects of model which were imported from those
+        with original_ids, by original id, leaving out any which have since
+        been deleted
+        """
+        object_ids = dict(ObjectMapping.objects.filter(
+            source=self.source, content_type=ContentType.objects.get_for_model(model),
+            original_id__in=original_ids,
+        ).values_list('original_id', 'object_id'))
+        objects = model._default_manager.in_bulk(list(object_ids.values()))
+        return {
+            original_id: objects[object_id] for (original_id, object_id) in object_ids.items()
+            if object_id in objects
+        }
+
+    def save_mappings(self, model, original_ids, instances):
+        """Record instances, objects of model, as imported from those with original_ids"""
+        content_type = ContentType.objects.get_for_model(model)
+        # mappings to objects which have been deleted are replaced
+        ObjectMapping.objects.filter(
+            source=self.source, content_type=content_type, original_id__in=original_ids).delete()
+        ObjectMapping.objects.bulk_create([
+            ObjectMapping(source=self.source, content_type=content_type, original_id=original_id,
+                          object_id=instance.pk)
+            for (original_id, instance) in zip(original_ids, instances)
+        ])
+
+
+def get_content_hash(page_record):
+    """Return a hash of the content of page_record, to tell whether it has changed"""
+    content = json.dumps(page_record, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class ModelPlan:
+    """
+    The details of a model which are needed to import its instances,
+    worked out once per import
+    """
+    def __init__(self, model):
+        self.model = model
+        # the attnames of foreign keys to pages, which may need rewriting to the new page IDs
+        self.page_fk_attnames = [
+            field.attname for field in model._meta.get_fields()
+            if isinstance(field, models.ForeignKey) and issubclass(field.related_model, Page)
+        ]
+        # the nullable foreign keys to specific page models, which may need deferring until their targets exist
+        self.specific_page_fks = [
+            field for field in model._meta.concrete_fields
+            if isinstance(field, models.ForeignKey) and not isinstance(field, ParentalKey)
+            and issubclass(field.related_model, Page) and field.related_model is not Page and field.null
+        ]
+        self.child_relations = get_all_child_relations(model)
+        self.child_accessor_names = [rel.get_accessor_name() for rel in self.child_relations]
+        self.child_m2m_field_names = [field.name for field in get_all_child_m2m_relations(model)]
+        self.foreign_keys = [
+            field for field in model._meta.concrete_fields
+            if field.remote_field and isinstance(field.remote_field, models.ManyToOneRel)
+        ]
+
+    @cached_property
+    def content_type(self):
+        return ContentType.objects.get_for_model(self.model)
+
+
+class ModelPlanCache:
+    """
+    The ModelPlans of one import, by model
+
+    hits counts the lookups of each model (by label) which were answered
+    from the cache, and misses those which had to work out a new plan.
+    remapped_ids holds the new ids of objects other than pages imported
+    along with the pages, by model and original id.
+    """
+    def __init__(self):
+        self.plans = {}
+        self.page_models = {}
+        self.existing_objects = {}
+        self.remapped_ids = defaultdict(dict)
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def get(self, model):
+        try:
+            plan = self.plans[model]
+        except KeyError:
+            plan = self.plans[model] = ModelPlan(model)
+            self.misses[model._meta.label] += 1
+        else:
+            self.hits[model._meta.label] += 1
+        return plan
+
+    def add_remapped_ids(self, model, original_ids, instances):
+        """Record the new ids of instances, imported objects of model with original_ids"""
+        self.remapped_ids[model].update(
+            (original_id, instance.pk) for (original_id, instance) in zip(original_ids, instances))
+
+    def remap_foreign_keys(self, instance):
+        """Rewrite the foreign keys of instance to imported objects to their new ids"""
+        if not self.remapped_ids:
+            return
+        for field in self.get(type(instance)).foreign_keys:
+            ids = self.remapped_ids.get(field.related_model)
+            if ids:
+                value = getattr(instance, field.attname)
+                if value in ids:
+                    setattr(instance, field.attname, ids[value])
+
+    def clear_dangling_foreign_keys(self, instance, attnames=None):
+        """
+        Null the foreign keys of instance to objects which do not exist, where
+        they are CASCADE or SET_NULL, as from_serializable_data does when
+        check_fks=True, or only those with the given attnames; each
+        referenced object is only looked up once
+        """
+        for field in self.get(type(instance)).foreign_keys:
+            if attnames is not None and field.attname not in attnames:
+                continue
+            value = getattr(instance, field.attname)
+            if value is None or field.remote_field.on_delete not in (models.CASCADE, models.SET_NULL):
+                continue
+            key = (field.related_model, field.remote_field.field_name, value)
             try:
-                # see if the linked page is one of the ones we're importing
-                linked_page = pages_by_original_id[linked_page_id]
+                exists = self.existing_objects[key]
             except KeyError:
-                # any references to pages outside of the import should be left unchanged
-                continue
+                exists = self.existing_objects[key] = field.related_model._default_manager.filter(
+                    **{field.remote_field.field_name: value}).exists()
+            if not exists:
+                setattr(instance, field.attname, None)
 
-            # update fk to the linked page's new ID
-            setattr(model, field.attname, linked_page.id)
-
-    # update references within inline child models, including the ParentalKey pointing back
-    # to the page
-    for rel in get_all_child_relations(model):
-        for child in getattr(model, rel.get_accessor_name()).all():
-            # reset the child model's PK so that it will be inserted as a new record
-            # rather than updating an existing one
-            child.pk = None
-            # update page references on the child model, including the ParentalKey
-            update_page_references(child, pages_by_original_id)
+    def get_page_plan(self, app_label, model_name):
+        """
+        Return the plan of the page model with the given app_label and
+        model name, raising LookupError if there is no such model
+        """
+        try:
+            model = self.page_models[(app_label, model_name)]
+        except KeyError:
+            model = self.page_models[(app_label, model_name)] = apps.get_model(app_label, model_name)
+        return self.get(model)
@@ -0,0 +1,273 @@
+import codecs
+import json
+import re
+from collections.abc import Iterator
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+# the number of bytes read from a file at a time when parsing JSON from it
+READ_CHUNK_SIZE = 64 * 1024
+
+_NUMBER_START = '-0123456789'
+_NUMBER_END = re.compile(r'[^-+.0-9eE]')
+
+# the number of characters from the end of the text within which an error
+# may be down to a value having been cut off there, such as a literal
+# ('-Infinity' less a character) or a \uXXXX escape
+_CUT_OFF_LENGTH = len('-Infinity') - 1
+
+
+class IncompleteJSONError(json.JSONDecodeError):
+    """
+    The JSON text ended before the value being parsed did, as it does when
+    the text has been cut off; a value which is malformed and can't be
+    parsed up to the end of the text raises it too
+    """
+
+
+def iter_json(data, indent=None):
+    """
+    Generate the JSON text of data in pieces
+
+    Generators and other iterators within data are encoded one item at a
+    time, as are dicts containing them, so a generator of page records can
+    be written out without ever being materialized. Every other value is
+    encoded in one go. With an indent the output is the same as that of
+    json.dumps(data, indent=indent, cls=DjangoJSONEncoder); without one it
+    is written without any whitespace.
+    """
+    if indent is None:
+        encoder = DjangoJSONEncoder(separators=(',', ':'))
+        newline = None
+    else:
+        encoder = DjangoJSONEncoder(indent=indent)
+        newline = '\n'
+        indent = ' ' * indent if isinstance(indent, int) else indent
+    return _iter_json(data, encoder, newline, indent, 0)
+
+
+def _iter_json(value, encoder, newline, indent, level):
+    if isinstance(value, Iterator):
+        items = ((None, item) for item in value)
+        brackets = '[]'
+    elif _is_streamed(value):
+        items = value.items()
+        brackets = '{}'
+    else:
+        text = encoder.encode(value)
+        if newline is not None and level:
+            text = text.replace(newline, newline + indent * level)
+        yield text
+        return
+
+    yield brackets[0]
+    separator = newline + indent * (level + 1) if newline is not None else ''
+    empty = True
+    for (key, item) in items:
+        yield separator if empty else ',' + separator
+        empty = False
+        if key is not None:
+            yield encoder.encode(str(key)) + encoder.key_separator
+        yield from _iter_json(item, encoder, newline, indent, level + 1)
+    if not empty and newline is not None:
+        yield newline + indent * level
+    yield brackets[1]
+
+
+def _is_streamed(value):
+    """Whether value is a dict which contains (perhaps nested) iterators"""
+    return isinstance(value, dict) and any(
+        isinstance(item, Iterator) or _is_streamed(item) for item in value.values())
+
+
+def iter_json_array(fp, key, chunk_size=READ_CHUNK_SIZE, values=None):
+    """
+    Parse the items of the array under key in the JSON object in fp, a
+    binary file, one at a time
+
+    The file is read and decoded (as UTF-8, with or without a BOM)
+    chunk_size bytes at a time, and only one item is ever parsed into
+    memory, so a file of any size can be read with memory in proportion to
+    its largest item; the values of other keys are skipped over in the same
+    way, unless values, a dict, is given: then the values of the keys
+    which come before key are parsed and added to it. Raises KeyError if
+    the object has no such key, and json.JSONDecodeError if the file isn't
+    valid JSON up to the end of the array (IncompleteJSONError if it ends
+    before then).
+    """
+    reader = _JSONReader(fp, chunk_size)
+    reader.find(key, values)
+    yield from reader.iter_array()
+
+
+def read_json_value(fp, key, chunk_size=READ_CHUNK_SIZE):
+    """
+    Parse the value of key in the JSON object in fp, a binary file, reading
+    it in the same way as iter_json_array
+    """
+    reader = _JSONReader(fp, chunk_size)
+    reader.find(key)
+    return reader.decode()
+
+
+def iter_json_object_arrays(fp, key, chunk_size=READ_CHUNK_SIZE):
+    """
+    Parse the members of the object under key in the JSON object in fp, a
+    binary file, whose values are arrays, as (name, items) pairs, where
+    items generates the items of the array one at a time
+
+    The file is read in the same way as by iter_json_array, so the items of
+    each array are parsed as they are iterated, and need iterating before
+    the next pair is taken; any which haven't been are then passed over.
+    """
+    reader = _JSONReader(fp, chunk_size)
+    reader.find(key)
+    for _ in reader._iter_members('{', '}'):
+        name = reader.decode()
+        reader.expect(':')
+        items = reader.iter_array()
+        yield (name, items)
+        for _ in items:
+            pass
+
+
+class JSONArrayReader:
+    """
+    The items of the array under key in the JSON object in fp, a seekable
+    binary file, parsed with iter_json_array each time they are iterated
+
+    fp may instead be a function which opens the file, such as a member of
+    a ZIP archive (which can't be seeked before Python 3.7); it is opened
+    again each time the items are iterated.
+    """
+    def __init__(self, fp, key, chunk_size=READ_CHUNK_SIZE):
+        self.fp = fp
+        self.key = key
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        if callable(self.fp):
+            return self._iter_opened()
+        self.fp.seek(0)
+        return iter_json_array(self.fp, self.key, self.chunk_size)
+
+    def _iter_opened(self):
+        with self.fp() as fp:
+            yield from iter_json_array(fp, self.key, self.chunk_size)
+
+
+class _JSONReader:
+    """A buffer of the decoded text of a JSON file, refilled as it is parsed"""
+    def __init__(self, fp, chunk_size):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size=None):
+        """Read another chunk (of size bytes) into the buffer, dropping what has been parsed"""
+        if self.eof:
+            return False
+        data = self.fp.read(size or self.chunk_size)
+        self.eof = not data
+        self.buffer = self.buffer[self.pos:] + self.text_decoder.decode(data, final=self.eof)
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next character other than whitespace, or '' at the end of the file"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self.fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, characters):
+        """Consume the next character, which must be one of characters"""
+        character = self.peek()
+        if not character:
+            raise IncompleteJSONError("Expecting one of %r" % characters, self.buffer, self.pos)
+        if character not in characters:
+            raise json.JSONDecodeError(
+                "Expecting one of %r" % characters, self.buffer, self.pos)
+        self.pos += 1
+        return character
+
+    def decode(self):
+        """Parse the next value"""
+        character = self.peek()
+        if character and character in _NUMBER_START:
+            # a number cut off at the end of the buffer would still parse, so
+            # read on until the character after it
+            while not _NUMBER_END.search(self.buffer, self.pos) and self.fill():
+                pass
+        # the value is parsed from the start each time more is read, so the
+        # reads grow in size to keep parsing a large value linear in its size
+        size = self.chunk_size
+        while True:
+            try:
+                (value, self.pos) = self.json_decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                if not _is_cut_off(e):
+                    raise
+                # the value may just be cut off at the end of the buffer
+                if not self.fill(size):
+                    raise IncompleteJSONError(e.msg, e.doc, e.pos) from e
+                size *= 2
+            else:
+                return value
+
+    def find(self, key, values=None):
+        """
+        Skip ahead to the value of key in the object which comes next,
+        adding the values passed over to values if it is given
+        """
+        for _ in self._iter_members('{', '}'):
+            name = self.decode()
+            self.expect(':')
+            if name == key:
+                return
+            if values is None:
+                self.skip()
+            else:
+                values[name] = self.decode()
+        raise KeyError(key)
+
+    def iter_array(self):
+        """Parse the items of the array which comes next one at a time"""
+        for _ in self._iter_members('[', ']'):
+            yield self.decode()
+
+    def skip(self):
+        """Skip over the next value, without parsing the arrays and objects within it as a whole"""
+        character = self.peek()
+        if character == '[':
+            for _ in self._iter_members('[', ']'):
+                self.skip()
+        elif character == '{':
+            for _ in self._iter_members('{', '}'):
+                self.decode()
+                self.expect(':')
+                self.skip()
+        else:
+            self.decode()
+
+    def _iter_members(self, start, end):
+        """Consume the brackets and separators of the array or object which comes next"""
+        self.expect(start)
+        if self.peek() == end:
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.expect(',' + end) == end:
+                return
+
+
+def _is_cut_off(error):
+    """Whether a json.JSONDecodeError may be down to the text having been cut off"""
+    return error.pos >= len(error.doc) - _CUT_OFF_LENGTH or error.msg.startswith('Unterminated string')
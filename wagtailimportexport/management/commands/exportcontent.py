@@ -1,12 +1,18 @@
 import os, logging
-from django.core.management.base import BaseCommand
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
 from wagtailimportexport.exporting import (
-    export_pages,
+    COMPRESSION_METHODS,
     export_snippets,
     export_image_data,
-    zip_content,
+    get_export_source,
+    iter_export_pages,
+    parse_timestamp,
+    write_zip_content,
 )
 from wagtailimportexport.compat import Page
+from wagtailimportexport.references import ExportReferences
 
 logger = logging.getLogger(__name__)
 
@@ -34,16 +40,123 @@ class Command(BaseCommand):
             action="store_true",
             help='null users in page and image data',
         )
+        parser.add_argument(
+            '-c',
+            '--compact',
+            action="store_true",
+            help='write content.json without indentation',
+        )
+        parser.add_argument(
+            '--compression',
+            choices=list(COMPRESSION_METHODS),
+            help='the compression of content.json and of images which are not already compressed '
+                 '(default WAGTAILIMPORTEXPORT_EXPORT_COMPRESSION, or deflate)',
+        )
+        parser.add_argument(
+            '-p',
+            '--processes',
+            type=int,
+            default=1,
+            help='the number of worker processes which serialize the pages, from Python 3.7 (default 1)',
+        )
+        parser.add_argument(
+            '--snippets',
+            choices=['all', 'referenced'],
+            help='export all snippets, or only those referenced by the exported pages '
+                 '(default all, or referenced with --since or --watermark)',
+        )
+        parser.add_argument(
+            '--images',
+            choices=['all', 'referenced'],
+            help='export all images, or only those referenced by the exported pages '
+                 '(default all, or referenced with --since or --watermark)',
+        )
+        parser.add_argument(
+            '--snippet-model',
+            action='append',
+            dest='snippet_models',
+            help='a snippet model to export, as app_label.ModelName; may be given more than once '
+                 '(default all snippet models)',
+        )
+        parser.add_argument(
+            '--content-addressed',
+            action="store_true",
+            help='store each distinct image file once, named by the hash of its content',
+        )
+        parser.add_argument(
+            '--known-hashes',
+            help='a file listing the hashes of the image files the destination site already has, '
+                 'as written by the imagehashes command, which are left out of the export '
+                 '(implies --content-addressed)',
+        )
+
+        parser.add_argument(
+            '--since',
+            help='only export pages published or revised since this ISO 8601 timestamp, '
+                 'along with their ancestors',
+        )
+        parser.add_argument(
+            '--watermark',
+            help='a file holding the time of the last export: only pages published or revised since '
+                 'then are exported (unless --since is given), and the time of this export is written to it',
+        )
 
     def handle(self, *args, **options):
         logger.debug(options)
+        exported_at = timezone.now()
+        since = options['since']
+        if since is None and options['watermark'] and os.path.exists(options['watermark']):
+            with open(options['watermark']) as f:
+                since = f.read().strip()
+        if since is not None:
+            try:
+                since = parse_timestamp(since)
+            except ValueError as e:
+                raise CommandError(e)
+
+        known_hashes = set()
+        if options['known_hashes']:
+            with open(options['known_hashes']) as f:
+                known_hashes = set(f.read().split())
+
+        snippet_models = None
+        if options['snippet_models']:
+            try:
+                snippet_models = [apps.get_model(label) for label in options['snippet_models']]
+            except (LookupError, ValueError) as e:
+                raise CommandError(e)
+
+        pages = iter_export_pages(
+            export_unpublished=options['all_pages'],
+            null_users=options['null_users'],
+            since=since,
+            processes=options['processes'])
+        # a delta export only includes the snippets and images its pages reference by default,
+        # rather than copying all of them again each time
+        default_objects = 'all' if since is None else 'referenced'
+        snippets = options['snippets'] or default_objects
+        images = options['images'] or default_objects
+        references = None
+        if 'referenced' in (snippets, images):
+            references = ExportReferences()
+            pages = references.collect(pages)
+
         content_data = {
-            'pages': export_pages(
-                export_unpublished=options['all_pages'],
-                null_users=options['null_users']),
-            'snippets': export_snippets(),
-            'images': export_image_data(null_users=options['null_users']),
+            'source': get_export_source(),
+            'pages': pages,
+            'snippets': export_snippets(
+                models=snippet_models, references=references if snippets == 'referenced' else None),
+            'images': export_image_data(
+                null_users=options['null_users'],
+                content_addressed=options['content_addressed'] or bool(options['known_hashes']),
+                references=references if images == 'referenced' else None),
         }
-        fd = zip_content(content_data)
         with open(os.path.abspath(options['filename']), 'wb') as f:
-            f.write(fd)
+            write_zip_content(
+                content_data, f, compact=options['compact'], compression=options['compression'],
+                known_hashes=known_hashes)
+
+        if options['watermark']:
+            with open(options['watermark'], 'w') as f:
+                f.write(exported_at.isoformat())
+
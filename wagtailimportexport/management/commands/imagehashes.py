@@ -0,0 +1,27 @@
+import os
+from django.core.management.base import BaseCommand
+from wagtail.images import get_image_model
+
+
+class Command(BaseCommand):
+    help = ('Write the hashes of the image files of this site to a file (default image-hashes.txt), '
+            'for exportcontent --known-hashes on a source site')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-f',
+            '--filename',
+            default='image-hashes.txt',
+            type=str,
+            help='the filename for the image hashes (default image-hashes.txt)',
+        )
+
+    def handle(self, *args, **options):
+        written = set()
+        with open(os.path.abspath(options['filename']), 'w') as f:
+            for image in get_image_model().objects.all().iterator():
+                # works out and saves the hashes of images which don't have one yet
+                file_hash = image.get_file_hash()
+                if file_hash not in written:
+                    written.add(file_hash)
+                    f.write(file_hash + '\n')
@@ -0,0 +1,44 @@
+# Generated by Django 2.0.13 on 2026-10-16 20:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('wagtailcore', '0040_page_draft_title'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('base_pages_done', models.PositiveIntegerField(default=0, verbose_name='base pages done')),
+                ('specific_pages_done', models.PositiveIntegerField(default=0, verbose_name='specific pages done')),
+                ('completed', models.BooleanField(default=False, verbose_name='completed')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created at')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='updated at')),
+                ('parent_page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='wagtailcore.Page', verbose_name='parent page')),
+            ],
+            options={
+                'verbose_name': 'import job',
+            },
+        ),
+        migrations.CreateModel(
+            name='ImportJobPage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.PositiveIntegerField()),
+                ('original_path', models.CharField(max_length=255)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pages', to='wagtailimportexport.ImportJob')),
+                ('page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='wagtailcore.Page')),
+            ],
+            options={
+                'unique_together': {('job', 'original_id')},
+            },
+        ),
+    ]
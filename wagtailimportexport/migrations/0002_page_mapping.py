@@ -0,0 +1,28 @@
+# Generated by Django 2.0.13 on 2026-10-16 20:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailcore', '0040_page_draft_title'),
+        ('wagtailimportexport', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PageMapping',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255)),
+                ('original_id', models.PositiveIntegerField()),
+                ('content_hash', models.CharField(max_length=40)),
+                ('page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='wagtailcore.Page')),
+            ],
+            options={
+                'unique_together': {('source', 'original_id')},
+            },
+        ),
+    ]
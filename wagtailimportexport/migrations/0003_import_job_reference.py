@@ -0,0 +1,27 @@
+# Generated by Django 2.0.13 on 2026-10-16 21:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('wagtailcore', '0040_page_draft_title'),
+        ('wagtailimportexport', '0002_page_mapping'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJobReference',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('attname', models.CharField(max_length=255)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.ContentType')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='references', to='wagtailimportexport.ImportJob')),
+                ('page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='wagtailcore.Page')),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.0.13 on 2026-10-16 23:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('wagtailimportexport', '0003_import_job_reference'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ObjectMapping',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255)),
+                ('original_id', models.PositiveIntegerField()),
+                ('object_id', models.PositiveIntegerField()),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.ContentType')),
+            ],
+            options={
+                'unique_together': {('source', 'content_type', 'original_id')},
+            },
+        ),
+    ]
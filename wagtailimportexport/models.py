@@ -0,0 +1,90 @@
+from django.db import models
+from django.utils.translation import ugettext_lazy as _
+
+
+class ImportJob(models.Model):
+    """
+    The progress of a checkpointed import (see importing.import_pages),
+    from which it can be resumed after a failure
+    """
+    parent_page = models.ForeignKey(
+        'wagtailcore.Page', on_delete=models.CASCADE, related_name='+', verbose_name=_("parent page"))
+    base_pages_done = models.PositiveIntegerField(_("base pages done"), default=0)
+    specific_pages_done = models.PositiveIntegerField(_("specific pages done"), default=0)
+    completed = models.BooleanField(_("completed"), default=False)
+    created_at = models.DateTimeField(_("created at"), auto_now_add=True)
+    updated_at = models.DateTimeField(_("updated at"), auto_now=True)
+
+    class Meta:
+        verbose_name = _("import job")
+
+    def __str__(self):
+        return "Import #%s" % self.pk
+
+    def get_page_mappings(self):
+        """
+        Return the pages created so far, by their original path and by their
+        original id
+        """
+        pages_by_original_path = {}
+        pages_by_original_id = {}
+        for job_page in self.pages.select_related('page').order_by('page__path'):
+            pages_by_original_path[job_page.original_path] = job_page.page
+            pages_by_original_id[job_page.original_id] = job_page.page
+        return (pages_by_original_path, pages_by_original_id)
+
+
+class ImportJobPage(models.Model):
+    """The new page created by an import job for a page of the source site"""
+    job = models.ForeignKey(ImportJob, on_delete=models.CASCADE, related_name='pages')
+    original_id = models.PositiveIntegerField()
+    original_path = models.CharField(max_length=255)
+    page = models.ForeignKey('wagtailcore.Page', on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        unique_together = [('job', 'original_id')]
+
+
+class PageMapping(models.Model):
+    """
+    The page of the destination site which was imported from a page of a
+    source site by an upsert import, and a hash of the page's exported
+    content at the time, so that later imports of it can update that page
+    only if it has changed
+    """
+    source = models.CharField(max_length=255)
+    original_id = models.PositiveIntegerField()
+    page = models.ForeignKey('wagtailcore.Page', on_delete=models.CASCADE, related_name='+')
+    content_hash = models.CharField(max_length=40)
+
+    class Meta:
+        unique_together = [('source', 'original_id')]
+
+
+class ImportJobReference(models.Model):
+    """
+    A foreign key, of an object created by an import job, to a page whose
+    specific page is yet to be created, which is set once it has been (see
+    importing.DeferredPageReferences)
+    """
+    job = models.ForeignKey(ImportJob, on_delete=models.CASCADE, related_name='references')
+    content_type = models.ForeignKey('contenttypes.ContentType', on_delete=models.CASCADE, related_name='+')
+    object_id = models.PositiveIntegerField()
+    attname = models.CharField(max_length=255)
+    page = models.ForeignKey('wagtailcore.Page', on_delete=models.CASCADE, related_name='+')
+
+
+class ObjectMapping(models.Model):
+    """
+    The snippet or image of the destination site which was imported from
+    one of a source site by an upsert import (see importing.import_zip),
+    so that later imports of it update that object rather than adding
+    another
+    """
+    source = models.CharField(max_length=255)
+    content_type = models.ForeignKey('contenttypes.ContentType', on_delete=models.CASCADE, related_name='+')
+    original_id = models.PositiveIntegerField()
+    object_id = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = [('source', 'content_type', 'original_id')]
@@ -0,0 +1,222 @@
+import json
+import re
+from collections import defaultdict
+from functools import lru_cache
+
+from django.apps import apps
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from modelcluster.models import get_all_child_relations
+from wagtail.core import blocks
+from wagtail.core.fields import RichTextField, StreamField
+from wagtail.images import get_image_model
+from wagtail.images.blocks import ImageChooserBlock
+from wagtail.snippets.blocks import SnippetChooserBlock
+from wagtail.snippets.models import SNIPPET_MODELS
+
+
+# a link to a page in rich text, as stored in the database, with its page id as group 1
+PAGE_LINK_RE = re.compile(r"""<a\b(?=[^>]*\blinktype=["']page["'])[^>]*(?<![-\w])id=["'](\d+)["'][^>]*>""")
+
+# an image embedded in rich text, as stored in the database, with its image id as group 1
+IMAGE_EMBED_RE = re.compile(r"""<embed\b(?=[^>]*\bembedtype=["']image["'])[^>]*(?<![-\w])id=["'](\d+)["'][^>]*>""")
+
+
+def map_block_value(block, value, func):
+    """
+    Rebuild the raw JSON value of a StreamField block, as stored in the
+    database, replacing the value of each block within it which is not a
+    StreamBlock, StructBlock or ListBlock with func(block, value)
+    """
+    if isinstance(block, blocks.StreamBlock):
+        if not isinstance(value, list):
+            return value
+        return [
+            dict(child, value=map_block_value(block.child_blocks[child['type']], child.get('value'), func))
+            if isinstance(child, dict) and child.get('type') in block.child_blocks else child
+            for child in value
+        ]
+    if isinstance(block, blocks.StructBlock):
+        if not isinstance(value, dict):
+            return value
+        return dict(value, **{
+            name: map_block_value(child_block, value[name], func)
+            for (name, child_block) in block.child_blocks.items() if name in value
+        })
+    if isinstance(block, blocks.ListBlock):
+        if not isinstance(value, list):
+            return value
+        # lists are stored as {'type': 'item', 'value': ..., 'id': ...} items since Wagtail 2.16
+        if value and isinstance(value[0], dict) and value[0].get('type') == 'item' and 'value' in value[0]:
+            return [dict(item, value=map_block_value(block.child_block, item['value'], func)) for item in value]
+        return [map_block_value(block.child_block, item, func) for item in value]
+    return func(block, value)
+
+
+def load_stream_data(value):
+    """Return the raw JSON value of a StreamField from exported data, which holds it as a JSON string"""
+    if isinstance(value, str):
+        try:
+            return json.loads(value) if value else []
+        except ValueError:
+            # a StreamField which was converted from a text field may still hold plain text
+            return None
+    return value
+
+
+class ExportReferences:
+    """
+    The ids of the snippets and images referenced by exported pages,
+    through foreign keys, chooser blocks in StreamFields, images embedded
+    in rich text and the same references of inline child objects
+
+    collect() passes on page records, as generated by
+    exporting.iter_export_pages, noting the objects they reference, so
+    that export_snippets(references=...) and
+    export_image_data(references=...) can export only those objects once
+    the pages have been exported.
+    """
+    def __init__(self):
+        self.ids = defaultdict(set)
+        self.complete = False
+        self._fields = {}
+
+    def collect(self, page_records):
+        for page_record in page_records:
+            model = apps.get_model(page_record['app_label'], page_record['model'])
+            self.add_data(model, page_record['content'])
+            yield page_record
+        self.complete = True
+
+    def add_data(self, model, data):
+        """Note the objects referenced by the exported data of an instance of model and its child objects"""
+        (object_fks, rich_text_fields, stream_fields) = self._get_fields(model)
+        for field in object_fks:
+            value = data.get(field.name)
+            if value is not None:
+                self.ids[field.related_model].add(value)
+        for field in rich_text_fields:
+            self._add_rich_text(data.get(field.name))
+        for field in stream_fields:
+            stream_data = load_stream_data(data.get(field.name))
+            if stream_data:
+                map_block_value(field.stream_block, stream_data, self._add_block_value)
+        for rel in get_all_child_relations(model):
+            for child_data in data.get(rel.get_accessor_name()) or ():
+                self.add_data(rel.related_model, child_data)
+
+    def get_ids(self, model):
+        if not self.complete:
+            raise RuntimeError("The objects referenced by the exported pages are not known until they are exported")
+        return self.ids[model]
+
+    def _add_block_value(self, block, value):
+        if isinstance(block, (SnippetChooserBlock, ImageChooserBlock)) and value is not None:
+            self.ids[block.target_model].add(value)
+        elif isinstance(block, blocks.RichTextBlock):
+            self._add_rich_text(value)
+        return value
+
+    def _add_rich_text(self, text):
+        if isinstance(text, str) and 'embedtype' in text:
+            self.ids[get_image_model()].update(int(match.group(1)) for match in IMAGE_EMBED_RE.finditer(text))
+
+    def _get_fields(self, model):
+        if model not in self._fields:
+            referenced_models = set(SNIPPET_MODELS) | {get_image_model()}
+            (rich_text_fields, stream_fields) = get_reference_fields(model)
+            self._fields[model] = (
+                [field for field in model._meta.concrete_fields
+                 if isinstance(field, models.ForeignKey) and field.related_model in referenced_models],
+                rich_text_fields,
+                stream_fields,
+            )
+        return self._fields[model]
+
+
+def rewrite_page_references(model, data, get_page_id, remapped_ids=None):
+    """
+    Return the exported data of an instance of model with the page ids in
+    its rich text fields, its StreamFields' PageChooserBlocks and rich text
+    blocks, and those of its inline child objects, rewritten by
+    get_page_id(original id), which returns the new page id or None to
+    leave the id unchanged
+
+    If remapped_ids, the new ids of other imported objects by model and
+    original id (see ModelPlanCache.remapped_ids), is given, the ids of
+    those objects in the StreamFields' other chooser blocks, such as
+    snippets and images, and of the images embedded in rich text are
+    rewritten too; ids which aren't in it are left unchanged.
+
+    The data is rewritten as it is, before any instances are built from it;
+    values which hold no references to rewrite are passed on unchanged.
+    """
+    (rich_text_fields, stream_fields) = get_reference_fields(model)
+    image_ids = remapped_ids.get(get_image_model()) if remapped_ids else None
+    changes = {}
+    for field in rich_text_fields:
+        value = data.get(field.name)
+        if value and ('linktype' in value or (image_ids and 'embedtype' in value)):
+            text = rewrite_rich_text(value, get_page_id, image_ids)
+            if text != value:
+                changes[field.name] = text
+    for field in stream_fields:
+        stream_data = load_stream_data(data.get(field.name))
+        if stream_data:
+            rewritten = map_block_value(
+                field.stream_block, stream_data,
+                lambda block, value: _rewrite_block_value(block, value, get_page_id, remapped_ids, image_ids))
+            if rewritten != stream_data:
+                changes[field.name] = json.dumps(rewritten, cls=DjangoJSONEncoder)
+    for rel in get_all_child_relations(model):
+        accessor_name = rel.get_accessor_name()
+        children = data.get(accessor_name)
+        if children:
+            rewritten = [
+                rewrite_page_references(rel.related_model, child, get_page_id, remapped_ids) for child in children]
+            if any(new is not old for (new, old) in zip(rewritten, children)):
+                changes[accessor_name] = rewritten
+    return dict(data, **changes) if changes else data
+
+
+def rewrite_rich_text(text, get_page_id, image_ids=None):
+    """
+    Rewrite the page ids of the page links in rich text by get_page_id, and
+    the image ids of its embedded images by image_ids, a dict of new ids by
+    original id, if it is given, as for rewrite_page_references
+    """
+    text = _rewrite_ids(PAGE_LINK_RE, text, get_page_id)
+    if image_ids:
+        text = _rewrite_ids(IMAGE_EMBED_RE, text, image_ids.get)
+    return text
+
+
+def _rewrite_ids(pattern, text, get_id):
+    def replace(match):
+        new_id = get_id(int(match.group(1)))
+        if new_id is None:
+            return match.group(0)
+        (start, end) = (match.start(1) - match.start(0), match.end(1) - match.start(0))
+        return match.group(0)[:start] + str(new_id) + match.group(0)[end:]
+    return pattern.sub(replace, text)
+
+
+@lru_cache(maxsize=None)
+def get_reference_fields(model):
+    """Return the rich text fields and the StreamFields of model, which may hold page, image and snippet ids"""
+    return (
+        [field for field in model._meta.concrete_fields if isinstance(field, RichTextField)],
+        [field for field in model._meta.concrete_fields if isinstance(field, StreamField)],
+    )
+
+
+def _rewrite_block_value(block, value, get_page_id, remapped_ids=None, image_ids=None):
+    if isinstance(block, blocks.PageChooserBlock) and isinstance(value, int):
+        page_id = get_page_id(value)
+        return value if page_id is None else page_id
+    if isinstance(block, blocks.ChooserBlock) and isinstance(value, int) and remapped_ids:
+        return remapped_ids.get(block.target_model, {}).get(value, value)
+    if isinstance(block, blocks.RichTextBlock) and isinstance(value, str) and (
+            'linktype' in value or (image_ids and 'embedtype' in value)):
+        return rewrite_rich_text(value, get_page_id, image_ids)
+    return value
@@ -0,0 +1,170 @@
+import http.client
+import io
+import json
+from unittest import mock
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.test import LiveServerTestCase, override_settings
+from django.urls import reverse
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from wagtailimportexport.client import ExportAPIClient, SpooledRecords
+from wagtailimportexport.compat import Page
+from wagtailimportexport.jsonstream import IncompleteJSONError, _JSONReader
+from wagtailimportexport import exporting, importing
+
+
+class FlakyAdapter(HTTPAdapter):
+    """A transport which fails some requests before or part way through their responses"""
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = list(failures)
+        self.request_count = 0
+
+    def send(self, request, **kwargs):
+        self.request_count += 1
+        failure = self.failures.pop(0) if self.failures else None
+        if failure == 'connect':
+            raise requests.ConnectionError("Connection refused")
+        if failure == 'cut-off-at-end':
+            # the closing brackets are cut off the uncompressed body
+            request.headers['Accept-Encoding'] = 'identity'
+        response = super().send(request, **kwargs)
+        if failure in ('cut-off', 'cut-off-chunked', 'cut-off-at-end'):
+            response = self.cut_off(
+                request, response, chunked=failure == 'cut-off-chunked', at_end=failure == 'cut-off-at-end')
+        elif failure is not None:
+            response.status_code = failure
+        return response
+
+    def cut_off(self, request, response, chunked, at_end=False):
+        """
+        Rebuild response as it would have been received had the connection
+        dropped half way through its body, or at_end, just before its
+        closing brackets, which is sent either in chunks or up to the close
+        of the connection
+        """
+        body = response.raw.read(decode_content=False)
+        body = body[:body.rindex(b']')] if at_end else body[:len(body) // 2]
+        headers = [
+            (name, value) for (name, value) in response.raw.headers.items()
+            if name.lower() not in ('content-length', 'transfer-encoding')
+        ]
+        if chunked:
+            # the connection drops part way through the first chunk
+            headers.append(('Transfer-Encoding', 'chunked'))
+            body = b'%x\r\n' % (len(body) * 2) + body
+        message = b'HTTP/1.1 200 OK\r\n' + b''.join(
+            ('%s: %s\r\n' % header).encode('latin-1') for header in headers) + b'\r\n' + body
+        http_response = http.client.HTTPResponse(ReceivedSocket(message), method=request.method)
+        http_response.begin()
+        raw = urllib3.HTTPResponse(
+            body=http_response, headers=http_response.getheaders(), status=http_response.status,
+            version=http_response.version, reason=http_response.reason, preload_content=False,
+            decode_content=False, original_response=http_response, request_method=request.method)
+        return self.build_response(request, raw)
+
+
+class ReceivedSocket:
+    """A socket which has received data and then been closed"""
+    def __init__(self, data):
+        self.data = data
+
+    def makefile(self, mode):
+        return io.BytesIO(self.data)
+
+
+# the export API needs no middleware, and the stand-in source site is served without any
+@override_settings(MIDDLEWARE=[])
+class TestExportAPIClient(LiveServerTestCase):
+    # the site's initial pages are flushed after each test case, so all of
+    # the stand-in source site's requests are made by a single test
+    def tearDown(self):
+        # Django 2.0 creates permissions again after the flush from the content types it has
+        # cached, which the flush has deleted
+        ContentType.objects.clear_cache()
+
+    def test_client(self):
+        """the client fetches, retries and spools the records of the export API for import"""
+        section = Page(title="Section", slug="section")
+        Page.objects.get(depth=2).add_child(instance=section)
+        for i in range(5):
+            section.add_child(instance=Page(title="Child %d" % i, slug="child-%d" % i))
+        export_url = self.live_server_url + reverse('wagtailimportexport:export', args=[section.pk])
+        expected = json.loads(json.dumps(exporting.export_pages(root_page=section), cls=DjangoJSONEncoder))
+
+        # every record is fetched a part at a time, in the background or not
+        client = ExportAPIClient(export_url, limit=2)
+        assert list(client.iter_records()) == expected
+        # along with the source site named by the export
+        assert client.source == exporting.get_export_source()
+        assert list(client.prefetch_records()) == expected
+
+        # failed requests are retried, and records received before a failure are not repeated
+        session = requests.Session()
+        adapter = FlakyAdapter(['connect', None, 503, 'cut-off', 'cut-off-chunked', None])
+        session.mount('http://', adapter)
+        client = ExportAPIClient(export_url, limit=4, backoff_factor=0, session=session)
+        assert list(client.prefetch_records()) == expected
+        assert adapter.request_count == 6
+        # responses cut off part way through fail as they would over a dropped connection
+        client = ExportAPIClient(export_url, retries=0, session=session)
+        adapter.failures = ['cut-off']
+        with self.assertRaises(IncompleteJSONError):
+            list(client.iter_records())
+        adapter.failures = ['cut-off-chunked']
+        with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+            list(client.iter_records())
+        adapter.failures = [404]
+        with self.assertRaises(requests.HTTPError):
+            list(client.iter_records())
+        adapter.failures = ['connect'] * 3
+        with self.assertRaises(requests.ConnectionError):
+            list(ExportAPIClient(export_url, retries=2, backoff_factor=0, session=session).prefetch_records())
+
+        # a part which fails after all of its records have arrived is complete, so the next part
+        # is requested rather than none of the first
+        session = requests.Session()
+        adapter = FlakyAdapter(['cut-off-at-end'])
+        session.mount('http://', adapter)
+        client = ExportAPIClient(export_url, limit=3, backoff_factor=0, session=session)
+        assert list(client.iter_records()) == expected
+        assert adapter.request_count == 3
+
+        # spooled records can be imported in two passes
+        records = SpooledRecords(ExportAPIClient(export_url, limit=4).prefetch_records())
+        records_list = list(records)
+        section.delete()
+        destination = Page.objects.get(depth=2)
+        assert importing.import_pages({'pages': records}, destination) == 6
+        assert list(records) == records_list == expected
+        assert Page.objects.get(slug='child-4').get_parent().slug == 'section'
+        records.close()
+
+        # a part which fails part way is requested again after the last record received, so
+        # that no records are missed when pages already received are deleted in the meantime
+        section = Page.objects.get(slug='section')
+        export_url = self.live_server_url + reverse('wagtailimportexport:export', args=[section.pk])
+        expected = json.loads(json.dumps(exporting.export_pages(root_page=section), cls=DjangoJSONEncoder))
+        session = requests.Session()
+        # uncompressed, so that the response is cut off half way through its records
+        session.headers['Accept-Encoding'] = 'identity'
+        session.mount('http://', FlakyAdapter(['cut-off']))
+        records = ExportAPIClient(export_url, backoff_factor=0, session=session).iter_records()
+        received = [next(records), next(records)]
+        Page.objects.get(slug='child-0').delete()
+        assert received + list(records) == expected
+
+        # a record much larger than the chunks of the response is read in reads of growing size,
+        # rather than decoded again as each chunk arrives
+        section.add_child(instance=Page(title="Large", slug="large", search_description="Large. " * 1000000))
+        expected = json.loads(json.dumps(exporting.export_pages(root_page=section), cls=DjangoJSONEncoder))
+        session = requests.Session()
+        session.headers['Accept-Encoding'] = 'identity'
+        with mock.patch.object(_JSONReader, 'fill', autospec=True, side_effect=_JSONReader.fill) as fill:
+            records = SpooledRecords(ExportAPIClient(export_url, session=session).iter_records())
+            assert list(records) == expected
+        assert fill.call_count < 20
+        assert list(records) == expected
+        records.close()
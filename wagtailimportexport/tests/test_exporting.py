@@ -1,14 +1,70 @@
+import io
 import json
 import os
 import tempfile
 import zipfile
+from concurrent.futures import Future
+from unittest import mock, skipUnless
 from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from wagtail.images import get_image_model
 from wagtail_factories import ImageFactory
 from wagtailimportexport.compat import Page
 from wagtailimportexport import exporting  # read this aloud
-from testapp.models import TestSnippet
+from wagtailimportexport.references import ExportReferences
+from testapp.models import TestPage, TestPageRelatedLink, TestSnippet
+
+
+class InlineExecutor:
+    """
+    A stand-in for the ProcessPoolExecutor of a parallel export, which runs
+    its tasks in this thread, and so with this test's database connection,
+    once their results are needed: each task is run along with the next one
+    submitted, which finishes first
+    """
+    def __init__(self, max_workers, mp_context=None, initializer=None, initargs=()):
+        self.max_workers = max_workers
+        self.mp_context = mp_context
+        self.futures = []
+        self.max_pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def submit(self, fn, *args):
+        future = InlineFuture(self, fn, args)
+        self.futures.append(future)
+        self.max_pending = max(self.max_pending, len(self.get_pending()))
+        return future
+
+    def get_pending(self):
+        return [future for future in self.futures if not future.done()]
+
+    def run(self, future):
+        index = self.futures.index(future)
+        for future in reversed(self.futures[index:index + 2]):
+            if not future.done():
+                future.set_result(future.fn(*future.args))
+
+
+class InlineFuture(Future):
+    def __init__(self, executor, fn, args):
+        super().__init__()
+        (self.executor, self.fn, self.args) = (executor, fn, args)
+
+    def result(self, timeout=None):
+        if not self.done():
+            self.executor.run(self)
+        return super().result(timeout)
 
 
 class TestExportingPages(TestCase):
@@ -53,35 +109,371 @@ class TestExportingPages(TestCase):
         page_json = json.dumps(page_data, cls=DjangoJSONEncoder)
         assert '"owner": %d' % user.pk not in page_json
 
+    def test_iter_export_pages(self):
+        """iterating pages in small chunks yields the same records as export_pages, pruning included."""
+        root_page = Page.objects.first()
+        section = Page(title="Section", slug="section")
+        root_page.add_child(instance=section)
+        section.add_child(instance=Page(title="Published Child", slug="published-child"))
+        hidden = Page(title="Hidden Section", slug="hidden-section")
+        root_page.add_child(instance=hidden)
+        orphan = hidden.add_child(instance=Page(title="Orphaned Child", slug="orphaned-child"))
+        orphan.add_child(instance=Page(title="Orphaned Grandchild", slug="orphaned-grandchild"))
+        hidden.unpublish()
+
+        # the unpublished subtree is pruned by the query, and never fetched
+        hidden_slugs = ['hidden-section', 'orphaned-child', 'orphaned-grandchild']
+        assert not exporting.get_export_queryset(root_page).filter(slug__in=hidden_slugs).exists()
+        assert exporting.get_export_queryset(
+            root_page, export_unpublished=True).filter(slug__in=hidden_slugs).count() == 3
+        assert exporting.get_export_queryset(section).filter(slug='published-child').exists()
+
+        page_iter = exporting.iter_export_pages(chunk_size=1)
+        assert not isinstance(page_iter, list)
+        page_data = list(page_iter)
+        assert page_data == exporting.export_pages()
+        titles = [page['content']['title'] for page in page_data]
+        assert "Published Child" in titles
+        assert "Hidden Section" not in titles
+        assert "Orphaned Child" not in titles
+
+        # each chunk can be serialized on its own, as by the worker processes of a parallel export
+        chunks = list(exporting._iter_page_chunks(exporting.get_export_queryset(root_page), root_page, chunk_size=2))
+        assert len(chunks) > 1
+        assert [record for page_keys in chunks for record in exporting.export_page_chunk(page_keys)] == page_data
+        assert exporting.export_pages(processes=1) == page_data
+
+    @skipUnless(connection.vendor == 'sqlite', "counts the instructions run by SQLite")
+    def test_export_queryset_scales_linearly(self):
+        """the work of pruning unpublished subtrees grows with the number of pages, not with its square"""
+        root_page = Page.objects.first()
+
+        def add_sections(count):
+            for i in range(count):
+                section = root_page.add_child(instance=Page(title="Section", slug="section-%d" % Page.objects.count()))
+                section.add_child(instance=Page(title="Child", slug="child"))
+                hidden = root_page.add_child(instance=Page(title="Hidden", slug="hidden-%d" % Page.objects.count()))
+                hidden.add_child(instance=Page(title="Child", slug="child"))
+                hidden.unpublish()
+
+        def count_steps():
+            steps = []
+            connection.ensure_connection()
+            connection.connection.set_progress_handler(lambda: steps.append(None), 10)
+            try:
+                page_ids = list(exporting.get_export_queryset(root_page).values_list('pk', flat=True))
+            finally:
+                connection.connection.set_progress_handler(None, 0)
+            return (len(page_ids), len(steps))
+
+        add_sections(20)
+        (small_count, small_steps) = count_steps()
+        add_sections(20)
+        (large_count, large_steps) = count_steps()
+        assert large_count == small_count + 40
+        # comparing every live page with every unpublished one would take about four times as long
+        assert large_steps < 3 * small_steps
+
+    def test_iter_export_pages_in_parallel(self):
+        """the chunks of a parallel export are generated in order, two per process at most at a time"""
+        root_page = Page.objects.first()
+        for i in range(10):
+            root_page.add_child(instance=Page(title="Page %d" % i, slug="page-%d" % i))
+        page_data = exporting.export_pages()
+        executors = []
+
+        def create_executor(*args, **kwargs):
+            executors.append(InlineExecutor(*args, **kwargs))
+            return executors[-1]
+
+        with mock.patch.object(exporting, 'ProcessPoolExecutor', create_executor), \
+                mock.patch.object(exporting, 'PROCESS_POOL_SUPPORTED', True):
+            assert list(exporting.iter_export_pages(chunk_size=1, processes=2)) == page_data
+            executor = executors.pop()
+            assert executor.mp_context.get_start_method() == 'spawn'
+            assert len(executor.futures) == len(page_data)
+            assert executor.max_pending == 4
+
+            # the chunks which are waiting when the records are no longer wanted are cancelled
+            records = exporting.iter_export_pages(chunk_size=1, processes=2)
+            assert next(records) == page_data[0]
+            records.close()
+            executor = executors.pop()
+            assert not executor.get_pending()
+            assert [future.cancelled() for future in executor.futures] == [False, False, True, True]
+
+        # before Python 3.7 the pages are serialized by this process instead
+        with mock.patch.object(exporting, 'ProcessPoolExecutor', create_executor), \
+                mock.patch.object(exporting, 'PROCESS_POOL_SUPPORTED', False):
+            assert list(exporting.iter_export_pages(chunk_size=1, processes=2)) == page_data
+        assert not executors
+
+    def test_iter_export_pages_in_parts(self):
+        """pages exported a part at a time after the last path of the previous part add up to the whole export"""
+        root_page = Page.objects.first()
+        section = Page(title="Section", slug="section")
+        root_page.add_child(instance=section)
+        for i in range(3):
+            section.add_child(instance=Page(title="Child %d" % i, slug="child-%d" % i))
+        hidden = Page(title="Hidden Section", slug="hidden-section")
+        section.add_child(instance=hidden)
+        hidden.add_child(instance=Page(title="Orphaned Child", slug="orphaned-child"))
+        hidden.unpublish()
+        section.add_child(instance=Page(title="Last Child", slug="last-child"))
+
+        expected = exporting.export_pages()
+        for limit in (1, 2, 3):
+            page_data = []
+            after = None
+            while True:
+                part = list(exporting.iter_export_pages(after=after, limit=limit, chunk_size=2))
+                page_data.extend(part)
+                if len(part) < limit:
+                    break
+                after = part[-1]['content']['path']
+            assert page_data == expected
+
+    def test_iter_export_pages_since(self):
+        """a delta export includes the pages published or revised since a time, and the ancestors which place them"""
+        root_page = Page.objects.first()
+        section = Page(title="Section", slug="section")
+        root_page.add_child(instance=section)
+        for slug in ('first', 'second', 'third'):
+            section.add_child(instance=Page(title=slug.title(), slug=slug))
+        since = timezone.now()
+        Page.objects.update(last_published_at=since, latest_revision_created_at=None)
+
+        assert exporting.export_pages(root_page=section, since=since) == []
+        second = Page.objects.get(slug='second')
+        second.title = "Second, revised"
+        second.save_revision().publish()
+        page_data = exporting.export_pages(root_page=section, since=since)
+        assert [page['content']['title'] for page in page_data] == ["Section", "Second, revised"]
+        assert [page['content']['title'] for page in exporting.export_pages(since=since)] == [
+            root_page.title, "Section", "Second, revised"]
+
+        # the ancestors of the changed pages are matched by subqueries, whose parameters are the
+        # same however many pages have changed
+        def get_param_count():
+            return len(exporting.get_export_queryset(root_page, since=since).query.sql_with_params()[1])
+        param_count = get_param_count()
+        for i in range(5):
+            other_section = Page(title="Other section %d" % i, slug="other-section-%d" % i)
+            root_page.add_child(instance=other_section)
+            other_section.add_child(instance=Page(title="Other page %d" % i, slug="other-page"))
+        Page.objects.filter(slug='other-page').update(last_published_at=timezone.now())
+        assert [page['content']['title'] for page in exporting.export_pages(since=since)][-2:] == [
+            "Other section 4", "Other page 4"]
+        assert get_param_count() == param_count
+
+    def test_exportcontent_watermark(self):
+        """exportcontent with a watermark exports the pages changed since the previous run"""
+        with tempfile.TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, 'content.zip')
+            watermark = os.path.join(tempdir, 'watermark')
+
+            def export_titles():
+                call_command('exportcontent', filename=filename, watermark=watermark)
+                with zipfile.ZipFile(filename, 'r') as zf:
+                    return [page['content']['title'] for page in json.loads(zf.read('content.json'))['pages']]
+
+            assert len(export_titles()) == Page.objects.count()
+            assert export_titles() == []
+            home_page = Page.objects.get(depth=2)
+            home_page.add_child(instance=Page(title="New Page", slug="new-page"))
+            new_page = Page.objects.get(slug='new-page')
+            new_page.save_revision().publish()
+            assert export_titles() == [Page.objects.get(depth=1).title, home_page.title, "New Page"]
+
+    def test_exportcontent_watermark_referenced_objects(self):
+        """a delta export includes only the snippets and images its pages reference, unless all are asked for"""
+        (referenced_snippet, unreferenced_snippet) = [
+            TestSnippet.objects.create(text=text) for text in ("Referenced", "Unreferenced")]
+        (referenced_image, unreferenced_image) = [ImageFactory(title=title) for title in ("Referenced", "Unreferenced")]
+        with tempfile.TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, 'content.zip')
+            watermark = os.path.join(tempdir, 'watermark')
+
+            def export_content(**options):
+                call_command('exportcontent', filename=filename, watermark=watermark, **options)
+                with zipfile.ZipFile(filename, 'r') as zf:
+                    content_data = json.loads(zf.read('content.json'))
+                return (
+                    [record['text'] for record in content_data['snippets']['testapp.TestSnippet']],
+                    [record['title'] for record in content_data['images']],
+                )
+
+            assert export_content() == (["Referenced", "Unreferenced"], ["Referenced", "Unreferenced"])
+            home_page = Page.objects.get(depth=2)
+            home_page.add_child(instance=TestPage(
+                title="New Page", slug="new-page", snippet=referenced_snippet, image=referenced_image))
+            TestPage.objects.filter(slug='new-page').update(last_published_at=timezone.now())
+            assert export_content() == (["Referenced"], ["Referenced"])
+            assert export_content(snippets='all', images='all') == (
+                ["Referenced", "Unreferenced"], ["Referenced", "Unreferenced"])
+
+    def test_page_data_matches_to_json(self):
+        """exported page data encodes to the same JSON as page.to_json(), StreamFields and inline children included."""
+        root_page = Page.objects.first()
+        snippet = TestSnippet.objects.create(text="Hi, folks, Snippy here.")
+        target_page = Page(title="Target Page", slug="target-page")
+        root_page.add_child(instance=target_page)
+        new_page = TestPage(
+            title="This is the New Page",
+            slug="new-page",
+            body=json.dumps([
+                {'type': 'heading', 'value': "Streaming"},
+                {'type': 'paragraph', 'value': '<p><a linktype="page" id="%d">Target</a></p>' % target_page.pk},
+                {'type': 'page', 'value': target_page.pk},
+                {'type': 'snippet', 'value': snippet.pk},
+            ]),
+            related_page=target_page,
+            related_links=[
+                TestPageRelatedLink(title="First link", link_page=target_page),
+                TestPageRelatedLink(title="Second link", link_page=root_page),
+            ],
+        )
+        root_page.add_child(instance=new_page)
+
+        page_data = exporting.export_pages()
+        record = next(page for page in page_data if page['content']['pk'] == new_page.pk)
+        assert record['model'] == 'testpage'
+        assert len(record['content']['related_links']) == 2
+        expected = json.loads(TestPage.objects.get(pk=new_page.pk).to_json())
+        assert json.loads(json.dumps(record['content'], cls=DjangoJSONEncoder)) == expected
+
+    def test_export_pages_query_count(self):
+        """the number of queries to export pages with inline children doesn't grow with the number of pages"""
+        root_page = Page.objects.first()
+
+        def add_pages(count):
+            for i in range(count):
+                root_page.add_child(instance=TestPage(
+                    title="Page %d" % i,
+                    slug="page-%d-%d" % (count, i),
+                    related_links=[
+                        TestPageRelatedLink(title="Link", link_page=root_page),
+                        TestPageRelatedLink(title="Another link", link_page=root_page),
+                    ],
+                ))
+                root_page.add_child(instance=Page(title="Plain page %d" % i, slug="plain-%d-%d" % (count, i)))
+
+        add_pages(2)
+        exporting.export_pages()
+        # the root page, the base pages, then the pages and the inline children of each model
+        with CaptureQueriesContext(connection) as queries:
+            page_data = exporting.export_pages()
+        add_pages(8)
+        with self.assertNumQueries(len(queries)):
+            assert len(exporting.export_pages()) == len(page_data) + 16
+
+
+@skipUnless(exporting.PROCESS_POOL_SUPPORTED, "parallel exports need Python 3.7")
+class TestExportingPagesInParallel(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("the worker processes can't connect to an in-memory test database")
+
+    def tearDown(self):
+        # Django 2.0 creates permissions again after the flush from the content types it has
+        # cached, which the flush has deleted
+        ContentType.objects.clear_cache()
+
+    def test_iter_export_pages_in_parallel(self):
+        """worker processes serialize the pages from the test database, in the same order as this process"""
+        root_page = Page.objects.filter(depth=1).first() or Page.add_root(instance=Page(title="Root", slug="root"))
+        for i in range(6):
+            root_page.add_child(instance=TestPage(
+                title="Page %d" % i, slug="page-%d" % i,
+                related_links=[TestPageRelatedLink(title="Link %d" % i, link_page=root_page, sort_order=0)]))
+        page_data = exporting.export_pages(root_page=root_page)
+        assert list(exporting.iter_export_pages(root_page=root_page, chunk_size=2, processes=2)) == page_data
+
 
 class TestExportingSnippets(TestCase):
     def test_export_snippets(self):
-        """exporting snippets returns a list of all snippets in the database"""
+        """exporting snippets returns the records of all snippets in the database, by model"""
         snippet = TestSnippet.objects.create(text="Hi, folks, Snippy here.")
-        snippet_data = exporting.export_snippets()
+        snippet_data = {key: list(records) for (key, records) in exporting.export_snippets().items()}
         snippet_json = json.dumps(snippet_data, cls=DjangoJSONEncoder)
         assert '"text": "%s"' % snippet.text in snippet_json
 
+    def test_export_referenced_snippets(self):
+        """snippets can be exported by model, or only those referenced by the exported pages"""
+        (by_fk, by_block, unreferenced) = [
+            TestSnippet.objects.create(text=text) for text in ("By foreign key", "By block", "Unreferenced")]
+        root_page = Page.objects.first()
+        section = root_page.add_child(instance=Page(title="Section", slug="section"))
+        section.add_child(instance=TestPage(
+            title="Referencing", slug="referencing", snippet=by_fk,
+            body=json.dumps([{'type': 'snippet', 'value': by_block.pk}, {'type': 'heading', 'value': "Hi"}]),
+        ))
+        root_page.add_child(instance=TestPage(title="Not exported", slug="not-exported", snippet=unreferenced))
+
+        snippet_data = exporting.export_snippets(models=[])
+        assert snippet_data == {}
+
+        references = ExportReferences()
+        snippet_data = exporting.export_snippets(references=references)
+        with self.assertRaises(RuntimeError):
+            list(snippet_data['testapp.TestSnippet'])
+        snippet_data = exporting.export_snippets(models=[TestSnippet], references=references)
+        assert len(list(references.collect(exporting.iter_export_pages(root_page=section)))) == 2
+        assert [record['text'] for record in snippet_data['testapp.TestSnippet']] == ["By foreign key", "By block"]
+
+    def test_export_referenced_images(self):
+        """only the images referenced by the exported pages are exported, by foreign key, block or rich text"""
+        (by_fk, by_block, by_rich_text, unreferenced) = [
+            ImageFactory(title=title) for title in ("By foreign key", "By block", "By rich text", "Unreferenced")]
+        root_page = Page.objects.first()
+        root_page.add_child(instance=TestPage(
+            title="Referencing", slug="referencing", image=by_fk,
+            body=json.dumps([
+                {'type': 'image', 'value': by_block.pk},
+                {'type': 'paragraph', 'value': '<embed embedtype="image" format="left" id="%d"/>' % by_rich_text.pk},
+            ]),
+        ))
+        references = ExportReferences()
+        image_data = exporting.export_image_data(references=references)
+        list(references.collect(exporting.iter_export_pages(root_page=root_page)))
+        assert [record['title'] for record in image_data] == ["By foreign key", "By block", "By rich text"]
+
 
 class TestExportingImages(TestCase):
     def test_export_images(self):
         """exporting image data returns a list of images in the database"""
         image = ImageFactory(title="Very blue.")
-        image_data = exporting.export_image_data()
+        image_data = list(exporting.export_image_data())
         image_json = json.dumps(image_data, cls=DjangoJSONEncoder)
         assert '"title": "%s"' % image.title in image_json
 
+    def test_export_images_as_generator(self):
+        """image records are generated from the rows' values, the same as the data of the image instances"""
+        images = [ImageFactory(title="Image %d" % i) for i in range(5)]
+        image_data = exporting.export_image_data(chunk_size=2)
+        assert next(image_data) == exporting.instance_to_data(get_image_model().objects.get(pk=images[0].pk))
+        assert [image_def['title'] for image_def in image_data] == ["Image %d" % i for i in range(1, 5)]
+
+    def test_export_image_sizes(self):
+        """the sizes of image files are taken from their rows, and only from storage where the rows have none"""
+        image = ImageFactory(title="Very blue.")
+        ImageModel = get_image_model()
+        ImageModel.objects.filter(pk=image.pk).update(file_size=12345)
+        assert next(exporting.export_image_data())['file']['size'] == 12345
+        ImageModel.objects.filter(pk=image.pk).update(file_size=None)
+        assert next(exporting.export_image_data())['file']['size'] == image.file.size
+
     def test_export_images_null_user(self):
         """exporting images with null_users=True nulls the uploaded_by_user_id field"""
         user = User.objects.create(username='TEST USER')
         image = ImageFactory(title="Very blue.", uploaded_by_user=user)
 
-        image_data = exporting.export_image_data()  # default null_users=False
+        image_data = list(exporting.export_image_data())  # default null_users=False
         image_json = json.dumps(image_data, cls=DjangoJSONEncoder)
         assert '"title": "%s"' % image.title in image_json
         assert '"uploaded_by_user_id": %d' % user.pk in image_json
 
-        image_data = exporting.export_image_data(null_users=True)
+        image_data = list(exporting.export_image_data(null_users=True))
         image_json = json.dumps(image_data, cls=DjangoJSONEncoder)
         assert len(image_data) == 1
         assert '"title": "%s"' % image.title in image_json
@@ -118,4 +510,120 @@ class TestExportingZipContent(TestCase):
         content_data = json.loads(content_json)
         assert len(content_data['pages']) > 1
         assert len(content_data['images']) == 1
-        assert len(content_data['snippets']) == 1
+        # the records of each snippet model, of which the test app has two
+        assert len(content_data['snippets']) == 2
+        assert len(content_data['snippets']['testapp.TestSnippet']) == 1
+
+    def test_iter_zip_content(self):
+        """streaming the content zip yields it in chunks, with images copied intact from storage"""
+        image = ImageFactory(title="Very blue.")
+        content_data = {
+            'pages': exporting.export_pages(),
+            'snippets': exporting.export_snippets(),
+            'images': list(exporting.export_image_data()),
+        }
+        chunks = list(exporting.iter_zip_content(content_data, chunk_size=64))
+        assert len(chunks) > 2
+        with image.file.open('rb') as f:
+            image_bytes = f.read()
+        with zipfile.ZipFile(io.BytesIO(b''.join(chunks)), 'r') as zf:
+            assert zf.read(image.file.name) == image_bytes
+            assert json.loads(zf.read('content.json').decode('utf-8'))['images'][0]['title'] == image.title
+
+        with tempfile.TemporaryFile() as f:
+            exporting.write_zip_content(content_data, f)
+            f.seek(0)
+            with zipfile.ZipFile(f, 'r') as zf:
+                assert zf.read(image.file.name) == image_bytes
+
+    def test_zip_content_from_generators(self):
+        """page generators are written to content.json, indented or compact"""
+        image = ImageFactory(title="Very blue.")
+        for compact in (False, True):
+            content_data = {
+                'pages': exporting.iter_export_pages(),
+                'snippets': exporting.export_snippets(),
+                'images': iter(exporting.export_image_data()),
+            }
+            zip_data = exporting.zip_content(content_data, compact=compact)
+            with zipfile.ZipFile(io.BytesIO(zip_data), 'r') as zf:
+                content_json = zf.read('content.json').decode('utf-8')
+                assert image.file.name in zf.namelist()
+            assert ('\n' in content_json) != compact
+            assert json.loads(content_json)['pages'] == json.loads(
+                json.dumps(exporting.export_pages(), cls=DjangoJSONEncoder))
+
+    def test_zip_content_image_prefetch(self):
+        """images read ahead by the thread pool are written in the same order and content as sequential reads"""
+        images = [ImageFactory(title="Image %d" % i) for i in range(5)]
+        sizes = [image.file.size for image in images]
+        content_data = {
+            'pages': [],
+            'snippets': {},
+            'images': list(exporting.export_image_data()),
+        }
+        # a budget that fits some images but not all of them, and one which fits none
+        for prefetch_bytes in (max(sizes) * 2, 0):
+            with self.settings(WAGTAILIMPORTEXPORT_EXPORT_IMAGE_CONCURRENCY=3,
+                               WAGTAILIMPORTEXPORT_EXPORT_IMAGE_PREFETCH_BYTES=prefetch_bytes):
+                zip_data = exporting.zip_content(content_data)
+            with zipfile.ZipFile(io.BytesIO(zip_data), 'r') as zf:
+                assert zf.namelist()[1:] == [image_def['file']['name'] for image_def in content_data['images']]
+                for image in images:
+                    with image.file.open('rb') as f:
+                        assert zf.read(image.file.name) == f.read()
+
+    def test_zip_content_addressed(self):
+        """content addressed archives store each distinct image file once, and leave out those with known hashes"""
+        ImageFactory(title="Blue")
+        ImageFactory(title="Also blue")
+        ImageFactory(title="Red", file__color='red')
+        content_data = {
+            'pages': [],
+            'snippets': {},
+            'images': list(exporting.export_image_data(content_addressed=True)),
+        }
+        file_data = [image_def['file'] for image_def in content_data['images']]
+        assert file_data[0]['hash'] == file_data[1]['hash'] != file_data[2]['hash']
+        member_names = [exporting.get_image_member_name(data) for data in file_data]
+        assert member_names[0] == 'images/%s%s' % (file_data[0]['hash'], os.path.splitext(file_data[0]['name'])[1])
+
+        for (known_hashes, expected_members) in [
+                ((), [member_names[0], member_names[2]]), ({file_data[0]['hash']}, [member_names[2]])]:
+            zip_data = exporting.zip_content(content_data, known_hashes=known_hashes)
+            with zipfile.ZipFile(io.BytesIO(zip_data), 'r') as zf:
+                assert zf.namelist() == ['content.json'] + expected_members
+                assert len(json.loads(zf.read('content.json').decode('utf-8'))['images']) == 3
+                with get_image_model().objects.get(title="Red").file.open('rb') as f:
+                    assert zf.read(member_names[2]) == f.read()
+
+    def test_export_image_hashes(self):
+        """missing image hashes are worked out from the stored files, without querying or saving each image"""
+        images = [ImageFactory(title="Image %d" % i, file__color=color) for (i, color) in enumerate(['blue', 'red'])]
+        ImageModel = get_image_model()
+        ImageModel.objects.update(file_hash='')
+        with CaptureQueriesContext(connection) as queries:
+            image_data = list(exporting.export_image_data(content_addressed=True))
+        assert len(queries) == 1
+        assert not ImageModel.objects.exclude(file_hash='').exists()
+        assert [data['file']['hash'] for data in image_data] == [image.get_file_hash() for image in images]
+
+    def test_zip_content_compression(self):
+        """content.json is compressed and already compressed images are stored as they are"""
+        image = ImageFactory(title="Very blue.")
+        content_data = {
+            'pages': exporting.export_pages(),
+            'snippets': exporting.export_snippets(),
+            'images': list(exporting.export_image_data()),
+        }
+        for (compression, json_compress_type) in [
+                (None, zipfile.ZIP_DEFLATED), ('lzma', zipfile.ZIP_LZMA), ('store', zipfile.ZIP_STORED)]:
+            zip_data = exporting.zip_content(content_data, compression=compression)
+            with zipfile.ZipFile(io.BytesIO(zip_data), 'r') as zf:
+                assert zf.getinfo('content.json').compress_type == json_compress_type
+                assert zf.getinfo(image.file.name).compress_type == zipfile.ZIP_STORED
+                assert json.loads(zf.read('content.json').decode('utf-8'))['images'][0]['title'] == image.title
+
+        assert exporting.get_compress_type('original_images/picture.bmp', 'bzip2') == zipfile.ZIP_BZIP2
+        with self.assertRaises(ValueError):
+            exporting.get_compress_type('content.json', 'zstd')
@@ -0,0 +1,605 @@
+import io
+import json
+from unittest import mock
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from wagtail.core.models import Collection
+from wagtail.images import get_image_model
+from wagtail_factories import ImageFactory
+from wagtailimportexport.compat import Page
+from wagtailimportexport import exporting, importing
+from wagtailimportexport.jsonstream import JSONArrayReader
+from wagtailimportexport.models import ImportJob, PageMapping
+from testapp.models import TestInheritedSnippet, TestPage, TestPageRelatedLink, TestSnippet, TestSnippetBase
+
+
+class ImportTestCase(TestCase):
+    def setUp(self):
+        self.home_page = Page.objects.get(depth=2)
+
+    def create_source_tree(self):
+        """Create a small tree of pages, including specific pages linking to each other, under the home page"""
+        section = Page(title="Section", slug="section")
+        self.home_page.add_child(instance=section)
+        first = Page(title="First", slug="first")
+        section.add_child(instance=first)
+        first.add_child(instance=Page(title="Grandchild", slug="grandchild"))
+        section.add_child(instance=TestPage(
+            title="Second",
+            slug="second",
+            body=json.dumps([
+                {'type': 'heading', 'value': "Streaming"},
+                {'type': 'paragraph', 'value': '<p><a linktype="page" id="%d">First</a> and '
+                                               '<a id="%d" linktype="page">Home</a></p>' % (first.pk, self.home_page.pk)},
+                {'type': 'page', 'value': first.pk},
+            ]),
+            related_page=first,
+            related_links=[
+                TestPageRelatedLink(title="First link", link_page=first, sort_order=0),
+                TestPageRelatedLink(title="Home link", link_page=self.home_page, sort_order=1),
+            ],
+        ))
+        section.add_child(instance=Page(title="Third", slug="third"))
+        return section
+
+    def export_source_tree(self):
+        """Export the source tree and delete it, so that it can be imported again into the same site"""
+        section = self.create_source_tree()
+        import_data = {'pages': exporting.export_pages(root_page=section)}
+        section.delete()
+        self.home_page.refresh_from_db()
+        return import_data
+
+    def create_destination(self, slug):
+        destination = Page(title="Destination", slug=slug)
+        self.home_page.add_child(instance=destination)
+        return destination
+
+    def get_tree(self, parent_page):
+        """Describe the tree under parent_page relative to its position, to compare imports"""
+        parent_page.refresh_from_db()
+        tree = [parent_page.numchild]
+        for page in Page.objects.descendant_of(parent_page).order_by('path').specific():
+            tree.append((
+                page.path[len(parent_page.path):],
+                page.depth - parent_page.depth,
+                page.numchild,
+                page.url_path[len(parent_page.url_path):],
+                page.title,
+                type(page),
+                getattr(page, 'related_page', None) and page.related_page.title,
+                [(link.title, link.link_page.title) for link in getattr(page, 'related_links', Page.objects.none()).all()],
+            ))
+        return tree
+
+
+class TestImportPages(ImportTestCase):
+    def test_import_pages(self):
+        """importing pages recreates the tree under the parent page, rewriting references between imported pages"""
+        import_data = self.export_source_tree()
+        destination = self.create_destination('destination')
+
+        assert importing.import_pages(import_data, destination) == 5
+        second = TestPage.objects.get(slug='second')
+        assert second.url_path == destination.url_path + 'section/second/'
+        assert second.related_page.url_path == destination.url_path + 'section/first/'
+        assert second.related_links.get(title="First link").link_page.pk == second.related_page.pk
+        assert second.related_links.get(title="Home link").link_page.pk == self.home_page.pk
+        # as are the page references within StreamFields and rich text
+        assert second.body[1].value.source == (
+            '<p><a linktype="page" id="%d">First</a> and <a id="%d" linktype="page">Home</a></p>'
+            % (second.related_page.pk, self.home_page.pk))
+        assert second.body[2].value.pk == second.related_page.pk
+
+    def test_import_pages_from_file(self):
+        """page records parsed from a file one at a time are imported as if they had been loaded all at once"""
+        import_data = self.export_source_tree()
+        destination = self.create_destination('destination')
+        importing.import_pages(import_data, destination)
+        expected = self.get_tree(destination)
+        Page.objects.get(slug='section').delete()
+
+        fp = io.BytesIO(json.dumps(import_data, cls=DjangoJSONEncoder).encode('utf-8-sig'))
+        for bulk in (False, True):
+            destination.refresh_from_db()
+            import_data = {'pages': JSONArrayReader(fp, 'pages', chunk_size=256)}
+            assert importing.import_pages(import_data, destination, bulk=bulk) == 5
+            assert self.get_tree(destination) == expected
+            Page.objects.get(slug='section').delete()
+
+    def test_upsert_import_pages(self):
+        """upserting pages updates those which were imported before and creates the rest"""
+        import_data = self.export_source_tree()
+        destination = self.create_destination('destination')
+        importing.import_pages(import_data, destination)
+        second_id = TestPage.objects.get(slug='second').pk
+
+        import_data = json.loads(json.dumps(import_data, cls=DjangoJSONEncoder))
+        (second_record, third_record) = import_data['pages'][3:5]
+        second_record['content']['title'] = "Second, revised"
+        second_record['content']['related_links'].pop(0)
+        fourth_record = json.loads(json.dumps(third_record))
+        fourth_record['content'].update(pk=third_record['content']['pk'] + 100, slug='fourth', title="Fourth",
+                                        path=third_record['content']['path'][:-4] + 'ZZZZ')
+        fourth_record['content'].pop('translation_key', None)
+        import_data['pages'].append(fourth_record)
+
+        assert importing.import_pages(import_data, destination, upsert=True) == 6
+        destination.refresh_from_db()
+        assert destination.numchild == 1
+        section = Page.objects.get(slug='section')
+        assert [page.slug for page in section.get_children()] == ['first', 'second', 'third', 'fourth']
+        second = TestPage.objects.get(slug='second')
+        assert second.pk == second_id
+        assert second.title == "Second, revised"
+        assert [link.title for link in second.related_links.all()] == ["Home link"]
+        assert second.related_page.slug == 'first'
+        assert Page.objects.filter(slug='grandchild').count() == 1
+
+        with self.assertRaises(ValueError):
+            importing.import_pages(import_data, destination, upsert=True, bulk=True)
+
+    def test_upsert_import_pages_by_mapping(self):
+        """upserts find the pages imported before from the same source, and only update those whose records changed"""
+        import_data = self.export_source_tree()
+        import_data['source'] = 'https://source.example/'
+        destination = self.create_destination('destination')
+        assert importing.import_pages(import_data, destination, upsert=True) == 5
+        assert PageMapping.objects.filter(source='https://source.example/').count() == 5
+        page_ids = set(Page.objects.descendant_of(destination).values_list('pk', flat=True))
+
+        # pages edited on the destination site are only overwritten if their records change
+        Page.objects.filter(slug='third').update(title="Third, edited")
+        Page.objects.filter(slug='first').update(slug='first-renamed')
+        import_data = json.loads(json.dumps(import_data, cls=DjangoJSONEncoder))
+        import_data['pages'][3]['content']['title'] = "Second, revised"
+        with CaptureQueriesContext(connection) as queries:
+            assert importing.import_pages(import_data, destination, upsert=True) == 5
+        assert set(Page.objects.descendant_of(destination).values_list('pk', flat=True)) == page_ids
+        assert Page.objects.get(slug='third').title == "Third, edited"
+        assert Page.objects.get(slug='second').title == "Second, revised"
+        assert not Page.objects.filter(slug='first').exists()
+        page_updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "wagtailcore_page"')]
+        assert page_updates and all('"id" = %d' % Page.objects.get(slug='second').pk in sql for sql in page_updates)
+        assert PageMapping.objects.filter(source='https://source.example/').count() == 5
+
+    def test_upsert_import_pages_renamed(self):
+        """upserting pages whose slugs have changed moves their url paths, and those of their descendants"""
+        import_data = self.export_source_tree()
+        import_data['source'] = 'https://source.example/'
+        destination = self.create_destination('destination')
+        importing.import_pages(import_data, destination, upsert=True)
+
+        import_data = json.loads(json.dumps(import_data, cls=DjangoJSONEncoder))
+        import_data['pages'][0]['content']['slug'] = 'section-renamed'
+        import_data['pages'][1]['content']['slug'] = 'first-renamed'
+        import_data['pages'][3]['content']['title'] = "Second, revised"
+        assert importing.import_pages(import_data, destination, upsert=True) == 5
+        assert Page.objects.get(slug='grandchild').url_path == (
+            destination.url_path + 'section-renamed/first-renamed/grandchild/')
+        for page in Page.objects.descendant_of(destination):
+            assert page.url_path == page.get_parent().url_path + page.slug + '/'
+
+    def test_upsert_import_pages_elsewhere(self):
+        """upserting pages under a different parent page creates them there, leaving those mapped elsewhere"""
+        import_data = self.export_source_tree()
+        import_data['source'] = 'https://source.example/'
+        first_destination = self.create_destination('first-destination')
+        importing.import_pages(import_data, first_destination, upsert=True)
+        first_ids = set(Page.objects.descendant_of(first_destination).values_list('pk', flat=True))
+
+        import_data = json.loads(json.dumps(import_data, cls=DjangoJSONEncoder))
+        import_data['pages'][3]['content']['title'] = "Second, revised"
+        for page_record in import_data['pages']:
+            # both copies are on this site, so they can't share translation keys
+            page_record['content'].pop('translation_key', None)
+        second_destination = self.create_destination('second-destination')
+        assert importing.import_pages(import_data, second_destination, upsert=True) == 5
+        assert Page.objects.descendant_of(second_destination).count() == 5
+        assert set(Page.objects.descendant_of(first_destination).values_list('pk', flat=True)) == first_ids
+        assert Page.objects.descendant_of(first_destination).get(slug='second').title == "Second"
+        assert Page.objects.descendant_of(second_destination).get(slug='second').title == "Second, revised"
+        # the mappings follow the pages which were imported last
+        assert all(
+            mapping.page.url_path.startswith(second_destination.url_path)
+            for mapping in PageMapping.objects.filter(source='https://source.example/'))
+
+    def test_bulk_import_pages(self):
+        """importing pages in bulk creates the same tree as importing them one at a time"""
+        import_data = self.export_source_tree()
+        destination = self.create_destination('destination')
+        # give the destination an existing child, to be followed by the imported pages
+        destination.add_child(instance=Page(title="Existing", slug="existing"))
+
+        importing.import_pages(import_data, destination)
+        expected = self.get_tree(destination)
+        Page.objects.get(slug='section').delete()
+
+        importing.import_pages(import_data, destination, bulk=True)
+        assert self.get_tree(destination) == expected
+        assert Page.objects.get(slug='grandchild').get_parent().slug == 'first'
+
+    def test_bulk_import_pages_batches_queries(self):
+        """importing in bulk inserts specific pages and their child objects in batches rather than one by one"""
+        section = self.create_source_tree()
+        for i in range(10):
+            section.add_child(instance=TestPage(
+                title="Extra %d" % i,
+                slug="extra-%d" % i,
+                related_links=[TestPageRelatedLink(title="Link", link_page=section)],
+            ))
+        import_data = {'pages': exporting.export_pages(root_page=section)}
+        section.delete()
+        self.home_page.refresh_from_db()
+
+        destination = self.create_destination('per-row')
+        with CaptureQueriesContext(connection) as per_row_queries:
+            importing.import_pages(import_data, destination)
+        destination.delete()
+        self.home_page.refresh_from_db()
+        with CaptureQueriesContext(connection) as bulk_queries:
+            importing.import_pages(import_data, self.create_destination('bulk'), bulk=True)
+        assert len(bulk_queries) * 10 < len(per_row_queries)
+        assert TestPageRelatedLink.objects.filter(page__url_path__startswith='/home/bulk/').count() == 12
+
+    def test_checkpointed_import_pages(self):
+        """a checkpointed import creates the same tree, and resumes from its last committed batch after a failure"""
+        import_data = self.export_source_tree()
+        destination = self.create_destination('destination')
+        importing.import_pages(import_data, destination)
+        expected = self.get_tree(destination)
+        Page.objects.get(slug='section').delete()
+
+        for bulk in (False, True):
+            destination.refresh_from_db()
+            broken_data = json.loads(json.dumps(import_data, cls=DjangoJSONEncoder))
+            broken_data['pages'][3]['model'] = 'nosuchpage'
+            job = ImportJob.objects.create(parent_page=destination)
+            with self.assertRaises(LookupError):
+                importing.import_pages(broken_data, destination, bulk=bulk, checkpoint=2, job=job)
+            job.refresh_from_db()
+            assert not job.completed
+            # the first batch of two pages was committed, in one of the two passes
+            assert (job.base_pages_done, job.specific_pages_done) == ((5, 2) if not bulk else (2, 0))
+            assert job.pages.count() == job.base_pages_done
+
+            assert importing.import_pages(
+                import_data, Page.objects.get(pk=destination.pk), bulk=bulk, checkpoint=2,
+                job=ImportJob.objects.get(pk=job.pk)) == 5
+            job.refresh_from_db()
+            assert job.completed
+            assert job.pages.count() == 5
+            assert self.get_tree(destination) == expected
+            Page.objects.get(slug='section').delete()
+
+    def test_interrupted_bulk_checkpointed_import_pages(self):
+        """a bulk checkpointed import which fails between its passes leaves base pages typed as Page until resumed"""
+        import_data = self.export_source_tree()
+        destination = self.create_destination('destination')
+        importing.import_pages(import_data, destination)
+        expected = self.get_tree(destination)
+        Page.objects.get(slug='section').delete()
+
+        destination.refresh_from_db()
+        job = ImportJob.objects.create(parent_page=destination)
+        with mock.patch.object(importing, 'bulk_create_specific_pages', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                importing.import_pages(import_data, destination, bulk=True, checkpoint=2, job=job)
+        job.refresh_from_db()
+        assert (job.base_pages_done, job.specific_pages_done) == (5, 0)
+        # the committed pages can all be served as they are
+        pages = Page.objects.descendant_of(destination)
+        assert [type(page) for page in pages.specific()] == [Page] * 5
+        assert pages.get(slug='second').specific.url_path == destination.url_path + 'section/second/'
+
+        assert importing.import_pages(
+            import_data, Page.objects.get(pk=destination.pk), bulk=True, checkpoint=2,
+            job=ImportJob.objects.get(pk=job.pk)) == 5
+        assert self.get_tree(destination) == expected
+        assert isinstance(Page.objects.get(slug='second').specific, TestPage)
+
+    def test_checkpointed_upsert_import_pages(self):
+        """
+        a checkpointed upsert which fails between its passes leaves the existing pages' types and live states
+        as they were, and keeps the other changes to the base pages when it is resumed
+        """
+        import_data = self.export_source_tree()
+        import_data['source'] = 'https://source.example/'
+        destination = self.create_destination('destination')
+        importing.import_pages(import_data, destination, upsert=True)
+
+        import_data = json.loads(json.dumps(import_data, cls=DjangoJSONEncoder))
+        import_data['pages'][3]['content']['title'] = "Second, revised"
+        import_data['pages'][3]['content']['live'] = False
+        broken_data = json.loads(json.dumps(import_data))
+        broken_data['pages'][3]['model'] = 'nosuchpage'
+        job = ImportJob.objects.create(parent_page=destination)
+        with self.assertRaises(LookupError):
+            importing.import_pages(broken_data, destination, checkpoint=2, job=job, upsert=True)
+        job.refresh_from_db()
+        assert (job.base_pages_done, job.specific_pages_done) == (5, 2)
+        second = Page.objects.get(slug='second')
+        assert isinstance(second.specific, TestPage)
+        assert second.live
+
+        assert importing.import_pages(
+            import_data, Page.objects.get(pk=destination.pk), checkpoint=2, job=ImportJob.objects.get(pk=job.pk),
+            upsert=True) == 5
+        second = Page.objects.get(slug='second').specific
+        assert isinstance(second, TestPage)
+        assert second.title == "Second, revised"
+        assert not second.live
+        assert Page.objects.descendant_of(destination).count() == 5
+
+    def export_forward_references_tree(self):
+        """Export a source tree with references to a specific page later in the tree, and from that page to itself"""
+        section = self.create_source_tree()
+        fourth = section.add_child(instance=TestPage(title="Fourth", slug="fourth"))
+        TestPage.objects.filter(slug='second').update(related_test_page=fourth)
+        TestPage.objects.filter(slug='fourth').update(related_test_page=fourth)
+        TestPageRelatedLink.objects.filter(title="First link").update(link_test_page=fourth)
+        import_data = {'pages': exporting.export_pages(root_page=section)}
+        section.delete()
+        self.home_page.refresh_from_db()
+        return import_data
+
+    def assert_forward_references(self):
+        fourth = TestPage.objects.get(slug='fourth')
+        second = TestPage.objects.get(slug='second')
+        assert second.related_test_page == fourth
+        assert second.related_links.get(title="First link").link_test_page == fourth
+        assert fourth.related_test_page == fourth
+
+    def test_import_forward_specific_page_references(self):
+        """foreign keys to specific pages later in the import, or to their own pages, are set once those pages exist"""
+        import_data = self.export_forward_references_tree()
+        destination = self.create_destination('destination')
+
+        for (bulk, checkpoint) in [(False, None), (True, None), (False, 2), (True, 2)]:
+            destination.refresh_from_db()
+            with CaptureQueriesContext(connection) as queries:
+                assert importing.import_pages(import_data, destination, bulk=bulk, checkpoint=checkpoint) == 6
+            self.assert_forward_references()
+            # the references were set after the pages were inserted
+            assert any(query['sql'].startswith('UPDATE "testapp_testpage"') for query in queries)
+            Page.objects.get(slug='section').delete()
+
+    def test_resume_forward_specific_page_references(self):
+        """a resumed checkpointed import sets the references deferred by the batches committed before it failed"""
+        import_data = self.export_forward_references_tree()
+        destination = self.create_destination('destination')
+        broken_data = json.loads(json.dumps(import_data, cls=DjangoJSONEncoder))
+        broken_data['pages'][5]['model'] = 'nosuchpage'
+
+        for bulk in (False, True):
+            destination.refresh_from_db()
+            job = ImportJob.objects.create(parent_page=destination)
+            with self.assertRaises(LookupError):
+                importing.import_pages(broken_data, destination, checkpoint=2, job=job)
+            job.refresh_from_db()
+            assert job.specific_pages_done == 4
+            # the references of the second page and of its link to the fourth, which is yet to be created
+            assert job.references.count() == 2
+
+            # the import can be resumed in bulk or not
+            importing.import_pages(
+                import_data, Page.objects.get(pk=destination.pk), bulk=bulk, checkpoint=2,
+                job=ImportJob.objects.get(pk=job.pk))
+            self.assert_forward_references()
+            assert not job.references.exists()
+            Page.objects.get(slug='section').delete()
+
+    def test_remap_child_objects(self):
+        """the inline child objects of many pages are remapped together, leaving references outside the import"""
+        new_pages = {1001: Page(id=101), 1002: Page(id=102)}
+        links = [
+            TestPageRelatedLink(pk=10, page_id=1001, link_page_id=1002),
+            TestPageRelatedLink(pk=11, page_id=1002, link_page_id=self.home_page.pk),
+        ]
+        importing.remap_child_objects(
+            {TestPageRelatedLink: links}, new_pages, importing.ModelPlanCache())
+        assert [(link.pk, link.page_id, link.link_page_id) for link in links] == [
+            (None, 101, 102), (None, 102, self.home_page.pk)]
+
+    def test_import_pages_model_plans(self):
+        """each model's import plan is worked out once per import and then reused"""
+        import_data = self.export_source_tree()
+        destination = self.create_destination('destination')
+        model_plans = importing.ModelPlanCache()
+
+        importing.import_pages(import_data, destination, model_plans=model_plans)
+        assert model_plans.misses == {
+            'wagtailcore.Page': 1, 'testapp.TestPage': 1, 'testapp.TestPageRelatedLink': 1}
+        # every further lookup of the four plain pages and the TestPage is a hit, and the related
+        # links of the TestPage are remapped together with one lookup
+        assert model_plans.hits['wagtailcore.Page'] >= 3
+        assert model_plans.hits['testapp.TestPage'] >= 1
+        assert model_plans.hits['testapp.TestPageRelatedLink'] == 0
+        plan = model_plans.get(TestPage)
+        assert 'related_page_id' in plan.page_fk_attnames
+        assert 'related_links' in plan.child_accessor_names
+        assert sorted(model_plans.get(TestPageRelatedLink).page_fk_attnames) == [
+            'link_page_id', 'link_test_page_id', 'page_id']
+
+
+class TestImportZip(ImportTestCase):
+    def test_import_zip(self):
+        """importing a content zip creates its images and snippets, and points the imported pages at them"""
+        collection = Collection.get_first_root_node().add_child(name="Exported")
+        image = ImageFactory(title="Very blue.", collection=collection)
+        with image.file.open('rb') as f:
+            image_bytes = f.read()
+        snippet = TestSnippet.objects.create(text="Hi, folks, Snippy here.")
+        section = self.create_source_tree()
+        TestPage.objects.filter(slug='second').update(image=image, snippet=snippet)
+        zip_data = exporting.zip_content({
+            'pages': exporting.iter_export_pages(root_page=section),
+            'snippets': exporting.export_snippets(),
+            'images': exporting.export_image_data(),
+        })
+        section.delete()
+        image.delete()
+        snippet.delete()
+        collection.delete()
+        self.home_page.refresh_from_db()
+
+        destination = self.create_destination('destination')
+        assert importing.import_zip(io.BytesIO(zip_data), destination) == 5
+        second = TestPage.objects.get(slug='second')
+        assert second.image.title == image.title
+        assert second.image.collection == Collection.get_first_root_node()
+        with second.image.file.open('rb') as f:
+            assert f.read() == image_bytes
+        assert second.snippet.text == snippet.text
+        assert get_image_model().objects.count() == 1
+        assert TestSnippet.objects.count() == 1
+        assert second.related_page.url_path == destination.url_path + 'section/first/'
+
+    def test_upsert_import_zip(self):
+        """upserting a content zip again updates the images and snippets it imported before rather than adding more"""
+        image = ImageFactory(title="Very blue.")
+        snippet = TestSnippet.objects.create(text="Hi, folks, Snippy here.")
+        section = self.create_source_tree()
+        TestPage.objects.filter(slug='second').update(image=image, snippet=snippet)
+        zip_data = exporting.zip_content({
+            'source': 'https://source.example/',
+            'pages': exporting.iter_export_pages(root_page=section),
+            'snippets': exporting.export_snippets(),
+            'images': exporting.export_image_data(),
+        })
+        section.delete()
+        image.delete()
+        snippet.delete()
+        self.home_page.refresh_from_db()
+
+        destination = self.create_destination('destination')
+        assert importing.import_zip(io.BytesIO(zip_data), destination, upsert=True) == 5
+        (new_image, new_snippet) = (get_image_model().objects.get(), TestSnippet.objects.get())
+        TestSnippet.objects.update(text="Edited")
+        assert importing.import_zip(io.BytesIO(zip_data), Page.objects.get(pk=destination.pk), upsert=True) == 5
+        assert TestSnippet.objects.get().pk == new_snippet.pk
+        assert TestSnippet.objects.get().text == snippet.text
+        assert get_image_model().objects.get().pk == new_image.pk
+        # the unchanged file is kept rather than stored again
+        assert get_image_model().objects.get().file.name == new_image.file.name
+        second = TestPage.objects.get(slug='second')
+        assert (second.image, second.snippet) == (new_image, new_snippet)
+        assert Page.objects.descendant_of(destination).count() == 5
+
+    def test_import_zip_rewrites_ids_in_content(self):
+        """the ids of imported images and snippets in chooser blocks and rich text embeds are rewritten too"""
+        image = ImageFactory(title="Very blue.")
+        snippet = TestSnippet.objects.create(text="Hi, folks, Snippy here.")
+        section = self.create_source_tree()
+        second = TestPage.objects.get(slug='second')
+        second.body = json.dumps([
+            {'type': 'snippet', 'value': snippet.pk},
+            {'type': 'image', 'value': image.pk},
+            {'type': 'paragraph', 'value': '<p><embed alt="Blue" embedtype="image" format="left" id="%d"/></p>'
+                                           '<p><a linktype="page" id="%d">Home</a></p>' % (image.pk, self.home_page.pk)},
+        ])
+        second.save()
+        zip_data = exporting.zip_content({
+            'pages': exporting.iter_export_pages(root_page=section),
+            'snippets': exporting.export_snippets(),
+            'images': exporting.export_image_data(),
+        })
+        # the image and snippet are kept, so that those imported are given new ids
+        section.delete()
+        self.home_page.refresh_from_db()
+
+        destination = self.create_destination('destination')
+        assert importing.import_zip(io.BytesIO(zip_data), destination) == 5
+        new_image = get_image_model().objects.exclude(pk=image.pk).get()
+        new_snippet = TestSnippet.objects.exclude(pk=snippet.pk).get()
+        second = TestPage.objects.get(slug='second')
+        assert second.body[0].value == new_snippet
+        assert second.body[1].value == new_image
+        assert second.body[2].value.source == (
+            '<p><embed alt="Blue" embedtype="image" format="left" id="%d"/></p>'
+            '<p><a linktype="page" id="%d">Home</a></p>' % (new_image.pk, self.home_page.pk))
+
+    def test_import_snippets_in_batches(self):
+        """snippets are taken from their records and inserted a batch at a time"""
+        inserted_counts = []
+
+        def iter_records():
+            for i in range(5):
+                # the number of snippets inserted by the time each record is taken
+                inserted_counts.append(TestSnippet.objects.count())
+                yield {'id': 100 + i, 'text': "Snippet %d" % i}
+
+        model_plans = importing.ModelPlanCache()
+        importing.import_snippets([('testapp.TestSnippet', iter_records())], model_plans, batch_size=2)
+        assert inserted_counts == [0, 0, 2, 2, 4]
+        remapped_ids = model_plans.remapped_ids[TestSnippet]
+        assert TestSnippet.objects.get(pk=remapped_ids[104]).text == "Snippet 4"
+
+    def test_import_multi_table_snippets(self):
+        """snippets of a model with multi-table inheritance, which can't be inserted in bulk, are created one by one"""
+        for i in range(3):
+            TestInheritedSnippet.objects.create(text="Snippet %d" % i, extra_text="Extra %d" % i)
+        snippet_items = [
+            (model_key, json.loads(json.dumps(list(records), cls=DjangoJSONEncoder)))
+            for (model_key, records) in exporting.export_snippets(models=[TestInheritedSnippet]).items()]
+        original_ids = list(TestInheritedSnippet.objects.order_by('pk').values_list('pk', flat=True))
+        TestSnippetBase.objects.all().delete()
+
+        model_plans = importing.ModelPlanCache()
+        object_matcher = importing.ObjectMatcher('https://source.example/')
+        # as on a database which returns the ids of bulk inserts, such as PostgreSQL
+        with mock.patch.object(connection.features, 'can_return_rows_from_bulk_insert', True, create=True):
+            importing.import_snippets(snippet_items, model_plans, batch_size=2, object_matcher=object_matcher)
+        remapped_ids = model_plans.remapped_ids[TestInheritedSnippet]
+        assert [(snippet.text, snippet.extra_text) for snippet in TestInheritedSnippet.objects.filter(
+            pk__in=[remapped_ids[original_id] for original_id in original_ids]).order_by('pk')] == [
+            ("Snippet %d" % i, "Extra %d" % i) for i in range(3)]
+
+        # and are updated, in both of their tables, when they are upserted again
+        TestInheritedSnippet.objects.update(extra_text="Edited")
+        TestSnippetBase.objects.update(text="Edited")
+        importing.import_snippets(snippet_items, importing.ModelPlanCache(), batch_size=2,
+                                  object_matcher=importing.ObjectMatcher('https://source.example/'))
+        assert TestSnippetBase.objects.count() == 3
+        assert [(snippet.text, snippet.extra_text) for snippet in TestInheritedSnippet.objects.order_by('pk')] == [
+            ("Snippet %d" % i, "Extra %d" % i) for i in range(3)]
+
+    def test_import_content_addressed_zip(self):
+        """images in a content addressed zip are mapped to existing images with the same file, or else created once"""
+        ImageFactory(title="Blue")
+        ImageFactory(title="Also blue")
+        red = ImageFactory(title="Red", file__color='red')
+        with red.file.open('rb') as f:
+            red_bytes = f.read()
+        section = self.create_source_tree()
+        TestPage.objects.filter(slug='second').update(image=red)
+        # the destination site's hashes are saved by listing them with the imagehashes command
+        for image in get_image_model().objects.all():
+            image.get_file_hash()
+        image_data = list(exporting.export_image_data(content_addressed=True))
+        (blue_hash, _, red_hash) = [image_def['file']['hash'] for image_def in image_data]
+        zip_data = exporting.zip_content({
+            'pages': exporting.export_pages(root_page=section),
+            'snippets': {},
+            'images': image_data,
+        }, known_hashes={blue_hash})
+        section.delete()
+        red.delete()
+        self.home_page.refresh_from_db()
+
+        destination = self.create_destination('destination')
+        assert importing.import_zip(io.BytesIO(zip_data), destination) == 5
+        # the blue images are mapped to an existing one, and the red one is created again
+        assert get_image_model().objects.count() == 3
+        second = TestPage.objects.get(slug='second')
+        assert second.image.title == "Red"
+        assert second.image.file_hash == red_hash
+        with second.image.file.open('rb') as f:
+            assert f.read() == red_bytes
+
+        get_image_model().objects.filter(file_hash=blue_hash).delete()
+        Page.objects.get(slug='section').delete()
+        with self.assertRaises(LookupError):
+            importing.import_zip(io.BytesIO(zip_data), Page.objects.get(pk=destination.pk))
@@ -0,0 +1,144 @@
+import datetime
+import io
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.test import SimpleTestCase
+from wagtailimportexport.jsonstream import (
+    IncompleteJSONError, JSONArrayReader, iter_json, iter_json_array, iter_json_object_arrays)
+
+
+def make_data():
+    return {
+        'pages': ({'title': "Page %d" % i, 'tags': [i, {'nested': []}]} for i in range(3)),
+        'snippets': {
+            'testapp.TestSnippet': iter([{'text': "Snippy"}]),
+            'testapp.Empty': iter([]),
+        },
+        'images': [],
+        'exported_at': datetime.datetime(2019, 4, 24, 19, 28),
+    }
+
+
+class TestIterJSON(SimpleTestCase):
+    def test_indented_output_matches_json_dumps(self):
+        """iterating JSON with an indent produces the same text as json.dumps"""
+        expected_data = make_data()
+        expected_data['pages'] = list(expected_data['pages'])
+        expected_data['snippets'] = {key: list(value) for (key, value) in expected_data['snippets'].items()}
+        expected = json.dumps(expected_data, indent=2, cls=DjangoJSONEncoder)
+
+        pieces = list(iter_json(make_data(), indent=2))
+        assert len(pieces) > 1
+        assert ''.join(pieces) == expected
+
+    def test_compact_output(self):
+        """iterating JSON without an indent produces JSON text without whitespace"""
+        text = ''.join(iter_json(make_data()))
+        assert '\n' not in text
+        assert ', ' not in text
+        assert json.loads(text)['snippets'] == {'testapp.TestSnippet': [{'text': "Snippy"}], 'testapp.Empty': []}
+        assert len(json.loads(text)['pages']) == 3
+
+
+class TestIterJSONArray(SimpleTestCase):
+    def make_file(self, indent=2):
+        data = {
+            'snippets': {'testapp.TestSnippet': [{'text': "Snippy [1]"}], 'testapp.Empty': []},
+            'images': [],
+            'pages': [
+                {'title': "Pâge %d \u2603 \\\"]" % i, 'pk': 12345678 + i, 'ratio': 1.5e-3, 'live': i % 2 == 0,
+                 'owner': None, 'tags': [i, {'nested': []}]}
+                for i in range(20)
+            ],
+            'exported_at': "2019-04-24T19:28:00",
+        }
+        return (data, io.BytesIO(json.dumps(data, indent=indent).encode('utf-8-sig')))
+
+    def test_parses_array_items(self):
+        """the items of the array are parsed one at a time from any chunk size, skipping the other keys"""
+        for indent in (2, None):
+            for chunk_size in (1, 3, 7, 64 * 1024):
+                (data, fp) = self.make_file(indent)
+                items = iter_json_array(fp, 'pages', chunk_size=chunk_size)
+                assert next(items) == data['pages'][0]
+                # only as much of the file as is needed is read
+                assert chunk_size > 1000 or fp.tell() < len(fp.getvalue()) / 2
+                assert [data['pages'][0]] + list(items) == data['pages']
+                fp.seek(0)
+                assert list(iter_json_array(fp, 'images', chunk_size=chunk_size)) == []
+                # the values passed over on the way to the array can be kept
+                fp.seek(0)
+                values = {}
+                assert list(iter_json_array(fp, 'pages', chunk_size=chunk_size, values=values)) == data['pages']
+                assert values == {'snippets': data['snippets'], 'images': []}
+
+    def test_missing_key_and_invalid_json(self):
+        """a missing key raises KeyError, malformed JSON raises JSONDecodeError and cut off JSON IncompleteJSONError"""
+        (data, fp) = self.make_file()
+        with self.assertRaises(KeyError):
+            list(iter_json_array(fp, 'documents', chunk_size=5))
+        with self.assertRaises(KeyError):
+            list(iter_json_array(io.BytesIO(b'{}'), 'pages'))
+        for text in (b'', b'{"pages": [{"title": "Cut off"', b'{"pages": [1, 2'):
+            with self.assertRaises(IncompleteJSONError):
+                list(iter_json_array(io.BytesIO(text), 'pages', chunk_size=4))
+        for text in (b'[]', b'{"pages": [1 2]}'):
+            with self.assertRaises(json.JSONDecodeError) as cm:
+                list(iter_json_array(io.BytesIO(text), 'pages', chunk_size=4))
+            assert not isinstance(cm.exception, IncompleteJSONError)
+        # malformed JSON is found without reading the rest of the file
+        fp = io.BytesIO(b'{"pages": [{"live": tru, "title": "' + b'x' * 100000 + b'"}]}')
+        with self.assertRaises(json.JSONDecodeError) as cm:
+            list(iter_json_array(fp, 'pages', chunk_size=16))
+        assert not isinstance(cm.exception, IncompleteJSONError)
+        assert fp.tell() < 1000
+
+    def test_parses_large_items(self):
+        """an item much larger than the chunk size is read in a number of chunks in proportion to the log of its size"""
+        data = {'pages': [{'body': "x" * 1000000}, {'title': "Small"}]}
+        fp = io.BytesIO(json.dumps(data).encode('utf-8'))
+        sizes = []
+        read = fp.read
+        fp.read = lambda size: sizes.append(size) or read(size)
+        assert list(iter_json_array(fp, 'pages', chunk_size=1024)) == data['pages']
+        assert len(sizes) < 20
+
+    def test_parses_object_arrays(self):
+        """the arrays of an object are parsed one item at a time, passing over those which aren't iterated"""
+        snippets = {
+            'testapp.TestSnippet': [{'text': "Snippet %d" % i} for i in range(50)],
+            'testapp.Skipped': [{'text': "Skipped [%d]" % i} for i in range(3)],
+            'testapp.Empty': [],
+            'testapp.Last': [{'text': "Last"}],
+        }
+        fp = io.BytesIO(json.dumps({'pages': [], 'snippets': snippets}).encode('utf-8'))
+        members = iter_json_object_arrays(fp, 'snippets', chunk_size=16)
+        (name, items) = next(members)
+        assert (name, next(items)) == ('testapp.TestSnippet', snippets['testapp.TestSnippet'][0])
+        assert fp.tell() < len(fp.getvalue()) / 2
+        assert [snippets[name][0]] + list(items) == snippets[name]
+        assert next(members)[0] == 'testapp.Skipped'
+        assert [(name, list(items)) for (name, items) in members] == [
+            ('testapp.Empty', []), ('testapp.Last', [{'text': "Last"}])]
+
+    def test_reader_can_be_iterated_again(self):
+        """a JSONArrayReader parses the file from the start each time it is iterated"""
+        (data, fp) = self.make_file()
+        reader = JSONArrayReader(fp, 'pages', chunk_size=100)
+        assert list(reader) == data['pages']
+        assert list(reader) == data['pages']
+
+    def test_reader_opens_file_again(self):
+        """a JSONArrayReader of a function which opens the file opens it again each time it is iterated"""
+        (data, fp) = self.make_file()
+        content = fp.getvalue()
+        opened = []
+
+        def open_file():
+            opened.append(io.BytesIO(content))
+            return opened[-1]
+        reader = JSONArrayReader(open_file, 'pages', chunk_size=100)
+        assert list(reader) == data['pages']
+        assert list(reader) == data['pages']
+        assert len(opened) == 2
+        assert all(f.closed for f in opened)
@@ -0,0 +1,240 @@
+import gzip
+import json
+import warnings
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.serializers.json import DjangoJSONEncoder
+from django.contrib.contenttypes.models import ContentType
+from django.test import LiveServerTestCase, RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from wagtail.images import get_image_model
+from wagtail_factories import ImageFactory
+from wagtailimportexport.client import ExportAPIClient
+from wagtailimportexport.compat import Page
+from wagtailimportexport import exporting, views
+from wagtailimportexport.tests import test_client
+from testapp.models import TestPage, TestSnippet
+
+
+class TestExportAPI(TestCase):
+    def setUp(self):
+        self.section = Page(title="Section", slug="section")
+        Page.objects.get(depth=2).add_child(instance=self.section)
+        for i in range(4):
+            self.section.add_child(instance=Page(title="Child %d" % i, slug="child-%d" % i))
+        self.factory = RequestFactory()
+
+    def get(self, params=None, **headers):
+        return views.export(self.factory.get('/export/%d/' % self.section.pk, params, **headers), self.section.pk)
+
+    def get_pages(self, response):
+        content = b''.join(response.streaming_content)
+        if response.get('Content-Encoding') == 'gzip':
+            content = gzip.decompress(content)
+        return json.loads(content.decode('utf-8'))['pages']
+
+    def test_export_in_parts(self):
+        """the export can be fetched a part at a time, after the path of the last page of the previous part"""
+        expected = json.loads(json.dumps({'pages': exporting.export_pages(root_page=self.section)},
+                                         cls=DjangoJSONEncoder))['pages']
+        pages = []
+        params = {'limit': 2}
+        while True:
+            part = self.get_pages(self.get(params))
+            pages.extend(part)
+            if len(part) < 2:
+                break
+            params['after'] = part[-1]['content']['path']
+        assert pages == expected
+        assert len(pages) == 5
+
+        assert self.get({'limit': 'all'}).status_code == 400
+
+    def test_export_gzip(self):
+        """the export is compressed with gzip if the client accepts it"""
+        response = self.get(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        assert response['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response['Vary']
+        assert len(self.get_pages(response)) == 5
+
+        response = self.get(HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+        assert not response.has_header('Content-Encoding')
+        assert len(self.get_pages(response)) == 5
+
+    def test_export_etag(self):
+        """an unchanged export is not sent again, until a page in it has a new revision"""
+        response = self.get()
+        etag = response['ETag']
+        assert self.get({'limit': 2})['ETag'] != etag
+
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+
+        child = Page.objects.get(slug='child-2')
+        child.title = "Changed"
+        child.save_revision().publish()
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response['ETag'] != etag
+        assert "Changed" in [page['content']['title'] for page in self.get_pages(response)]
+
+    def test_export_since(self):
+        """?since= exports the pages changed since a timestamp, in the current time zone unless it has one"""
+        since = timezone.now()
+        Page.objects.update(last_published_at=since, latest_revision_created_at=None)
+        Page.objects.get(slug='child-2').save_revision().publish()
+        with warnings.catch_warnings():
+            # comparing naive timestamps with aware ones warns
+            warnings.simplefilter('error', RuntimeWarning)
+            for value in (since.isoformat(), timezone.make_naive(since).isoformat()):
+                assert [page['content']['slug'] for page in self.get_pages(self.get({'since': value}))] == [
+                    'section', 'child-2']
+
+        assert self.get({'since': 'yesterday'}).status_code == 400
+        assert self.get({'since': '2020-13-01T00:00:00'}).status_code == 400
+
+    def test_export_etag_publish_draft(self):
+        """publishing a draft saved earlier changes the export, and so its tag"""
+        child = Page.objects.get(slug='child-2')
+        child.title = "Draft"
+        revision = child.save_revision()
+        response = self.get()
+        etag = response['ETag']
+        assert "Draft" not in [page['content']['title'] for page in self.get_pages(response)]
+
+        revision.publish()
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response['ETag'] != etag
+        assert "Draft" in [page['content']['title'] for page in self.get_pages(response)]
+
+
+class AdminViewTestMixin:
+    def setUp(self):
+        self.home_page = Page.objects.get(depth=2)
+        self.section = Page(title="Section", slug="section")
+        self.home_page.add_child(instance=self.section)
+        for i in range(3):
+            self.section.add_child(instance=Page(title="Child %d" % i, slug="child-%d" % i))
+        self.destination = Page(title="Destination", slug="destination")
+        self.home_page.add_child(instance=self.destination)
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    def post(self, view_name, data):
+        """Post data to an admin view which redirects to the explorer page of the destination, and return its messages"""
+        response = self.client.post(reverse(view_name), data, follow=True)
+        assert response.redirect_chain == [(reverse('wagtailadmin_explore', args=[self.destination.pk]), 302)]
+        return [str(message) for message in response.context['messages']]
+
+    def import_file(self, name, content, **data):
+        data.update(file=SimpleUploadedFile(name, content), parent_page=self.destination.pk)
+        return self.post('wagtailimportexport_admin:import_from_file', data)
+
+
+class TestImportFromFile(AdminViewTestMixin, TestCase):
+    def test_import_json(self):
+        """an uploaded JSON export is imported under the parent page, and updates those pages when imported again"""
+        content = json.dumps({
+            'source': exporting.get_export_source(),
+            'pages': exporting.export_pages(root_page=self.section),
+        }, cls=DjangoJSONEncoder).encode('utf-8')
+
+        (message,) = self.import_file('content.json', content)
+        assert "4 pages imported." in message
+        imported_section = Page.objects.child_of(self.destination).get()
+        assert [page.title for page in imported_section.get_children()] == ["Child 0", "Child 1", "Child 2"]
+
+        Page.objects.filter(pk=imported_section.get_children().get(slug='child-1').pk).update(title="Changed")
+        (message,) = self.import_file('content.json', content, update_existing='on')
+        assert "4 pages imported." in message
+        assert Page.objects.child_of(self.destination).get().pk == imported_section.pk
+        assert [page.title for page in imported_section.get_children()] == ["Child 0", "Child 1", "Child 2"]
+
+        (message,) = self.import_file('content.json', b'{"pages": [')
+        assert "Import failed: " in message
+
+    def test_export_and_import_zip(self):
+        """a zip downloaded from export_to_file can be uploaded again, with its images and snippets"""
+        image = ImageFactory(title="Very blue.")
+        snippet = TestSnippet.objects.create(text="Hi, folks, Snippy here.")
+        self.section.add_child(instance=TestPage(title="Specific", slug="specific", image=image, snippet=snippet))
+        response = self.client.post(reverse('wagtailimportexport_admin:export_to_file'), {
+            'root_page': self.section.pk,
+            'export_unpublished': 'on',
+            'null_users': 'on',
+            'snippets': 'all',
+        })
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'application/zip'
+        assert response['Content-Disposition'] == 'attachment; filename="content.zip"'
+        content = b''.join(response.streaming_content)
+        self.section.delete()
+        image.delete()
+        snippet.delete()
+
+        (message,) = self.import_file('content.zip', content)
+        assert "5 pages imported." in message
+        imported_section = Page.objects.child_of(self.destination).get()
+        assert [page.title for page in imported_section.get_children()] == [
+            "Child 0", "Child 1", "Child 2", "Specific"]
+        specific = TestPage.objects.get(slug='specific')
+        assert specific.image == get_image_model().objects.get()
+        assert specific.image.title == image.title
+        assert specific.snippet == TestSnippet.objects.get()
+        assert specific.snippet.text == snippet.text
+
+
+def receive_records(client):
+    """
+    Receive every record when the first is taken, before the import begins, rather than in the
+    background as it goes on, as the live server reads the pages from the same SQLite database
+    which the import locks
+    """
+    records = list(client.iter_records())
+    yield from records
+
+
+@override_settings(WAGTAILIMPORTEXPORT_API_PAGE_LIMIT=2)
+class TestImportFromAPI(AdminViewTestMixin, LiveServerTestCase):
+    def setUp(self):
+        # the site's initial pages are flushed after each live server test case, so they are
+        # created again if another one has run first
+        if not Page.objects.exists():
+            Page.add_root(instance=Page(title="Root", slug="root")).add_child(
+                instance=Page(title="Home", slug="home"))
+        super().setUp()
+
+    def tearDown(self):
+        # Django 2.0 creates permissions again after the flush from the content types it has
+        # cached, which the flush has deleted
+        ContentType.objects.clear_cache()
+
+    @mock.patch.object(ExportAPIClient, 'prefetch_records', receive_records)
+    def test_import_from_api(self):
+        """the pages exported by the source site's API are imported a part at a time under the parent page"""
+        data = {
+            'source_page_id': self.section.pk,
+            'source_site_base_url': self.live_server_url + '/',
+            'parent_page': self.destination.pk,
+        }
+        # the first part is cut off after its last record, which leaves none of it to request again
+        adapter = test_client.FlakyAdapter(['cut-off-at-end'])
+        with mock.patch('wagtailimportexport.client.HTTPAdapter', return_value=adapter):
+            (message,) = self.post('wagtailimportexport_admin:import_from_api', data)
+        assert "4 pages imported." in message
+        assert adapter.request_count == 3
+        imported_section = Page.objects.child_of(self.destination).get()
+        assert [page.title for page in imported_section.get_children()] == ["Child 0", "Child 1", "Child 2"]
+
+        Page.objects.filter(pk=imported_section.get_children().get(slug='child-1').pk).update(title="Changed")
+        data['update_existing'] = 'on'
+        (message,) = self.post('wagtailimportexport_admin:import_from_api', data)
+        assert "4 pages imported." in message
+        assert Page.objects.child_of(self.destination).get().pk == imported_section.pk
+        assert [page.title for page in imported_section.get_children()] == ["Child 0", "Child 1", "Child 2"]
+
+        data['source_page_id'] = self.destination.pk + 1000
+        (message,) = self.post('wagtailimportexport_admin:import_from_api', data)
+        assert "Import failed: " in message
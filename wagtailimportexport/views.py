@@ -1,23 +1,37 @@
-import io
+import hashlib
 import json
 import re
+import zipfile
+from itertools import chain, islice
 
-from django.http import JsonResponse, FileResponse
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Max
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect, render
 from django.urls import reverse
+from django.utils.cache import patch_vary_headers
 from django.utils.translation import ungettext, ugettext_lazy as _
+from django.views.decorators.http import condition
 
 import requests
 
+from wagtailimportexport.client import ExportAPIClient, SpooledRecords
 from wagtailimportexport.compat import messages, Page
 from wagtailimportexport.exporting import (
-    export_pages,
+    CONTENT_ENCODINGS,
     export_snippets,
     export_image_data,
-    zip_content,
+    get_export_source,
+    iter_export_pages,
+    iter_json_content,
+    iter_zip_content,
+    parse_timestamp,
 )
 from wagtailimportexport.forms import ExportForm, ImportFromAPIForm, ImportFromFileForm
-from wagtailimportexport.importing import import_pages
+from wagtailimportexport.importing import get_import_source, import_pages, import_zip
+from wagtailimportexport.jsonstream import JSONArrayReader
+from wagtailimportexport.references import ExportReferences
 
 
 def index(request):
@@ -42,13 +56,27 @@ def import_from_api(request):
             import_url = (base_url + reverse(
                 'wagtailimportexport:export',
                 args=[form.cleaned_data['source_page_id']]))
-            r = requests.get(import_url)
-            import_data = r.json()
+            client = ExportAPIClient(import_url)
+            records = client.prefetch_records()
             parent_page = form.cleaned_data['parent_page']
 
             try:
-                page_count = import_pages(import_data, parent_page)
-            except LookupError as e:
+                # the export names its source site ahead of its pages, so the first record is awaited
+                # to find it; the base url stands in for it in exports which don't
+                first_records = list(islice(records, 1))
+                import_data = {
+                    'source': client.source or base_url,
+                    # the page records are imported as they arrive, and spooled for the second pass
+                    'pages': SpooledRecords(chain(first_records, records)),
+                }
+                try:
+                    page_count = import_pages(
+                        import_data, parent_page, upsert=form.cleaned_data['update_existing'],
+                        bulk=getattr(settings, 'WAGTAILIMPORTEXPORT_BULK_IMPORT', False)
+                        and not form.cleaned_data['update_existing'])
+                finally:
+                    import_data['pages'].close()
+            except (LookupError, json.JSONDecodeError, requests.RequestException) as e:
                 messages.error(request,
                                _("Import failed: %(reason)s") % {'reason': e})
             else:
@@ -68,8 +96,9 @@ def import_from_api(request):
 
 def import_from_file(request):
     """
-    Import a part of a source site's page tree via an import of a JSON file
-    exported to a user's filesystem from the source site's Wagtail Admin
+    Import a part of a source site's page tree via an import of a JSON file,
+    or of a ZIP file along with images and snippets, exported to a user's
+    filesystem from the source site's Wagtail Admin
 
     The source site's base url and the source page id of the point in the
     tree to import defined what to import and the destination parent page
@@ -78,13 +107,23 @@ def import_from_file(request):
     if request.method == 'POST':
         form = ImportFromFileForm(request.POST, request.FILES)
         if form.is_valid():
-            import_data = json.loads(
-                form.cleaned_data['file'].read().decode('utf-8-sig'))
+            import_file = form.cleaned_data['file']
             parent_page = form.cleaned_data['parent_page']
+            upsert = form.cleaned_data['update_existing']
+            bulk = getattr(settings, 'WAGTAILIMPORTEXPORT_BULK_IMPORT', False) and not upsert
 
             try:
-                page_count = import_pages(import_data, parent_page)
-            except LookupError as e:
+                if zipfile.is_zipfile(import_file):
+                    # a content.zip from export_to_file, with images and snippets
+                    page_count = import_zip(import_file, parent_page, bulk=bulk, upsert=upsert)
+                else:
+                    # the page records are parsed from the upload one at a time as they are imported
+                    import_data = {
+                        'source': get_import_source(import_file),
+                        'pages': JSONArrayReader(import_file, 'pages'),
+                    }
+                    page_count = import_pages(import_data, parent_page, bulk=bulk, upsert=upsert)
+            except (LookupError, json.JSONDecodeError) as e:
                 messages.error(request,
                                _("Import failed: %(reason)s") % {'reason': e})
             else:
@@ -111,20 +150,25 @@ def export_to_file(request):
     if request.method == 'POST':
         form = ExportForm(request.POST)
         if form.is_valid():
+            pages = iter_export_pages(
+                root_page=form.cleaned_data['root_page'],
+                export_unpublished=form.cleaned_data['export_unpublished'],
+                null_users=form.cleaned_data['null_users'],
+            )
+            references = None
+            if form.cleaned_data['snippets'] == 'referenced':
+                # the snippets are noted as the pages are written, ahead of them
+                references = ExportReferences()
+                pages = references.collect(pages)
             content_data = {
-                'pages': export_pages(
-                    root_page=form.cleaned_data['root_page'],
-                    export_unpublished=form.cleaned_data['export_unpublished'],
-                    null_users=form.cleaned_data['null_users'],
-                ),
-                'snippets': export_snippets(),
+                'source': get_export_source(),
+                'pages': pages,
+                'snippets': export_snippets(models=form.cleaned_data['snippet_models'], references=references),
                 'images': export_image_data(null_users=form.cleaned_data['null_users']),
             }
-            filedata = zip_content(content_data)
-            payload = io.BytesIO(filedata)
-            response = FileResponse(payload)
+            response = StreamingHttpResponse(
+                iter_zip_content(content_data), content_type='application/zip')
             response['Content-Disposition'] = 'attachment; filename="content.zip"'
-            response.content_type = 'application/zip'
             return response
     else:
         form = ExportForm()
@@ -134,25 +178,96 @@ def export_to_file(request):
     })
 
 
+def _get_export_root(page_id, export_unpublished):
+    pages = Page.objects.all() if export_unpublished else Page.objects.filter(live=True)
+    return pages.filter(id=page_id).first()
+
+
+def _export_etag(request, page_id, export_unpublished=False):
+    """
+    Tag the export of a part of the page tree by the latest revision and
+    publication within it and by its size and extent, so that the export is
+    only generated again once some page in it has changed
+    """
+    root_page = _get_export_root(page_id, export_unpublished)
+    if root_page is None:
+        return None
+    pages = Page.objects.descendant_of(root_page, inclusive=True)
+    if not export_unpublished:
+        pages = pages.filter(live=True)
+    tree_state = pages.aggregate(
+        latest_revision_created_at=Max('latest_revision_created_at'), last_published_at=Max('last_published_at'),
+        count=Count('pk'), last_path=Max('path'))
+    key = json.dumps(
+        [page_id, export_unpublished, request.GET.get('after'), request.GET.get('limit'),
+         request.GET.get('since'), tree_state],
+        cls=DjangoJSONEncoder)
+    # weak, as the same export may be sent with different content encodings
+    return 'W/"%s"' % hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _get_content_encoding(request):
+    """Return the preferred one of CONTENT_ENCODINGS which is acceptable to the client, if any"""
+    accepted = set()
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        (coding, sep, params) = item.partition(';')
+        (name, sep, value) = params.partition('=')
+        try:
+            if name.strip() == 'q' and float(value) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(coding.strip().lower())
+    for content_encoding in CONTENT_ENCODINGS:
+        if content_encoding in accepted:
+            return content_encoding
+    return None
+
+
+@condition(etag_func=_export_etag)
 def export(request, page_id, export_unpublished=False):
     """
     API endpoint of this source site to export a part of the page tree
     rooted at page_id
 
     Requests are made by a destination site's import_from_api view.
+
+    The pages can be fetched a part at a time, by limit pages at a time
+    after the path of the last page of the previous part: the pages of
+    ?limit=N&after=<path> follow those of ?limit=N; a part with fewer
+    than N pages is the last. ?since=<timestamp> exports only the pages
+    published or revised since then, with their ancestors.
+
+    The response is streamed, compressed with gzip or zstd if the client
+    accepts it, and tagged so that unchanged parts of the tree aren't
+    exported again.
     """
-    try:
-        if export_unpublished:
-            root_page = Page.objects.get(id=page_id)
-        else:
-            root_page = Page.objects.get(id=page_id, live=True)
-    except Page.DoesNotExist:
+    root_page = _get_export_root(page_id, export_unpublished)
+    if root_page is None:
         return JsonResponse({'error': _('page not found')})
+    limit = request.GET.get('limit')
+    if limit is not None:
+        if not limit.isdigit() or int(limit) < 1:
+            return JsonResponse({'error': _('limit must be a positive integer')}, status=400)
+        limit = int(limit)
+    since = request.GET.get('since')
+    if since is not None:
+        try:
+            since = parse_timestamp(since)
+        except ValueError:
+            return JsonResponse({'error': _('since must be an ISO 8601 timestamp')}, status=400)
 
     payload = {
-        'pages':
-        export_pages(
-            root_page=root_page, export_unpublished=export_unpublished)
+        'source': get_export_source(),
+        'pages': iter_export_pages(
+            root_page=root_page, export_unpublished=export_unpublished,
+            after=request.GET.get('after'), limit=limit, since=since)
     }
 
-    return JsonResponse(payload)
+    content_encoding = _get_content_encoding(request)
+    response = StreamingHttpResponse(
+        iter_json_content(payload, content_encoding), content_type='application/json')
+    if content_encoding is not None:
+        response['Content-Encoding'] = content_encoding
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
@@ -0,0 +1,16 @@
+import django
+from django.conf import settings
+
+
+def setup_export_worker(database_names):
+    """
+    Set up Django in a worker process of a parallel export, connected to
+    the databases of the exporting process by their names there, which
+    differ from the settings' when it is connected to test databases
+
+    This module imports no models, as the workers import it to find this
+    function before Django is set up.
+    """
+    for (alias, name) in database_names.items():
+        settings.DATABASES[alias]['NAME'] = name
+    django.setup()